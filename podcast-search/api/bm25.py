@@ -0,0 +1,256 @@
+import heapq
+import math
+import re
+from array import array
+from collections import Counter
+from typing import Collection, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import utils
+
+# Okapi BM25 term frequency saturation and document length normalization
+K1 = 1.2
+B = 0.75
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being below between
+both but by can could did do does doing down during each few for from further had has have having he
+her here hers him his how i if in into is it its itself just me more most my no nor not now of off on
+once only or other our ours out over own same she should so some such than that the their theirs them
+then there these they this those through to too under until up very was we were what when where which
+while who whom why will with would you your yours
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase word tokens, dropping stopwords.
+
+    Args:
+        text (str): Text to tokenize
+    Returns:
+        list: Tokens in document order
+
+    Examples:
+        >>> tokenize("Learn about Strategy!")
+        ['learn', 'strategy']
+    """
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Inverted index over the episode text fields, scored with Okapi BM25.
+
+    Postings are stored in flat arrays (CSR layout): the postings of term `t`
+    are `doc_ids[offsets[t]:offsets[t + 1]]` with matching `term_freqs`.
+    Document ids are positions in the episode list the index was built from.
+    """
+
+    def __init__(self, vocabulary: Dict[str, int], offsets: array, doc_ids: array,
+                 term_freqs: array, doc_lengths: array):
+        self.vocabulary = vocabulary
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.num_docs = len(doc_lengths)
+        self.avg_doc_length = (sum(doc_lengths) / self.num_docs) if self.num_docs else 0.0
+
+    @classmethod
+    def build(cls, documents: Iterable[str]) -> "BM25Index":
+        """
+        Build an index from document texts.
+
+        Args:
+            documents: Text of each document, in document id order
+        Returns:
+            BM25Index: The built index
+        """
+        vocabulary: Dict[str, int] = {}
+        postings: List[List[Tuple[int, int]]] = []
+        doc_lengths = array("I")
+        for doc_id, text in enumerate(documents):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, freq in Counter(tokens).items():
+                term_id = vocabulary.setdefault(term, len(vocabulary))
+                if term_id == len(postings):
+                    postings.append([])
+                postings[term_id].append((doc_id, freq))
+
+        offsets = array("Q", [0])
+        doc_ids = array("I")
+        term_freqs = array("I")
+        for term_postings in postings:
+            for doc_id, freq in term_postings:
+                doc_ids.append(doc_id)
+                term_freqs.append(freq)
+            offsets.append(len(doc_ids))
+        return cls(vocabulary, offsets, doc_ids, term_freqs, doc_lengths)
+
+    @classmethod
+    def from_episodes(cls, episodes: Iterable[Mapping]) -> "BM25Index":
+        """
+        Build an index over the title, summary and content fields of flattened episodes.
+        """
+        return cls.build(utils.episode_text(episode) for episode in episodes)
+
+    def idf(self, doc_freq: int) -> float:
+        return math.log(1 + (self.num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    def scores(self, query: str) -> Dict[int, float]:
+        """
+        Score every document sharing at least one term with the query.
+
+        Args:
+            query (str): Free text query
+        Returns:
+            dict: BM25 score by document id
+        """
+        scores: Dict[int, float] = {}
+        if not self.num_docs:
+            return scores
+        length_norm = K1 / self.avg_doc_length if self.avg_doc_length else 0.0
+        for term in set(tokenize(query)):
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            idf = self.idf(end - start)
+            for i in range(start, end):
+                doc_id = self.doc_ids[i]
+                freq = self.term_freqs[i]
+                denominator = freq + K1 * (1 - B) + length_norm * B * self.doc_lengths[doc_id]
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * freq * (K1 + 1) / denominator
+        return scores
+
+    def search(self, query: str, k: int, allowed: Optional[Sequence[bool]] = None) -> List[Tuple[int, float]]:
+        """
+        Return the `k` best scoring documents for the query.
+
+        Args:
+            query (str): Free text query
+            k (int): Maximum number of hits
+            allowed (sequence): Whether each document id may be returned (default: all), see facets.py
+        Returns:
+            list: (document id, score) pairs, best first; ties keep document order
+        """
+        return top_k(self.scores(query), k, allowed)
+
+    def updated(self, added: Sequence[Tuple[int, Mapping]], deleted: Collection[int]) -> "LayeredBM25Index":
+        """
+        Return a copy of the index with episodes added and documents deleted.
+
+        The postings arrays are shared, not rebuilt: see LayeredBM25Index.
+        """
+        layered = LayeredBM25Index(self, {}, {}, frozenset(), self.num_docs,
+                                   self.avg_doc_length * self.num_docs)
+        return layered.updated(added, deleted)
+
+
+class LayeredBM25Index:
+    """
+    A BM25Index plus the documents added and deleted since it was built.
+
+    Added documents have their own postings, and deleted documents are skipped
+    while scoring, so an update costs time proportional to the documents it
+    changes. Corpus statistics (document count, average length) are kept
+    exact; document frequencies keep counting deleted documents until the
+    next full rebuild, which only slightly skews idf.
+    """
+
+    def __init__(self, base: BM25Index, postings: Dict[str, Tuple[Tuple[int, int], ...]],
+                 doc_lengths: Dict[int, int], deleted: frozenset, num_docs: int, total_length: float):
+        self.base = base
+        self.postings = postings
+        self.doc_lengths = doc_lengths
+        self.deleted = deleted
+        self.num_docs = num_docs
+        self.total_length = total_length
+        self.avg_doc_length = total_length / num_docs if num_docs else 0.0
+
+    def _doc_length(self, doc_id: int) -> int:
+        length = self.doc_lengths.get(doc_id)
+        return self.base.doc_lengths[doc_id] if length is None else length
+
+    def updated(self, added: Sequence[Tuple[int, Mapping]], deleted: Collection[int]) -> "LayeredBM25Index":
+        """
+        Return a copy of the index with episodes added and documents deleted.
+        """
+        deleted = [doc_id for doc_id in deleted if doc_id not in self.deleted]
+        num_docs = self.num_docs - len(deleted)
+        total_length = self.total_length - sum(self._doc_length(doc_id) for doc_id in deleted)
+        new_postings: Dict[str, list] = {}
+        doc_lengths = dict(self.doc_lengths)
+        for doc_id, episode in added:
+            tokens = tokenize(utils.episode_text(episode))
+            doc_lengths[doc_id] = len(tokens)
+            total_length += len(tokens)
+            num_docs += 1
+            for term, freq in Counter(tokens).items():
+                new_postings.setdefault(term, []).append((doc_id, freq))
+        # Postings are appended to lists and frozen once per term, not copied on every append
+        postings = dict(self.postings)
+        for term, entries in new_postings.items():
+            postings[term] = postings.get(term, ()) + tuple(entries)
+        return LayeredBM25Index(self.base, postings, doc_lengths, self.deleted.union(deleted), num_docs,
+                                total_length)
+
+    def scores(self, query: str) -> Dict[int, float]:
+        """
+        Score every live document sharing at least one term with the query.
+        """
+        scores: Dict[int, float] = {}
+        if not self.num_docs:
+            return scores
+        base = self.base
+        deleted = self.deleted
+        length_norm = K1 / self.avg_doc_length if self.avg_doc_length else 0.0
+        for term in set(tokenize(query)):
+            term_id = base.vocabulary.get(term)
+            start, end = (base.offsets[term_id], base.offsets[term_id + 1]) if term_id is not None else (0, 0)
+            added = self.postings.get(term, ())
+            doc_freq = end - start + len(added)
+            if not doc_freq:
+                continue
+            idf = math.log(1 + (self.num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+            hits = ((base.doc_ids[i], base.term_freqs[i]) for i in range(start, end))
+            for postings in (hits, added):
+                for doc_id, freq in postings:
+                    if doc_id in deleted:
+                        continue
+                    denominator = freq + K1 * (1 - B) + length_norm * B * self._doc_length(doc_id)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * freq * (K1 + 1) / denominator
+        return scores
+
+    def search(self, query: str, k: int, allowed: Optional[Sequence[bool]] = None) -> List[Tuple[int, float]]:
+        """
+        Return the `k` best scoring live documents for the query, among the `allowed` ones if given.
+        """
+        return top_k(self.scores(query), k, allowed)
+
+
+def top_k(scores: Dict[int, float], k: int, allowed: Optional[Sequence[bool]] = None) -> List[Tuple[int, float]]:
+    """
+    Select the `k` best (document id, score) pairs, best first; ties keep document order.
+
+    With `allowed`, only the documents it is true for are selected.
+    """
+    hits = scores.items()
+    if allowed is not None:
+        hits = [hit for hit in hits if allowed[hit[0]]]
+    return heapq.nsmallest(k, hits, key=lambda hit: (-hit[1], hit[0]))
+
+
+def _build_index(snapshot):
+    index = BM25Index.from_episodes(snapshot.documents)
+    return index.updated((), snapshot.deleted) if snapshot.deleted else index
+
+
+def get_index(snapshot):
+    """
+    Return the BM25 index of a corpus snapshot, building it on first use.
+    """
+    return snapshot.derived("bm25", _build_index)
@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Tuple
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker that stops calling a service once it fails or
+    slows down, and probes it again after a cool-down.
+
+    While closed, the outcomes of the last `window_size` calls are kept. Once
+    at least `min_calls` are known, the breaker opens when the share of failed
+    calls reaches `failure_rate`, or the share of calls slower than
+    `slow_call_seconds` reaches `slow_call_rate`. While open, calls are
+    rejected. After `open_seconds` the breaker is half-open: `half_open_probes`
+    calls are let through, and it closes if all of them succeed in time or
+    opens again as soon as one does not.
+
+    Callers ask `allow()` before each call, then report it with `record()`, or
+    with `release()` if its outcome says nothing about the health of the
+    service (e.g. a validation error).
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, window_size: int = 20, min_calls: int = 10, failure_rate: float = 0.5,
+                 slow_call_seconds: float = 5.0, slow_call_rate: float = 0.5, open_seconds: float = 30.0,
+                 half_open_probes: int = 2, clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self._clock = clock
+        self._lock = threading.Lock()
+        # (failed, slow) outcome of the most recent calls while closed
+        self._outcomes: Deque[Tuple[bool, bool]] = deque(maxlen=window_size)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._probes = 0
+            self._probe_successes = 0
+            logging.info(f"Circuit breaker {self.name} is half-open, probing the service")
+        return self._state
+
+    def allow(self) -> bool:
+        """
+        Return whether a call may be made now; if so, it must be reported with `record` or `release`.
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, success: bool, latency: float) -> None:
+        """
+        Report the outcome of an allowed call.
+
+        Args:
+            success: Whether the call succeeded
+            latency: Seconds the call took
+        """
+        slow = latency >= self.slow_call_seconds
+        with self._lock:
+            state = self._current_state()
+            if state == self.HALF_OPEN:
+                if not success or slow:
+                    self._open(f"probe {'failed' if not success else f'took {latency:.1f} s'}")
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_probes:
+                        self._state = self.CLOSED
+                        self._outcomes.clear()
+                        logging.info(f"Circuit breaker {self.name} closed")
+            elif state == self.CLOSED:
+                self._outcomes.append((not success, slow))
+                if len(self._outcomes) >= self.min_calls:
+                    failed = sum(outcome[0] for outcome in self._outcomes) / len(self._outcomes)
+                    slowed = sum(outcome[1] for outcome in self._outcomes) / len(self._outcomes)
+                    if failed >= self.failure_rate:
+                        self._open(f"{failed:.0%} of the last {len(self._outcomes)} calls failed")
+                    elif slowed >= self.slow_call_rate:
+                        self._open(f"{slowed:.0%} of the last {len(self._outcomes)} calls took "
+                                   f"{self.slow_call_seconds} s or more")
+            # Calls allowed before the breaker opened say nothing about the service after it did
+
+    def release(self) -> None:
+        """
+        Report an allowed call whose outcome does not count towards the health of the service.
+        """
+        with self._lock:
+            if self._current_state() == self.HALF_OPEN and self._probes > self._probe_successes:
+                self._probes -= 1
+
+    def _open(self, reason: str) -> None:
+        self._state = self.OPEN
+        self._opened_at = self._clock()
+        self._outcomes.clear()
+        self.opened += 1
+        logging.warning(f"Circuit breaker {self.name} opened for {self.open_seconds} s: {reason}")
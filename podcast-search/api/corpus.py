@@ -0,0 +1,426 @@
+import hashlib
+import itertools
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Collection, Dict, List, Mapping, Optional, Sequence, Set, Tuple
+
+import dedup
+import snapshot_file
+import utils
+from episode_store import EpisodeTable
+from incremental import AppendedEpisodes, FeedState, LiveEpisodes
+
+# Seconds between two checks of the data files for changes
+DEFAULT_CHECK_INTERVAL = 1.0
+
+# Feed files read from the data directory, among .json files and raw RSS files (.xml, .rss) converted on the fly
+FEED_PATTERN = os.environ.get("PODCAST_FEED_PATTERN", utils.DEFAULT_FEED_PATTERN)
+
+# Parse feed files item by item instead of loading each file whole
+STREAMING_INGEST = os.environ.get("PODCAST_STREAMING_INGEST", "false").lower() == "true"
+
+# Parse feed files on this many processes, in chunks of about PARSE_CHUNK_BYTES (0: on threads)
+PARSE_WORKERS = int(os.environ.get("PODCAST_PARSE_WORKERS", "0"))
+PARSE_CHUNK_BYTES = int(os.environ.get("PODCAST_PARSE_CHUNK_BYTES", str(utils.DEFAULT_PARSE_CHUNK_BYTES)))
+
+# Keep episodes in a compact EpisodeTable instead of one dict per episode
+COMPACT_STORE = os.environ.get("PODCAST_COMPACT_STORE", "true").lower() == "true"
+
+# Apply changed feed files to the current snapshot and its indexes instead of reloading every file
+INCREMENTAL_UPDATES = os.environ.get("PODCAST_INCREMENTAL", "true").lower() == "true"
+
+# Reload everything once the documents added or deleted since the last full load
+# exceed this fraction of it, so the layered indexes do not grow without bound
+MAX_DELTA_FRACTION = float(os.environ.get("PODCAST_MAX_DELTA_FRACTION", "0.25"))
+
+# Map one snapshot file shared by every worker process instead of loading the corpus in each (see snapshot_file.py)
+SHARED_CORPUS = os.environ.get("PODCAST_SHARED_CORPUS", "false").lower() == "true"
+
+Fingerprint = Tuple[Tuple[str, int, int], ...]
+
+# Versions are unique within the process, so they can key caches shared by several stores
+_versions = itertools.count(1)
+
+
+class CorpusSnapshot:
+    """
+    Immutable view of the podcast corpus as loaded at one point in time.
+
+    Readers keep a reference to a snapshot for the duration of a request, so a
+    reload never changes the episodes underneath them. Structures derived from
+    the episodes (indexes, encoded documents, ...) are built once per snapshot
+    through `derived` and are dropped together with it.
+
+    `feeds[i]`, when known, lists the feeds episode i was found in; episodes
+    repeated across feeds are only kept once (see dedup.py).
+
+    Indexes refer to episodes by document id, a position in `documents`. Ids
+    stay stable across incremental updates: new episodes get new ids and
+    removed ones are listed in `deleted`. `episodes` holds the live documents
+    only, and is the same sequence as `documents` after a full load.
+
+    `version_hash` and `last_modified` identify the data files the snapshot
+    reflects, by name, mtime and size, and `version_hash` whether episodes
+    were `deduplicated`. Unlike `version`, they are the same in every worker
+    process and across restarts, so HTTP validators built from them stay
+    valid behind a load balancer or CDN.
+    """
+
+    def __init__(self, documents: Sequence[Mapping], version: int, fingerprint: Fingerprint,
+                 derived: Optional[Dict[str, Any]] = None, feeds: Optional[Sequence[Sequence[str]]] = None,
+                 deleted: frozenset = frozenset(), deduplicated: bool = dedup.DEDUP_EPISODES):
+        self.documents = documents
+        self.deleted = deleted
+        self.episodes = LiveEpisodes(documents, deleted) if deleted else documents
+        self.version = version
+        self.fingerprint = fingerprint
+        self.feeds = feeds
+        self.deduplicated = deduplicated
+        self.loaded_at = time.time()
+        self.version_hash = hashlib.blake2b(repr((fingerprint, deduplicated)).encode(), digest_size=12).hexdigest()
+        # Seconds since the epoch of the latest change to the data files
+        self.last_modified = max((mtime_ns // 1_000_000_000 for _, mtime_ns, _ in fingerprint),
+                                 default=int(self.loaded_at))
+        self._derived: Dict[str, Any] = dict(derived or {})
+        self._derived_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.episodes)
+
+    def derived(self, name: str, builder: Callable[["CorpusSnapshot"], Any]) -> Any:
+        """
+        Return the structure registered under `name`, building it on first use.
+
+        Args:
+            name: Cache key of the derived structure
+            builder: Callable building the structure from this snapshot
+        Returns:
+            The cached or freshly built structure
+        """
+        try:
+            return self._derived[name]
+        except KeyError:
+            pass
+        with self._derived_lock:
+            if name not in self._derived:
+                self._derived[name] = builder(self)
+            return self._derived[name]
+
+    def updated(self, version: int, fingerprint: Fingerprint, added: Sequence[Tuple[int, Mapping]],
+                deleted: Collection[int], feeds: Optional[Sequence[Sequence[str]]]) -> "CorpusSnapshot":
+        """
+        Return a new snapshot with episodes added and documents deleted.
+
+        This snapshot is left untouched. Derived structures that have an
+        `updated(added, deleted)` method are carried over by applying the
+        change to them; the others are rebuilt when first used.
+
+        Args:
+            version: Version of the new snapshot
+            fingerprint: Data files the new snapshot reflects
+            added: (document id, episode) pairs, ids continuing `documents`
+            deleted: Ids of the documents to delete
+            feeds: Feeds holding each document in the new snapshot
+        """
+        documents = AppendedEpisodes.extend(self.documents, [episode for _, episode in added]) \
+            if added else self.documents
+        with self._derived_lock:
+            current = dict(self._derived)
+        derived = {name: value.updated(added, deleted) for name, value in current.items()
+                   if hasattr(value, "updated")}
+        return CorpusSnapshot(documents, version, fingerprint, derived, feeds, self.deleted.union(deleted),
+                              self.deduplicated)
+
+
+class CorpusStore:
+    """
+    Keeps the flattened podcast episodes in memory across requests.
+
+    The data files are parsed once and only parsed again when the mtime or size
+    of one of them changes. Checks for changes are rate limited by
+    `check_interval` so they do not add a stat call per file to every request.
+
+    When a precompiled snapshot (see snapshot_file.py) built from the current
+    data files exists at `snapshot_path`, it is memory-mapped instead, together
+    with its indexes, and the raw files are not parsed at all.
+
+    With `incremental` updates, only the files that changed since the last
+    load are parsed. Their episodes are diffed against the previous version
+    of the feed, and the inserts, updates and deletes applied to a new
+    snapshot and its indexes (see `CorpusSnapshot.updated`). Readers keep
+    the previous snapshot until the new one is published.
+
+    With `shared`, episodes are only ever served from the snapshot file,
+    together with their BM25, dense and facet indexes, rerank documents and
+    encodings, so every worker process of a server maps the same pages. A missing or
+    stale snapshot is rebuilt by one worker, elected by
+    `snapshot_file.build_lock`, which swaps the new file in atomically;
+    the others keep serving the snapshot they have and map the new file
+    once it is in place. Incremental updates do not apply in this mode.
+    """
+
+    def __init__(self, directory: str = "data", pattern: str = FEED_PATTERN,
+                 check_interval: float = DEFAULT_CHECK_INTERVAL, streaming: bool = STREAMING_INGEST,
+                 compact: bool = COMPACT_STORE, snapshot_path: Optional[Path] = snapshot_file.DEFAULT_PATH,
+                 deduplicate: bool = dedup.DEDUP_EPISODES, incremental: bool = INCREMENTAL_UPDATES,
+                 max_delta_fraction: float = MAX_DELTA_FRACTION, parse_workers: int = PARSE_WORKERS,
+                 parse_chunk_bytes: int = PARSE_CHUNK_BYTES, shared: bool = SHARED_CORPUS):
+        self.directory = directory
+        self.pattern = pattern
+        self.check_interval = check_interval
+        self.streaming = streaming
+        self.parse_workers = parse_workers
+        self.parse_chunk_bytes = parse_chunk_bytes
+        self.compact = compact
+        self.deduplicate = deduplicate
+        self.incremental = incremental
+        self.max_delta_fraction = max_delta_fraction
+        self.snapshot_path = snapshot_path
+        self.shared = shared and snapshot_path is not None
+        self._snapshot: Optional[CorpusSnapshot] = None
+        # Snapshot file mapped in shared mode, and data files last found to match it
+        self._mapped: Optional[snapshot_file.SnapshotFile] = None
+        self._checked_fingerprint: Optional[Fingerprint] = None
+        # Feed contents of the last full load, kept for incremental updates
+        self._feed_state: Optional[FeedState] = None
+        self._loaded_documents = 0
+        self._delta = 0
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[CorpusSnapshot], None]] = []
+
+    def fingerprint(self) -> Fingerprint:
+        """
+        Describe the current state of the data files by name, mtime and size.
+        """
+        files = utils.list_podcast_files(self.directory, self.pattern)
+        fingerprint = []
+        for file_path in files:
+            stat = file_path.stat()
+            fingerprint.append((file_path.name, stat.st_mtime_ns, stat.st_size))
+        return tuple(fingerprint)
+
+    def add_listener(self, callback: Callable[[CorpusSnapshot], None]) -> None:
+        """
+        Register a callback invoked with the new snapshot after every (re)load.
+        """
+        self._listeners.append(callback)
+
+    def load(self) -> CorpusSnapshot:
+        """
+        Parse the data files and publish them as the current snapshot.
+
+        Returns:
+            The newly loaded snapshot
+        """
+        with self._lock:
+            return self._load()
+
+    def snapshot(self) -> CorpusSnapshot:
+        """
+        Return the current snapshot, reloading it first if the data files changed.
+
+        While one thread reloads, other threads keep being served the previous
+        snapshot instead of waiting for the reload to finish.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    return self._load()
+                return self._snapshot
+        if time.monotonic() - self._last_check < self.check_interval:
+            return snapshot
+        if not self._lock.acquire(blocking=False):
+            return snapshot
+        try:
+            return self._refresh()
+        except Exception as e:
+            logging.error(f"Error reloading podcast corpus, serving version {snapshot.version}: {str(e)}")
+        finally:
+            self._lock.release()
+        return self._snapshot
+
+    def refresh(self) -> CorpusSnapshot:
+        """
+        Check the data files for changes now, regardless of `check_interval`,
+        and publish a new snapshot if they changed.
+
+        Returns:
+            The current snapshot
+        """
+        with self._lock:
+            if self._snapshot is None:
+                return self._load()
+            return self._refresh()
+
+    def _refresh(self) -> CorpusSnapshot:
+        self._last_check = time.monotonic()
+        if self.shared:
+            return self._refresh_shared()
+        fingerprint = self.fingerprint()
+        if fingerprint == self._snapshot.fingerprint:
+            return self._snapshot
+        if self.incremental and self._feed_state is not None:
+            try:
+                return self._update(fingerprint)
+            except Exception as e:
+                logging.error(f"Incremental corpus update failed, reloading all files: {str(e)}")
+        return self._load()
+
+    @property
+    def version(self) -> int:
+        return self.snapshot().version
+
+    def _map_fresh(self, files: List[Path]) -> Optional[snapshot_file.SnapshotFile]:
+        """
+        Map the snapshot file if it was built from `files` with the dedup settings of the store.
+        """
+        mapped = snapshot_file.load_if_fresh(self.snapshot_path, files)
+        if mapped is not None and mapped.meta.get("deduplicated", False) != self.deduplicate:
+            logging.info(f"Corpus snapshot {self.snapshot_path} was built with other dedup settings")
+            return None
+        return mapped
+
+    def _load(self) -> CorpusSnapshot:
+        if self.shared:
+            return self._load_shared()
+        files = utils.list_podcast_files(self.directory, self.pattern)
+        fingerprint = self.fingerprint()
+        started = time.perf_counter()
+        mapped = self._map_fresh(files) if self.snapshot_path else None
+        self._feed_state = None
+        if mapped is not None:
+            episodes = mapped.episodes()
+            derived = mapped.derived()
+            feeds = mapped.feeds()
+            source = f"snapshot {self.snapshot_path}"
+        else:
+            if self.incremental:
+                state = FeedState(self.deduplicate)
+                flattened = state.ingest(utils.read_podcast_feeds(self.directory, self.pattern, self.streaming,
+                                                                  self.parse_workers, self.parse_chunk_bytes))
+            else:
+                flattened, feeds = dedup.read_episodes(self.directory, self.pattern, streaming=self.streaming,
+                                                       deduplicate=self.deduplicate, workers=self.parse_workers,
+                                                       chunk_bytes=self.parse_chunk_bytes)
+            episodes = EpisodeTable.from_episodes(flattened) if self.compact else list(flattened)
+            if self.incremental:
+                self._feed_state = state
+                feeds = list(state.feeds)
+            derived = None
+            source = "data files"
+        self._loaded_documents = len(episodes)
+        self._delta = 0
+        snapshot = CorpusSnapshot(episodes, next(_versions), fingerprint, derived, feeds,
+                                  deduplicated=self.deduplicate)
+        self._publish(snapshot)
+        logging.info(f"Loaded {len(episodes)} podcast episodes (version {snapshot.version}) from {source} "
+                     f"in {time.perf_counter() - started:.3f}s")
+        return snapshot
+
+    def _load_shared(self) -> CorpusSnapshot:
+        started = time.perf_counter()
+        mapped = self._map_fresh(utils.list_podcast_files(self.directory, self.pattern))
+        if mapped is None:
+            with snapshot_file.build_lock(self.snapshot_path):
+                mapped = self._map_or_build()
+        return self._publish_mapped(mapped, started)
+
+    def _refresh_shared(self) -> CorpusSnapshot:
+        started = time.perf_counter()
+        identity = snapshot_file.file_identity(self.snapshot_path)
+        if identity is not None and identity != self._mapped.identity:
+            # Another worker swapped in a new snapshot
+            mapped = snapshot_file.SnapshotFile(self.snapshot_path)
+            return self._publish_mapped(mapped, started)
+        fingerprint = self.fingerprint()
+        if fingerprint in (self._snapshot.fingerprint, self._checked_fingerprint):
+            return self._snapshot
+        with snapshot_file.build_lock(self.snapshot_path, blocking=False) as acquired:
+            if not acquired:
+                # Another worker is rebuilding the snapshot; it is mapped on a later check once swapped in
+                return self._snapshot
+            mapped = self._map_or_build()
+        if mapped.identity == self._mapped.identity:
+            # The data files were touched but still match the snapshot
+            self._checked_fingerprint = fingerprint
+            return self._snapshot
+        return self._publish_mapped(mapped, started)
+
+    def _map_or_build(self) -> snapshot_file.SnapshotFile:
+        """
+        Map the snapshot file if fresh, else rebuild it from the data files. Call with the build lock held.
+        """
+        files = utils.list_podcast_files(self.directory, self.pattern)
+        # Another worker may have rebuilt it while this one waited for the lock
+        mapped = self._map_fresh(files)
+        if mapped is None:
+            started = time.perf_counter()
+            snapshot_file.build(self.directory, self.pattern, self.snapshot_path, self.parse_workers, self.deduplicate)
+            mapped = snapshot_file.SnapshotFile(self.snapshot_path)
+            logging.info(f"Rebuilt corpus snapshot {self.snapshot_path} in {time.perf_counter() - started:.3f}s")
+        return mapped
+
+    def _publish_mapped(self, mapped: snapshot_file.SnapshotFile, started: float) -> CorpusSnapshot:
+        self._mapped = mapped
+        self._checked_fingerprint = None
+        self._feed_state = None
+        # Identified by the data files the mapped file was built from, so every worker mapping it agrees on
+        # version_hash, whatever the data files look like when each of them checks
+        snapshot = CorpusSnapshot(mapped.episodes(), next(_versions), mapped.fingerprint, mapped.derived(),
+                                  mapped.feeds(), deduplicated=self.deduplicate)
+        self._publish(snapshot)
+        logging.info(f"Mapped {len(snapshot)} podcast episodes (version {snapshot.version}) from shared snapshot "
+                     f"{self.snapshot_path} in {time.perf_counter() - started:.3f}s")
+        return snapshot
+
+    def _update(self, fingerprint: Fingerprint) -> CorpusSnapshot:
+        started = time.perf_counter()
+        current = self._snapshot
+        previous = {name: (mtime, size) for name, mtime, size in current.fingerprint}
+        files = {file_path.name: file_path for file_path in utils.list_podcast_files(self.directory, self.pattern)}
+        changed = [name for name, mtime, size in fingerprint if previous.get(name) != (mtime, size)]
+        removed = [name for name in previous if name not in files]
+
+        state = self._feed_state
+        # A failure half way leaves the feed state out of sync, so it is only reused on success
+        self._feed_state = None
+        added: List[Tuple[int, Mapping]] = []
+        deleted: Set[int] = set()
+        for name in removed + changed:
+            if name in files:
+                read = utils.iter_feed_file if self.streaming else utils.process_single_file
+                episodes = read(files[name])
+            else:
+                episodes = ()
+            feed_added, feed_deleted = state.apply(Path(name).stem, episodes)
+            added += feed_added
+            deleted |= feed_deleted
+        self._feed_state = state
+
+        self._delta += len(added) + len(deleted)
+        if self._delta > self.max_delta_fraction * max(self._loaded_documents, 1):
+            logging.info(f"{self._delta} episodes changed since the last full load, reloading all files")
+            return self._load()
+
+        snapshot = current.updated(next(_versions), fingerprint, added, deleted, list(state.feeds))
+        self._publish(snapshot)
+        logging.info(f"Updated {len(changed) + len(removed)} feeds (+{len(added)} -{len(deleted)} episodes, "
+                     f"version {snapshot.version}) in {time.perf_counter() - started:.3f}s")
+        return snapshot
+
+    def _publish(self, snapshot: CorpusSnapshot) -> None:
+        self._snapshot = snapshot
+        self._last_check = time.monotonic()
+        for callback in self._listeners:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logging.error(f"Corpus reload listener failed: {str(e)}")
+
+
+store = CorpusStore()
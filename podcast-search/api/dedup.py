@@ -0,0 +1,270 @@
+import hashlib
+import logging
+import os
+import re
+import unicodedata
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+import utils
+
+# Drop episodes repeated across feeds while loading the corpus
+DEDUP_EPISODES = os.environ.get("PODCAST_DEDUP", "true").lower() == "true"
+
+# Episodes whose SimHash fingerprints differ in at most this many bits are near-duplicates
+SIMHASH_MAX_DISTANCE = int(os.environ.get("PODCAST_DEDUP_DISTANCE", "3"))
+
+# Words per shingle hashed into the SimHash fingerprint
+SHINGLE_SIZE = 3
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize_title(title: str) -> str:
+    """
+    Reduce a title to its lowercased words, e.g. "Ep. 12: Growth!" -> "ep 12 growth".
+    """
+    return " ".join(_WORD_RE.findall(unicodedata.normalize("NFKC", title).casefold()))
+
+
+def normalize_url(url: str) -> str:
+    """
+    Drop the scheme, query string and fragment of a URL, which vary with the
+    feed an episode is served from (tracking parameters, http vs https).
+    """
+    url = url.strip().split("#", 1)[0].split("?", 1)[0]
+    return url.split("://", 1)[-1].lower().rstrip("/")
+
+
+def episode_title(episode: Mapping) -> str:
+    for key, value in episode.items():
+        if key.split("_", 1)[0] == "title" and isinstance(value, str) and value and not key.endswith("prefix"):
+            return value
+    return ""
+
+
+def enclosure_url(episode: Mapping) -> str:
+    """
+    Return the URL of the episode audio: the RSS enclosure, or the first
+    media:content with an audio type.
+    """
+    url = episode.get("enclosure__url")
+    if url:
+        return url
+    for key, value in episode.items():
+        if key.startswith("content_") and key.endswith("__url"):
+            media_type = episode.get(key[:-len("url")] + "type", "")
+            if isinstance(media_type, str) and media_type.startswith("audio/"):
+                return value
+    return ""
+
+
+def content_key(episode: Mapping) -> Optional[bytes]:
+    """
+    Hash of the normalized title and enclosure URL, or None if the episode has neither.
+    """
+    title = normalize_title(episode_title(episode))
+    url = normalize_url(enclosure_url(episode))
+    if not title and not url:
+        return None
+    return hashlib.sha1(f"{title}\n{url}".encode("utf-8")).digest()
+
+
+def _mix64(values: np.ndarray) -> np.ndarray:
+    """SplitMix64 finalizer, spreading combined word hashes over all 64 bits."""
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+class SimHasher:
+    """
+    64-bit SimHash of the word shingles of a text.
+
+    Texts that share most of their shingles get fingerprints differing in few
+    bits. Word hashes are cached, and shingle hashes are combined and counted
+    with numpy, so a fingerprint costs one dict lookup per word.
+    """
+
+    def __init__(self, shingle_size: int = SHINGLE_SIZE):
+        self.shingle_size = shingle_size
+        self._word_hashes: Dict[str, int] = {}
+
+    def _word_hash(self, word: str) -> int:
+        value = self._word_hashes.get(word)
+        if value is None:
+            value = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            self._word_hashes[word] = value
+        return value
+
+    def fingerprint(self, text: str) -> Optional[int]:
+        """
+        Return the SimHash of `text`, or None if it has no words.
+        """
+        words = _WORD_RE.findall(unicodedata.normalize("NFKC", text).casefold())
+        if not words:
+            return None
+        hashes = np.fromiter((self._word_hash(word) for word in words), dtype=np.uint64, count=len(words))
+        size = min(self.shingle_size, len(words))
+        shingles = hashes[:len(words) - size + 1].copy()
+        with np.errstate(over="ignore"):
+            for offset in range(1, size):
+                shingles = shingles * np.uint64(0x9E3779B97F4A7C15) + hashes[offset:len(words) - size + 1 + offset]
+            shingles = _mix64(shingles)
+        bits = np.unpackbits(shingles.view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+        majority = bits.sum(axis=0, dtype=np.int64) * 2 > len(shingles)
+        return int.from_bytes(np.packbits(majority, bitorder="little").tobytes(), "little")
+
+
+class Deduplicator:
+    """
+    Streaming filter dropping episodes seen before, from the same or another feed.
+
+    An episode is a duplicate of an earlier (canonical) one if it has the same
+    normalized title and enclosure URL, or if the SimHash fingerprints of their
+    text differ in at most `max_distance` bits. Near-duplicates are looked up by
+    splitting fingerprints into `max_distance + 1` bands: two fingerprints that
+    close agree on at least one whole band.
+
+    `feeds[i]` lists the feeds the i-th canonical episode appeared in.
+    """
+
+    def __init__(self, max_distance: int = SIMHASH_MAX_DISTANCE):
+        self.max_distance = max_distance
+        self.feeds: List[List[str]] = []
+        self.duplicates = 0
+        self.near_duplicates = 0
+        self._hasher = SimHasher()
+        self._keys: Dict[bytes, int] = {}
+        self._content_keys: List[Optional[bytes]] = []
+        self._fingerprints: List[Optional[int]] = []
+        bands = max_distance + 1
+        self._band_bits = [(64 * band // bands, 64 * (band + 1) // bands) for band in range(bands)]
+        self._bands: List[Dict[int, List[int]]] = [{} for _ in range(bands)]
+
+    def _band_values(self, fingerprint: int) -> Iterator[Tuple[int, int]]:
+        for band, (start, stop) in enumerate(self._band_bits):
+            yield band, (fingerprint >> start) & ((1 << (stop - start)) - 1)
+
+    def _near_duplicate(self, fingerprint: int, exclude: Optional[int] = None) -> Optional[int]:
+        for band, value in self._band_values(fingerprint):
+            for candidate in self._bands[band].get(value, ()):
+                if candidate == exclude:
+                    continue
+                if bin(fingerprint ^ self._fingerprints[candidate]).count("1") <= self.max_distance:
+                    return candidate
+        return None
+
+    def add(self, episode: Mapping, feed: str) -> bool:
+        """
+        Record an episode of `feed`.
+
+        Returns:
+            True if the episode is canonical, False if it duplicates an earlier one
+        """
+        return self.place(episode, feed)[1]
+
+    def place(self, episode: Mapping, feed: str, exclude: Optional[int] = None) -> Tuple[int, bool]:
+        """
+        Record an episode of `feed` and find its canonical episode.
+
+        Args:
+            episode: Flattened episode
+            feed: Name of the feed it appears in
+            exclude: Canonical episode the episode may not be merged into, e.g.
+                the previous version of an updated episode
+        Returns:
+            The index of the canonical episode, and whether that is a new
+            canonical episode (the episode itself) rather than an earlier one
+        """
+        key = content_key(episode)
+        canonical = self._keys.get(key) if key is not None else None
+        if canonical == exclude:
+            canonical = None
+        fingerprint = None
+        if canonical is None:
+            fingerprint = self._hasher.fingerprint(utils.episode_text(episode))
+            if fingerprint is not None:
+                canonical = self._near_duplicate(fingerprint, exclude)
+                self.near_duplicates += canonical is not None
+
+        if canonical is not None:
+            self.duplicates += 1
+            if feed not in self.feeds[canonical]:
+                # Lists are replaced rather than appended to, as published snapshots share them
+                self.feeds[canonical] = self.feeds[canonical] + [feed]
+            return canonical, False
+
+        index = len(self.feeds)
+        self.feeds.append([feed])
+        self._content_keys.append(key)
+        self._fingerprints.append(fingerprint)
+        if key is not None:
+            self._keys[key] = index
+        if fingerprint is not None:
+            for band, value in self._band_values(fingerprint):
+                self._bands[band].setdefault(value, []).append(index)
+        return index, True
+
+    def remove(self, index: int, feed: str) -> bool:
+        """
+        Record that canonical episode `index` no longer appears in `feed`.
+
+        Returns:
+            True if it no longer appears in any feed, in which case later
+            episodes are not matched against it anymore
+        """
+        self.feeds[index] = [name for name in self.feeds[index] if name != feed]
+        if self.feeds[index]:
+            return False
+        key = self._content_keys[index]
+        if key is not None and self._keys.get(key) == index:
+            del self._keys[key]
+        fingerprint = self._fingerprints[index]
+        if fingerprint is not None:
+            for band, value in self._band_values(fingerprint):
+                self._bands[band][value].remove(index)
+            self._fingerprints[index] = None
+        return True
+
+    def deduplicate(self, feeds: Iterable[Tuple[str, Iterable[Mapping]]]) -> Iterator[Mapping]:
+        """
+        Yield the canonical episodes of `feeds`, a sequence of (feed name, episodes) pairs.
+        """
+        for feed, episodes in feeds:
+            for episode in episodes:
+                if self.add(episode, feed):
+                    yield episode
+        if self.duplicates:
+            logging.info(f"Dropped {self.duplicates} duplicate episodes "
+                         f"({self.near_duplicates} near-duplicates) across feeds")
+
+
+def read_episodes(directory: str = "data", pattern: str = utils.DEFAULT_FEED_PATTERN, streaming: bool = False,
+                  deduplicate: bool = DEDUP_EPISODES, workers: int = 0,
+                  chunk_bytes: int = utils.DEFAULT_PARSE_CHUNK_BYTES) -> Tuple[Iterator[Mapping], List[List[str]]]:
+    """
+    Read the episodes of the data files, dropping duplicates across feeds.
+
+    See utils.read_podcast_feeds for `streaming`, `workers` and `chunk_bytes`.
+
+    Returns:
+        Iterator over the (canonical) episodes, and the list of the feeds each
+        of them appeared in, which is complete once the iterator is exhausted
+    """
+    feeds = utils.read_podcast_feeds(directory, pattern, streaming, workers, chunk_bytes)
+    if deduplicate:
+        deduplicator = Deduplicator()
+        return deduplicator.deduplicate(feeds), deduplicator.feeds
+
+    provenance: List[List[str]] = []
+
+    def tag(feed: str, episodes: Iterable[Mapping]) -> Iterator[Mapping]:
+        for episode in episodes:
+            provenance.append([feed])
+            yield episode
+
+    return (episode for feed, episodes in feeds for episode in tag(feed, episodes)), provenance
@@ -0,0 +1,275 @@
+import hashlib
+import logging
+import math
+import os
+import zlib
+from collections import Counter
+from pathlib import Path
+from typing import Callable, Collection, Dict, List, Mapping, Optional, Protocol, Sequence, Tuple
+
+import numpy as np
+
+import bm25
+import utils
+
+# Directory the episode embedding matrices are written to and memory-mapped from
+INDEX_DIRECTORY = Path(os.environ.get("PODCAST_INDEX_DIR", Path(__file__).parent.parent / "index"))
+
+# Name of the embedder used for the dense index, see `register_embedder`
+DENSE_EMBEDDER = os.environ.get("DENSE_EMBEDDER", "hashing")
+
+
+class Embedder(Protocol):
+    """
+    Turns texts into L2-normalized float32 vectors of a fixed dimension.
+    """
+    name: str
+    dimension: int
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        ...
+
+
+class HashingEmbedder:
+    """
+    Deterministic offline embedder based on signed feature hashing.
+
+    Unigrams and bigrams are hashed with CRC32 (stable across processes, unlike
+    `hash`) into `dimension` buckets with a sign bit, weighted by sublinear
+    term frequency and L2-normalized, so cosine similarity is a dot product.
+    """
+
+    def __init__(self, dimension: int = 256):
+        self.dimension = dimension
+        self.name = f"hashing{dimension}"
+
+    def features(self, text: str) -> Counter:
+        tokens = bm25.tokenize(text)
+        features = Counter(tokens)
+        features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+        return features
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            vector = matrix[row]
+            for feature, freq in self.features(text).items():
+                bucket = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if bucket & 0x80000000 else -1.0
+                vector[bucket % self.dimension] += sign * (1.0 + math.log(freq))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+
+_EMBEDDERS: Dict[str, Callable[[], Embedder]] = {
+    "hashing": HashingEmbedder,
+}
+
+
+def register_embedder(name: str, factory: Callable[[], Embedder]) -> None:
+    """
+    Make an embedding provider available under `name` (selected with DENSE_EMBEDDER).
+    """
+    _EMBEDDERS[name] = factory
+
+
+def get_embedder(name: Optional[str] = None) -> Embedder:
+    name = name or DENSE_EMBEDDER
+    try:
+        return _EMBEDDERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown embedder: {name}")
+
+
+class DenseIndex:
+    """
+    Episode embeddings in one contiguous float32 matrix, one row per document id.
+
+    A query is scored against every row with a single matrix-vector product and
+    the top k rows are selected with `argpartition`, so only the k hits are sorted.
+    """
+
+    def __init__(self, matrix: np.ndarray, embedder: Embedder):
+        if matrix.dtype != np.float32 or matrix.ndim != 2:
+            raise ValueError("Expected a 2-D float32 embedding matrix")
+        self.matrix = matrix
+        self.embedder = embedder
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @classmethod
+    def build(cls, texts: Sequence[str], embedder: Embedder, path: Optional[Path] = None) -> "DenseIndex":
+        """
+        Embed the documents and, when `path` is given, save them to a .npy file
+        that is then memory-mapped instead of kept on the heap.
+
+        Args:
+            texts: Text of each document, in document id order
+            embedder: Embedding provider
+            path: Optional .npy file for the embedding matrix
+        Returns:
+            DenseIndex: The built index
+        """
+        matrix = np.ascontiguousarray(embedder.embed(texts), dtype=np.float32)
+        if path is None:
+            return cls(matrix, embedder)
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, "wb") as f:
+            np.save(f, matrix)
+        os.replace(tmp_path, path)
+        return cls.load(path, embedder)
+
+    @classmethod
+    def load(cls, path: Path, embedder: Embedder) -> "DenseIndex":
+        """
+        Memory-map an embedding matrix saved by `build`.
+        """
+        return cls(np.load(path, mmap_mode="r"), embedder)
+
+    def search_vector(self, query_vector: np.ndarray, k: int,
+                      allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Return the `k` rows with the highest cosine similarity to a normalized vector.
+
+        Args:
+            query_vector (np.ndarray): Normalized query embedding
+            k (int): Maximum number of hits
+            allowed (np.ndarray): Boolean mask of the document ids that may be returned (default: all)
+        Returns:
+            list: (document id, score) pairs, best first; ties keep document order
+        """
+        if k <= 0 or len(self) == 0 or not np.any(query_vector):
+            return []
+        scores = self.matrix @ query_vector
+        if allowed is not None:
+            scores[~allowed[:len(scores)]] = -np.inf
+        return _top_k(scores, np.arange(len(self)), k)
+
+    def search(self, query: str, k: int, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Embed the query and return its `k` nearest documents.
+        """
+        return self.search_vector(self.embedder.embed([query])[0], k, allowed)
+
+    def updated(self, added: Sequence[Tuple[int, Mapping]], deleted: Collection[int]) -> "LayeredDenseIndex":
+        """
+        Return a copy of the index with episodes added and documents deleted,
+        sharing this matrix: see LayeredDenseIndex.
+        """
+        empty = LayeredDenseIndex(self, np.empty((0, self.matrix.shape[1]), dtype=np.float32),
+                                  np.empty(0, dtype=np.int64), frozenset())
+        return empty.updated(added, deleted)
+
+
+class LayeredDenseIndex:
+    """
+    A DenseIndex plus the embeddings of the documents added since it was
+    built, minus deleted documents. Only added documents are embedded.
+    """
+
+    def __init__(self, base: DenseIndex, matrix: np.ndarray, doc_ids: np.ndarray, deleted: frozenset):
+        self.base = base
+        self.embedder = base.embedder
+        self.matrix = matrix
+        self.doc_ids = doc_ids
+        self.deleted = deleted
+        # Rows of the deleted documents in the concatenated base and added score vectors
+        rows = {doc_id: len(base) + row for row, doc_id in enumerate(doc_ids.tolist())}
+        self._deleted_rows = np.array([rows.get(doc_id, doc_id) for doc_id in deleted], dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.base) + len(self.doc_ids) - len(self.deleted)
+
+    def updated(self, added: Sequence[Tuple[int, Mapping]], deleted: Collection[int]) -> "LayeredDenseIndex":
+        """
+        Return a copy of the index with episodes added and documents deleted.
+        """
+        matrix, doc_ids = self.matrix, self.doc_ids
+        if added:
+            vectors = self.embedder.embed([utils.episode_text(episode) for _, episode in added])
+            matrix = np.concatenate([matrix, np.asarray(vectors, dtype=np.float32)])
+            doc_ids = np.concatenate([doc_ids, np.array([doc_id for doc_id, _ in added], dtype=np.int64)])
+        return LayeredDenseIndex(self.base, matrix, doc_ids, self.deleted.union(deleted))
+
+    def search_vector(self, query_vector: np.ndarray, k: int,
+                      allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Return the `k` live documents with the highest cosine similarity to a normalized vector,
+        among the `allowed` ones if given.
+        """
+        if k <= 0 or len(self) == 0 or not np.any(query_vector):
+            return []
+        scores = np.concatenate([self.base.matrix @ query_vector, self.matrix @ query_vector])
+        scores[self._deleted_rows] = -np.inf
+        doc_ids = np.concatenate([np.arange(len(self.base)), self.doc_ids])
+        if allowed is not None:
+            scores[~allowed[doc_ids]] = -np.inf
+        return _top_k(scores, doc_ids, min(k, len(self)))
+
+    def search(self, query: str, k: int, allowed: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Embed the query and return its `k` nearest live documents.
+        """
+        return self.search_vector(self.embedder.embed([query])[0], k, allowed)
+
+
+def _top_k(scores: np.ndarray, doc_ids: np.ndarray, k: int) -> List[Tuple[int, float]]:
+    """
+    Select the `k` highest scores with `argpartition`, so only the k hits are sorted.
+
+    Rows scored -inf (deleted or filtered out documents) are never selected.
+    """
+    if k < len(scores):
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.lexsort((doc_ids[top], -scores[top]))]
+    top = top[scores[top] > -np.inf]
+    return [(int(doc_ids[row]), float(scores[row])) for row in top]
+
+
+def _index_path(snapshot, embedder: Embedder) -> Path:
+    digest = hashlib.sha1(repr(snapshot.fingerprint).encode("utf-8")).hexdigest()[:16]
+    return INDEX_DIRECTORY / f"dense-{embedder.name}-{digest}.npy"
+
+
+def build_index(snapshot, embedder: Optional[Embedder] = None) -> DenseIndex:
+    """
+    Load the dense index of a snapshot from INDEX_DIRECTORY, embedding the
+    episodes and saving the matrix there first if it does not exist yet.
+    """
+    embedder = embedder or get_embedder()
+    path = _index_path(snapshot, embedder)
+    if path.exists():
+        try:
+            index = DenseIndex.load(path, embedder)
+            if len(index) == len(snapshot.documents):
+                return index
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable dense index {path}: {str(e)}")
+    texts = [utils.episode_text(episode) for episode in snapshot.documents]
+    try:
+        index = DenseIndex.build(texts, embedder, path)
+        for stale_path in path.parent.glob(f"dense-{embedder.name}-*.npy"):
+            if stale_path != path:
+                stale_path.unlink(missing_ok=True)
+        return index
+    except OSError as e:
+        logging.warning(f"Cannot write dense index to {path}, keeping it in memory: {str(e)}")
+        return DenseIndex.build(texts, embedder)
+
+
+def _build_live_index(snapshot):
+    index = build_index(snapshot)
+    return index.updated((), snapshot.deleted) if snapshot.deleted else index
+
+
+def get_index(snapshot):
+    """
+    Return the dense index of a corpus snapshot, building it on first use.
+    """
+    return snapshot.derived("dense", _build_live_index)
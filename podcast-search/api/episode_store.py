@@ -0,0 +1,298 @@
+import json
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+from typing import Any, Collection, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Strings up to this length are shared between all episodes holding an equal value
+POOLED_STRING_LENGTH = 64
+
+# Marks rows that have no value in a numeric column
+_MISSING = -(2 ** 63)
+
+
+def _is_canonical_int(value: Any) -> bool:
+    """True for strings that survive a round trip through int, e.g. '1800' but not '007'."""
+    return (isinstance(value, str) and 0 < len(value) < 19 and value.isdigit()
+            and (value[0] != "0" or value == "0"))
+
+
+class EpisodeTable(Sequence):
+    """
+    Compact, append-only storage for flattened episodes.
+
+    Instead of one dict per episode, each row stores a tuple of values plus the
+    id of its "shape": the interned, ordered tuple of field names shared by all
+    episodes with the same layout. Fields holding canonical integer strings
+    (enclosure lengths, durations in seconds, episode numbers) are stored in
+    int64 array columns and turned back into strings on access. Short strings
+    such as MIME types are pooled, and values repeated within an episode (e.g.
+    description and content:encoded) are stored once.
+
+    Indexing returns `EpisodeRecord` views that behave like the original dicts.
+    """
+
+    def __init__(self):
+        self._shape_ids: Dict[Tuple, int] = {}
+        self._shape_keys: List[Tuple[str, ...]] = []
+        self._shape_slots: List[Tuple[int, ...]] = []
+        self._shape_lookup: List[Dict[str, int]] = []
+        self._row_shapes = array("I")
+        self._row_values: List[Tuple] = []
+        self._column_ids: Dict[str, int] = {}
+        self._columns: List[array] = []
+        self._pool: Dict[str, str] = {}
+
+    @classmethod
+    def from_episodes(cls, episodes: Iterable[Mapping]) -> "EpisodeTable":
+        table = cls()
+        for episode in episodes:
+            table.append(episode)
+        return table
+
+    def __len__(self) -> int:
+        return len(self._row_values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [EpisodeRecord(self, row) for row in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("episode index out of range")
+        return EpisodeRecord(self, index)
+
+    def append(self, episode: Mapping) -> int:
+        """
+        Add a flattened episode and return its row number.
+        """
+        row = len(self._row_values)
+        keys = []
+        numeric = []
+        values = []
+        for key, value in episode.items():
+            keys.append(key)
+            if _is_canonical_int(value):
+                numeric.append(True)
+                self._column(key, row)[row] = int(value)
+            else:
+                numeric.append(False)
+                values.append(self._share(value, values))
+
+        signature = (tuple(keys), tuple(numeric))
+        shape_id = self._shape_ids.get(signature)
+        if shape_id is None:
+            shape_id = self._add_shape(*signature)
+        self._row_shapes.append(shape_id)
+        self._row_values.append(tuple(values))
+        for column in self._columns:
+            if len(column) == row:
+                column.append(_MISSING)
+        return row
+
+    def row_items(self, row: int) -> Iterator[Tuple[str, Any]]:
+        shape_id = self._row_shapes[row]
+        values = self._row_values[row]
+        for key, slot in zip(self._shape_keys[shape_id], self._shape_slots[shape_id]):
+            yield key, self._value(row, values, slot)
+
+    def row_dict(self, row: int) -> dict:
+        return dict(self.row_items(row))
+
+    def _value(self, row: int, values: Tuple, slot: int) -> Any:
+        if slot >= 0:
+            return values[slot]
+        return str(self._columns[-slot - 1][row])
+
+    def _column(self, key: str, row: int) -> array:
+        column_id = self._column_ids.get(key)
+        if column_id is None:
+            column_id = len(self._columns)
+            self._column_ids[sys.intern(key)] = column_id
+            self._columns.append(array("q", [_MISSING]) * (row + 1))
+        column = self._columns[column_id]
+        if len(column) == row:
+            column.append(_MISSING)
+        return column
+
+    def _add_shape(self, keys: Tuple[str, ...], numeric: Tuple[bool, ...]) -> int:
+        keys = tuple(sys.intern(key) for key in keys)
+        slots = []
+        next_value = 0
+        for key, is_numeric in zip(keys, numeric):
+            if is_numeric:
+                slots.append(-self._column_ids[key] - 1)
+            else:
+                slots.append(next_value)
+                next_value += 1
+        shape_id = len(self._shape_keys)
+        self._shape_ids[(keys, numeric)] = shape_id
+        self._shape_keys.append(keys)
+        self._shape_slots.append(tuple(slots))
+        self._shape_lookup.append(dict(zip(keys, slots)))
+        return shape_id
+
+    def _share(self, value: Any, row_values: List) -> Any:
+        if not isinstance(value, str):
+            return value
+        if len(value) <= POOLED_STRING_LENGTH:
+            return self._pool.setdefault(value, value)
+        for previous in row_values:
+            if previous == value:
+                return previous
+        return value
+
+
+class EpisodeRecord(Mapping):
+    """
+    Read-only dict-like view of one row of an `EpisodeTable`.
+
+    Iterates its fields in the order of the original flattened dict, so
+    `to_dict()` serializes to exactly the same JSON.
+    """
+    __slots__ = ("_table", "_row")
+
+    def __init__(self, table: EpisodeTable, row: int):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, key: str) -> Any:
+        table = self._table
+        slot = table._shape_lookup[table._row_shapes[self._row]][key]
+        return table._value(self._row, table._row_values[self._row], slot)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._table._shape_keys[self._table._row_shapes[self._row]])
+
+    def __len__(self) -> int:
+        return len(self._table._shape_keys[self._table._row_shapes[self._row]])
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._table._shape_lookup[self._table._row_shapes[self._row]]
+
+    def items(self):
+        return list(self._table.row_items(self._row))
+
+    def to_dict(self) -> dict:
+        return self._table.row_dict(self._row)
+
+    def __repr__(self) -> str:
+        return f"EpisodeRecord({self.to_dict()!r})"
+
+
+def to_dict(episode: Mapping) -> dict:
+    """
+    Return a flattened episode as a plain dict, e.g. for JSON serialization.
+    """
+    if isinstance(episode, EpisodeRecord):
+        return episode.to_dict()
+    return episode
+
+
+def encode_episode(episode: Mapping) -> bytes:
+    """
+    Encode a flattened episode as compact UTF-8 JSON, the way JSONResponse renders it.
+    """
+    return json.dumps(to_dict(episode), ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def join_json(key: str, encoded: Iterable[bytes]) -> bytes:
+    """
+    Join encoded episodes into the body of a {key: [episodes]} JSON response.
+    """
+    return b'{"' + key.encode("utf-8") + b'":[' + b",".join(encoded) + b"]}"
+
+
+class EncodedEpisodes:
+    """
+    Compact JSON encoding of every document of a snapshot, so responses are
+    built by joining bytes instead of validating and encoding episode dicts.
+
+    Documents are encoded on first use and kept for the lifetime of the
+    snapshot. Documents that already hold their encoding (mapped snapshots)
+    are served as memoryviews, without a copy.
+    """
+
+    def __init__(self, documents: Sequence[Mapping], encoded: Optional[List[Optional[bytes]]] = None):
+        self.documents = documents
+        self._stored = getattr(documents, "encoded", None)
+        # Stored encodings are not cached, so a mapped snapshot costs no per-document memory
+        if encoded is None and self._stored is None:
+            encoded = [None] * len(documents)
+        self._encoded = encoded
+
+    def __len__(self) -> int:
+        return len(self.documents) if self._encoded is None else len(self._encoded)
+
+    def __getitem__(self, doc_id: int) -> bytes:
+        if self._encoded is None:
+            return self._stored(doc_id)
+        encoded = self._encoded[doc_id]
+        if encoded is None:
+            encoded = self._stored(doc_id) if self._stored is not None else encode_episode(self.documents[doc_id])
+            self._encoded[doc_id] = encoded
+        return encoded
+
+    def updated(self, added: Sequence[Tuple[int, Mapping]], deleted: Collection[int]) -> "EncodedEpisodes":
+        """
+        Return a copy holding the encodings known so far, plus those of the episodes added.
+
+        Ids of added episodes continue the current ones, and earlier ids keep
+        their document, so `documents` still serves the encodings missing.
+        """
+        encoded = self._encoded if self._encoded is not None else [None] * len(self.documents)
+        return EncodedEpisodes(self.documents, encoded + [encode_episode(episode) for _, episode in added])
+
+
+def get_encoded(snapshot) -> EncodedEpisodes:
+    """
+    Return the encoded documents of a corpus snapshot, see EncodedEpisodes.
+    """
+    return snapshot.derived("encoded_episodes", lambda s: EncodedEpisodes(s.documents))
+
+
+def project_episode(episode: Mapping, fields: Optional[Collection[str]]) -> Mapping:
+    """
+    Keep only `fields` of an episode, in their original order; None keeps all fields.
+    """
+    if fields is None:
+        return episode
+    return {key: value for key, value in episode.items() if key in fields}
+
+
+def iter_ndjson(episodes: Sequence[Mapping], start: int, stop: int,
+                fields: Optional[Collection[str]] = None, batch_size: int = 64) -> Iterator[bytes]:
+    """
+    Encode episodes[start:stop] as newline-delimited JSON, a batch of lines at a time.
+
+    Episodes are encoded lazily as the response is sent, so memory per request
+    stays bounded by one batch. Episodes that already hold their JSON encoding
+    (mapped snapshots) are sent without being decoded.
+    """
+    encoded = getattr(episodes, "encoded", None) if fields is None else None
+    batch = []
+    for index in range(start, stop):
+        if encoded is not None:
+            batch.append(bytes(encoded(index)))
+        else:
+            batch.append(encode_episode(project_episode(episodes[index], fields)))
+        if len(batch) == batch_size:
+            yield b"\n".join(batch) + b"\n"
+            batch = []
+    if batch:
+        yield b"\n".join(batch) + b"\n"
+
+
+def iter_encoded_ndjson(encoded: Sequence[bytes], doc_ids: Iterable[int], batch_size: int = 64) -> Iterator[bytes]:
+    """
+    Join the encoded documents `doc_ids` (see EncodedEpisodes) as newline-delimited JSON, a batch of lines at a time.
+    """
+    batch = []
+    for doc_id in doc_ids:
+        batch.append(encoded[doc_id])
+        if len(batch) == batch_size:
+            yield b"\n".join(batch) + b"\n"
+            batch = []
+    if batch:
+        yield b"\n".join(batch) + b"\n"
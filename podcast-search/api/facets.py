@@ -0,0 +1,256 @@
+"""
+Facet filters for search: the show an episode belongs to, its publication
+date and its duration.
+
+Filters are turned into a boolean mask over document ids, by intersecting a
+per-show bitmap with ranges looked up in sorted indexes, and handed to the
+first-stage retrieval so only matching documents become rerank candidates.
+"""
+import math
+from datetime import date, datetime, time, timezone
+from email.utils import parsedate_to_datetime
+from typing import Collection, Dict, Iterable, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Feed names are file names, e.g. podcasts_hbr_ideacast; shows can be given without this prefix
+FEED_PREFIX = "podcasts_"
+
+
+def parse_pub_date(value) -> float:
+    """
+    Parse an RFC 822 date such as "Tue, 21 Jan 2025 08:00:27 -0500" to a Unix timestamp, or NaN.
+    """
+    if not isinstance(value, str) or not value:
+        return math.nan
+    try:
+        published = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return math.nan
+    if published.tzinfo is None:
+        published = published.replace(tzinfo=timezone.utc)
+    return published.timestamp()
+
+
+def parse_duration(value) -> float:
+    """
+    Parse an itunes:duration, seconds ("1837") or clock time ("00:26:25", "26:25"), to seconds, or NaN.
+    """
+    if not isinstance(value, str):
+        return math.nan
+    parts = value.strip().split(":")
+    if not 1 <= len(parts) <= 3 or not all(part.isdigit() for part in parts):
+        return math.nan
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + int(part)
+    return float(seconds)
+
+
+def episode_duration(episode: Mapping) -> float:
+    """
+    Duration of a flattened episode in seconds: "duration__itunes" in the
+    default layout, "duration___text" in the HBR one.
+    """
+    for key in ("duration__itunes", "duration___text", "duration"):
+        if key in episode:
+            return parse_duration(episode[key])
+    return math.nan
+
+
+def _facet_values(episodes: Iterable[Mapping]) -> Tuple[np.ndarray, np.ndarray]:
+    published, durations = [], []
+    for episode in episodes:
+        published.append(parse_pub_date(episode.get("pubDate")))
+        durations.append(episode_duration(episode))
+    return np.array(published, dtype=np.float64), np.array(durations, dtype=np.float64)
+
+
+class SortedIndex:
+    """
+    Values of one numeric facet by document id, with the document ids sorted
+    by value for range lookups. Documents without a value (NaN) match no range.
+
+    The sort order is computed on the first lookup, so updates that are never
+    queried cost only the values appended. Indexes mapped from a snapshot
+    file are given their order and sorted values.
+    """
+
+    def __init__(self, values: np.ndarray, order: Optional[np.ndarray] = None,
+                 sorted_values: Optional[np.ndarray] = None):
+        self.values = values
+        self._order = order
+        self._sorted = sorted_values
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def _sort(self) -> None:
+        if self._order is None:
+            known = np.flatnonzero(~np.isnan(self.values))
+            order = known[np.argsort(self.values[known], kind="stable")]
+            self._sorted = self.values[order]
+            self._order = order
+
+    def sorted_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the ids of the documents with a value, sorted by value, and their sorted values."""
+        self._sort()
+        return self._order, self._sorted
+
+    def range_mask(self, low: Optional[float], high: Optional[float]) -> np.ndarray:
+        """
+        Return the mask of the documents whose value is within [low, high], either bound being optional.
+        """
+        self._sort()
+        start = 0 if low is None else np.searchsorted(self._sorted, low, side="left")
+        stop = len(self._sorted) if high is None else np.searchsorted(self._sorted, high, side="right")
+        mask = np.zeros(len(self.values), dtype=bool)
+        mask[self._order[start:stop]] = True
+        return mask
+
+    def extended(self, values: np.ndarray) -> "SortedIndex":
+        return SortedIndex(np.concatenate([self.values, values]))
+
+
+class FacetIndex:
+    """
+    Sorted indexes of the publication date and duration of every document.
+
+    Deleted documents keep their values: retrieval already skips them.
+    """
+
+    def __init__(self, published: SortedIndex, duration: SortedIndex):
+        self.published = published
+        self.duration = duration
+
+    @classmethod
+    def from_episodes(cls, episodes: Iterable[Mapping]) -> "FacetIndex":
+        published, durations = _facet_values(episodes)
+        return cls(SortedIndex(published), SortedIndex(durations))
+
+    def __len__(self) -> int:
+        return len(self.published)
+
+    def updated(self, added: Sequence[Tuple[int, Mapping]], deleted: Collection[int]) -> "FacetIndex":
+        """
+        Return a copy of the index with episodes added, their ids continuing the current ones.
+        """
+        if not added:
+            return self
+        published, durations = _facet_values(episode for _, episode in added)
+        return FacetIndex(self.published.extended(published), self.duration.extended(durations))
+
+
+class ShowIndex:
+    """
+    Sorted ids of the documents of each show (feed). With deduplication a
+    document can belong to several shows.
+    """
+
+    def __init__(self, feeds: Optional[Sequence[Sequence[str]]], num_docs: int):
+        doc_ids: Dict[str, list] = {}
+        for doc_id, doc_feeds in enumerate(feeds or ()):
+            for feed in doc_feeds:
+                doc_ids.setdefault(feed, []).append(doc_id)
+        self.num_docs = num_docs
+        self.doc_ids: Dict[str, np.ndarray] = {feed: np.array(ids, dtype=np.uint32) for feed, ids in doc_ids.items()}
+
+    @classmethod
+    def from_doc_ids(cls, doc_ids: Mapping[str, np.ndarray], num_docs: int) -> "ShowIndex":
+        """Wrap the document ids of each show, e.g. arrays mapped from a snapshot file."""
+        index = cls((), num_docs)
+        index.doc_ids = dict(doc_ids)
+        return index
+
+    @property
+    def shows(self) -> Dict[str, int]:
+        """Number of documents of each show."""
+        return {feed: len(ids) for feed, ids in sorted(self.doc_ids.items())}
+
+    def mask(self, shows: Iterable[str]) -> np.ndarray:
+        """
+        Return the mask of the documents of any of `shows`, given as feed names with or without FEED_PREFIX.
+        """
+        mask = np.zeros(self.num_docs, dtype=bool)
+        for show in shows:
+            ids = self.doc_ids.get(show)
+            if ids is None:
+                ids = self.doc_ids.get(FEED_PREFIX + show)
+            if ids is not None:
+                mask[ids] = True
+        return mask
+
+
+def _day_start(day: date) -> float:
+    return datetime.combine(day, time.min, tzinfo=timezone.utc).timestamp()
+
+
+class FacetFilter:
+    """
+    Restriction of a search to some shows, a publication date range and a
+    duration range. Unset criteria do not filter.
+
+    Args:
+        shows: Shows (feed names) to search, any of them matching
+        published_after: First publication day, inclusive (UTC)
+        published_before: Last publication day, inclusive (UTC)
+        min_duration: Minimum duration in seconds, inclusive
+        max_duration: Maximum duration in seconds, inclusive
+    """
+
+    def __init__(self, shows: Iterable[str] = (), published_after: Optional[date] = None,
+                 published_before: Optional[date] = None, min_duration: Optional[float] = None,
+                 max_duration: Optional[float] = None):
+        self.shows = frozenset(show.strip().lower() for show in shows if show.strip())
+        self.published_after = published_after
+        self.published_before = published_before
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+
+    @property
+    def key(self) -> Tuple:
+        """Hashable identity of the filter, for cache keys."""
+        return (tuple(sorted(self.shows)), self.published_after, self.published_before, self.min_duration,
+                self.max_duration)
+
+    def __bool__(self) -> bool:
+        return bool(self.shows) or any(value is not None for value in self.key[1:])
+
+    def mask(self, snapshot) -> Optional[np.ndarray]:
+        """
+        Return the mask of the documents of `snapshot` matching the filter, or None if it filters nothing.
+        """
+        if not self:
+            return None
+        masks = []
+        if self.shows:
+            masks.append(get_show_index(snapshot).mask(self.shows))
+        index = get_index(snapshot)
+        if self.published_after is not None or self.published_before is not None:
+            low = None if self.published_after is None else _day_start(self.published_after)
+            high = None if self.published_before is None else _day_start(self.published_before) + 86400 - 1e-3
+            masks.append(index.published.range_mask(low, high))
+        if self.min_duration is not None or self.max_duration is not None:
+            masks.append(index.duration.range_mask(self.min_duration, self.max_duration))
+        # Narrowest first, so the intersection stops early when nothing matches
+        masks.sort(key=np.count_nonzero)
+        mask = masks[0]
+        for other in masks[1:]:
+            if not mask.any():
+                break
+            mask = mask & other
+        return mask
+
+
+def get_index(snapshot) -> FacetIndex:
+    """
+    Return the date and duration indexes of a corpus snapshot, building them on first use.
+    """
+    return snapshot.derived("facets", lambda s: FacetIndex.from_episodes(s.documents))
+
+
+def get_show_index(snapshot) -> ShowIndex:
+    """
+    Return the show bitmaps of a corpus snapshot, building them from its feeds on first use.
+    """
+    return snapshot.derived("facets:shows", lambda s: ShowIndex(s.feeds, len(s.documents)))
@@ -0,0 +1,198 @@
+"""
+Fast flatteners for feed items, producing exactly the output of the reference
+implementations utils.flatten_hbr_json and utils.flatten_json.
+
+A flattener is created per feed and compiles a plan for each (key, shape) of
+the top-level fields it sees, where the shape of a dict is its keys and the
+shape of any other value is its type. A plan is a step writing the field into
+the output dict, with the output keys of the field computed once. Items of a
+feed share a handful of shapes, so after the first items every field is
+flattened by a precompiled step; nested values of unusual fields are
+flattened iteratively, without intermediate lists or dicts.
+
+Both feed layouts repeat the long text of an episode under several keys
+(e.g. description and summary), so long text is cleaned once per item.
+"""
+import re
+from typing import Callable, Dict, Hashable, List, Tuple
+
+HTML_TAG_RE = re.compile(r'<[^>]+>')
+
+# Most plans compiled per flattener; fields of further shapes are flattened without caching their plan
+MAX_PLANS = 1024
+
+# Text at least this long is cleaned once per item, however many fields repeat it
+MIN_REPEATED_TEXT = 64
+
+# Writes a field into the flattened item, given the text already cleaned for the item
+Step = Callable[[dict, object, Dict[str, str]], None]
+
+
+def clean_text(text) -> str:
+    """
+    Same as utils.remove_html_tags, skipping the regex for text without tags.
+    """
+    if not text:
+        return ""
+    if "<" in text:
+        text = HTML_TAG_RE.sub("", text)
+    return " ".join(text.split())
+
+
+def _clean_once(text, cleaned: Dict[str, str]) -> str:
+    if type(text) is str and len(text) >= MIN_REPEATED_TEXT:
+        result = cleaned.get(text)
+        if result is None:
+            result = cleaned[text] = clean_text(text)
+        return result
+    return clean_text(text)
+
+
+class _PlannedFlattener:
+
+    def __init__(self):
+        self._plans: Dict[Hashable, Step] = {}
+
+    def __call__(self, item: dict) -> dict:
+        flattened = {}
+        cleaned = {}
+        plans = self._plans
+        for key, value in item.items():
+            shape = (key, tuple(value)) if isinstance(value, dict) else (key, type(value))
+            step = plans.get(shape)
+            if step is None:
+                step = self._compile(key, value)
+                if len(plans) < MAX_PLANS:
+                    plans[shape] = step
+            step(flattened, value, cleaned)
+        return flattened
+
+    def _compile(self, key: str, value) -> Step:
+        raise NotImplementedError
+
+
+def _flatten_nested(flattened: dict, value, parent_key: str, cleaned: Dict[str, str], sep: str = "_") -> None:
+    """
+    Iterative utils.flatten_hbr_json of a nested dict or list, writing into `flattened`.
+    """
+    # Iterators of the containers being flattened, deepest last
+    stack: List[Tuple[str, object, bool]] = [
+        (parent_key, iter(value.items()) if isinstance(value, dict) else enumerate(value), isinstance(value, dict))]
+    while stack:
+        prefix, entries, in_dict = stack[-1]
+        for key, child in entries:
+            new_key = f"{prefix}{sep}{key}" if prefix else (key if in_dict else str(key))
+            if isinstance(child, dict):
+                stack.append((new_key, iter(child.items()), True))
+                break
+            if isinstance(child, list):
+                stack.append((new_key, enumerate(child), False))
+                break
+            # Scalars in lists are kept as they are
+            flattened[new_key] = _clean_once(child, cleaned) if in_dict else child
+        else:
+            stack.pop()
+
+
+class HbrJsonFlattener(_PlannedFlattener):
+    """
+    Flattener of the items of an HBR feed, equivalent to utils.flatten_hbr_json.
+    """
+
+    def __call__(self, item) -> dict:
+        if not isinstance(item, dict):
+            flattened = {}
+            if isinstance(item, list):
+                _flatten_nested(flattened, item, "", {})
+            return flattened
+        return super().__call__(item)
+
+    def _compile(self, key: str, value) -> Step:
+        if isinstance(value, dict):
+            fields = tuple((name, f"{key}_{name}" if key else name) for name in value)
+
+            def step(flattened, value, cleaned):
+                for name, flat_key in fields:
+                    child = value[name]
+                    if isinstance(child, (dict, list)):
+                        _flatten_nested(flattened, child, flat_key, cleaned)
+                    else:
+                        flattened[flat_key] = _clean_once(child, cleaned)
+            return step
+
+        if isinstance(value, list):
+            return lambda flattened, value, cleaned: _flatten_nested(flattened, value, key, cleaned)
+
+        def step(flattened, value, cleaned):
+            flattened[key] = _clean_once(value, cleaned)
+        return step
+
+
+class JsonFlattener(_PlannedFlattener):
+    """
+    Flattener of feed items in the default layout, equivalent to utils.flatten_json.
+    """
+
+    def _compile(self, key: str, value) -> Step:
+        if isinstance(value, dict):
+            if '__prefix' in value and '__text' in value:
+                return self._compile_prefixed(key)
+            fields = tuple((name, f"{key}{name}") for name in value if name.startswith('__'))
+
+            def step(flattened, value, cleaned):
+                for name, flat_key in fields:
+                    flattened[flat_key] = _clean_once(value[name], cleaned)
+            return step
+
+        if isinstance(value, list):
+            if key == 'title':
+                return self._compile_title(key)
+            if key == 'content':
+                return self._compile_content(key)
+            return lambda flattened, value, cleaned: None
+
+        if isinstance(value, (str, int, float, bool)):
+            def step(flattened, value, cleaned):
+                flattened[key] = _clean_once(value, cleaned)
+            return step
+
+        return lambda flattened, value, cleaned: None
+
+    @staticmethod
+    def _compile_prefixed(key: str) -> Step:
+        # Prefixes vary between items with the same keys, so their output keys are cached as they are seen
+        flat_keys: Dict[str, str] = {}
+
+        def step(flattened, value, cleaned):
+            prefix = value['__prefix']
+            flat_key = flat_keys.get(prefix)
+            if flat_key is None:
+                flat_key = flat_keys[prefix] = f"{key}__{prefix}"
+            flattened[flat_key] = value['__text']
+        return step
+
+    @staticmethod
+    def _compile_title(key: str) -> Step:
+        def step(flattened, value, cleaned):
+            first = value[0]
+            if isinstance(first, dict):
+                flattened[f"{key}__{first['__prefix']}"] = first['__text']
+            else:
+                flattened[key] = _clean_once(first, cleaned)
+        return step
+
+    @staticmethod
+    def _compile_content(key: str) -> Step:
+        flat_keys: Dict[Tuple[int, str], str] = {}
+
+        def step(flattened, value, cleaned):
+            for i, content_item in enumerate(value):
+                for media_key, media_value in content_item.items():
+                    if media_key.startswith('_'):
+                        flat_key = flat_keys.get((i, media_key))
+                        if flat_key is None:
+                            flat_key = flat_keys[(i, media_key)] = f"{key}_{i}_{media_key}"
+                        flattened[flat_key] = media_value
+                    elif media_key == 'player':
+                        flattened[f"{key}_{i}_player_url"] = media_value.get('_url')
+        return step
@@ -0,0 +1,123 @@
+"""
+Fusion of the first-stage retrieval (BM25 or dense) and rerank scores of
+the candidates of a search into the final ranking.
+
+Modes:
+    rerank    order by rerank relevance score only; candidates the reranker
+              did not return are dropped
+    rrf       reciprocal rank fusion: sum of weight / (RRF_K + rank) over the
+              two rankings, so only positions matter
+    weighted  weighted sum of the rerank relevance score and of the
+              first-stage score, min-max normalized over the candidates
+
+The top results are selected with a bounded heap, in O(n log k) for n
+candidates and k results.
+"""
+import heapq
+import math
+import os
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+FUSION_MODES = ("rerank", "rrf", "weighted")
+
+# How the final ranking combines first-stage and rerank scores, one of FUSION_MODES
+RANK_FUSION = os.environ.get("RANK_FUSION", "rerank")
+
+# Share of the fused score given to the reranker in the rrf and weighted modes, the rest to first-stage retrieval
+FUSION_RERANK_WEIGHT = float(os.environ.get("FUSION_RERANK_WEIGHT", "0.7"))
+
+# Rank offset of reciprocal rank fusion; larger values flatten the difference between top and lower ranks
+RRF_K = float(os.environ.get("RRF_K", "60"))
+
+# (document id, scores) of a ranked result; scores has "retrieval", and "rerank" and "fused" when known
+ScoredHit = Tuple[int, Dict[str, float]]
+
+
+def _normalizer(scores: Sequence[float]):
+    low, high = min(scores), max(scores)
+    if high <= low:
+        return lambda score: 1.0
+    return lambda score: (score - low) / (high - low)
+
+
+def fuse(hits: Sequence[Tuple[int, float]], rerank_results: Sequence[Mapping], num_results: int,
+         mode: Optional[str] = None, rerank_weight: Optional[float] = None) -> List[ScoredHit]:
+    """
+    Rank the candidates of a search by combining their first-stage and rerank scores.
+
+    Args:
+        hits: (document id, first-stage score) pairs, best match first, as sent to rerank
+        rerank_results: Rerank results, with `index` into `hits` and `relevanceScore`
+        num_results: Maximum number of results
+        mode: One of FUSION_MODES (default: RANK_FUSION)
+        rerank_weight: Share of the reranker in the fused score (default: FUSION_RERANK_WEIGHT)
+    Returns:
+        (document id, scores) pairs, most relevant first
+    Raises:
+        ValueError: If the mode is unknown
+    """
+    mode = mode or RANK_FUSION
+    weight = FUSION_RERANK_WEIGHT if rerank_weight is None else rerank_weight
+    if mode not in FUSION_MODES:
+        raise ValueError(f"Unknown rank fusion mode: {mode}")
+    if not hits or num_results <= 0:
+        return []
+
+    # Rerank results come most relevant first, so their position is the rerank rank
+    reranked = {}
+    for rank, result in enumerate(rerank_results):
+        reranked.setdefault(int(result["index"]), (rank, float(result["relevanceScore"])))
+
+    if mode == "rerank":
+        # Iterate in rerank order so equal scores keep the order the reranker returned them in
+        scored = ((score, index) for index, (_, score) in reranked.items())
+    elif mode == "rrf":
+        scored = (((weight / (RRF_K + reranked[index][0] + 1) if index in reranked else 0.0)
+                   + (1 - weight) / (RRF_K + index + 1), index)
+                  for index in range(len(hits)))
+    else:
+        normalize = _normalizer([score for _, score in hits])
+        scored = (((weight * reranked[index][1] if index in reranked else 0.0)
+                   + (1 - weight) * normalize(hits[index][1]), index)
+                  for index in range(len(hits)))
+
+    # Ties go to the candidate seen first, i.e. ranked higher by the reranker or the first stage
+    top = heapq.nlargest(num_results, scored, key=lambda entry: entry[0])
+    results = []
+    for fused, index in top:
+        doc_id, retrieval_score = hits[index]
+        scores = {"retrieval": float(retrieval_score)}
+        if index in reranked:
+            scores["rerank"] = reranked[index][1]
+        if mode != "rerank":
+            scores["fused"] = fused
+        results.append((doc_id, scores))
+    return results
+
+
+def first_stage_results(hits: Sequence[Tuple[int, float]], num_results: int) -> List[ScoredHit]:
+    """
+    Return the first `num_results` hits in first-stage order, with their retrieval score.
+    """
+    return [(doc_id, {"retrieval": float(score)}) for doc_id, score in hits[:num_results]]
+
+
+def first_stage_confidence(hits: Sequence[Tuple[int, float]], num_results: int) -> float:
+    """
+    Confidence of the first stage in its top `num_results` hits: the score gap
+    between the last of them and the best hit left out, relative to the spread
+    of the scores of all hits. 0 when no hit is left out or scores are all
+    equal, up to 1 when the top hits stand apart from the rest.
+
+    Args:
+        hits: (document id, first-stage score) pairs, best match first
+        num_results: Number of results the search returns
+    Returns:
+        Confidence between 0 and 1
+    """
+    if num_results <= 0 or len(hits) <= num_results:
+        return 0.0
+    spread = hits[0][1] - hits[-1][1]
+    if not spread > 0 or not math.isfinite(spread):
+        return 0.0
+    return max(0.0, (hits[num_results - 1][1] - hits[num_results][1]) / spread)
@@ -0,0 +1,97 @@
+"""
+HTTP conditional requests for the corpus endpoints.
+
+Responses carry an ETag derived from the corpus version hash (see
+corpus.CorpusSnapshot) and the representation, a Last-Modified date and a
+Cache-Control policy. Requests whose If-None-Match (or, without it,
+If-Modified-Since) validator still matches are answered 304 Not Modified
+before any episode is read or reranked.
+"""
+import hashlib
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Mapping, Optional, Tuple
+
+from fastapi import Response
+
+# Cache-Control of /episodes and /search responses; clients and CDNs revalidate with the ETag once stale
+EPISODES_CACHE_CONTROL = os.environ.get("EPISODES_CACHE_CONTROL", "public, max-age=60")
+SEARCH_CACHE_CONTROL = os.environ.get("SEARCH_CACHE_CONTROL", "public, max-age=60")
+# Cache-Control of responses that must not be reused, e.g. searches ranked without the reranker
+NO_STORE = "no-store"
+
+
+def make_etag(snapshot, *variant) -> str:
+    """
+    Return a strong ETag for a representation of `snapshot`.
+
+    Args:
+        snapshot: Corpus snapshot the response is built from
+        variant: Anything else the body depends on beyond the URL, e.g. the negotiated format
+    Returns:
+        The quoted entity tag
+    """
+    if not variant:
+        return f'"{snapshot.version_hash}"'
+    digest = hashlib.blake2b(repr((snapshot.version_hash,) + variant).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def validators(snapshot, etag: str, cache_control: str, vary: Optional[str] = None) -> Dict[str, str]:
+    """
+    Return the ETag, Last-Modified, Cache-Control and, if given, Vary headers of a response built from `snapshot`.
+    """
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(snapshot.last_modified, usegmt=True),
+        "Cache-Control": cache_control,
+    }
+    if vary is not None:
+        headers["Vary"] = vary
+    return headers
+
+
+def _opaque_tag(tag: str) -> str:
+    # If-None-Match uses the weak comparison, so W/"x" matches "x"
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def is_not_modified(request_headers: Mapping[str, str], etag: str, last_modified: int) -> bool:
+    """
+    Evaluate the preconditions of a GET request against the current validators (RFC 9110, 13.2.2).
+
+    If-Modified-Since is only considered when If-None-Match is absent.
+    """
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {_opaque_tag(tag.strip()) for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError, IndexError):
+        return False
+    if since.tzinfo is None:
+        return False
+    return last_modified <= since.timestamp()
+
+
+def not_modified(headers: Dict[str, str]) -> Response:
+    """
+    Return an empty 304 response carrying the validators of the representation.
+    """
+    return Response(status_code=304, headers=headers)
+
+
+def conditional(request_headers: Mapping[str, str], snapshot, etag: str, cache_control: str,
+                vary: Optional[str] = None) -> Tuple[Dict[str, str], Optional[Response]]:
+    """
+    Return the validator headers of a response, and the 304 response to send instead of it if the client's copy
+    is still current. Both carry the same headers.
+    """
+    headers = validators(snapshot, etag, cache_control, vary)
+    if is_not_modified(request_headers, etag, snapshot.last_modified):
+        return headers, not_modified(headers)
+    return headers, None
@@ -0,0 +1,203 @@
+import hashlib
+from array import array
+from collections import Counter
+from collections.abc import Sequence
+from typing import Collection, Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
+
+import dedup
+from episode_store import encode_episode
+
+# Keys holding the GUID of a flattened episode, in both feed layouts
+GUID_KEYS = ("guid___text", "guid__text", "guid")
+
+Added = List[Tuple[int, Mapping]]
+
+
+def item_key(episode: Mapping, digest: bytes) -> str:
+    """
+    Identity of a feed item across versions of its feed: its GUID, or the hash
+    of its content for items without one.
+    """
+    for key in GUID_KEYS:
+        value = episode.get(key)
+        if isinstance(value, str) and value:
+            return value
+    return digest.hex()
+
+
+class AppendedEpisodes(Sequence):
+    """
+    Documents of a base sequence followed by documents added since it was loaded.
+
+    Extending creates a new object sharing the base, so snapshots holding the
+    previous one keep seeing the same documents.
+    """
+
+    def __init__(self, base: Sequence[Mapping], added: Tuple[Mapping, ...]):
+        self.base = base
+        self.added = added
+
+    @classmethod
+    def extend(cls, documents: Sequence[Mapping], added: Iterable[Mapping]) -> "AppendedEpisodes":
+        if isinstance(documents, cls):
+            return cls(documents.base, documents.added + tuple(added))
+        return cls(documents, tuple(added))
+
+    def __len__(self) -> int:
+        return len(self.base) + len(self.added)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < len(self.base):
+            return self.base[index]
+        return self.added[index - len(self.base)]
+
+    def encoded(self, index: int) -> bytes:
+        """
+        Return the compact JSON encoding of a document, without decoding it if the base holds it encoded.
+        """
+        if index < len(self.base) and hasattr(self.base, "encoded"):
+            return self.base.encoded(index)
+        return encode_episode(self[index])
+
+
+class LiveEpisodes(Sequence):
+    """
+    The documents that are not deleted, in document id order.
+
+    The positions of the live documents are only computed when the sequence is
+    first indexed, so updates that are never listed cost nothing here.
+    """
+
+    def __init__(self, documents: Sequence[Mapping], deleted: Collection[int]):
+        self.documents = documents
+        self.deleted = deleted
+        self._ids: Optional[array] = None
+
+    def _live_ids(self) -> array:
+        if self._ids is None:
+            deleted = self.deleted
+            self._ids = array("I", (i for i in range(len(self.documents)) if i not in deleted))
+        return self._ids
+
+    def __len__(self) -> int:
+        return len(self._live_ids())
+
+    def __getitem__(self, index):
+        ids = self._live_ids()
+        if isinstance(index, slice):
+            return [self.documents[i] for i in ids[index]]
+        return self.documents[ids[index]]
+
+    def doc_ids(self, start: int, stop: int) -> array:
+        """
+        Return the document ids of the live documents start to stop.
+        """
+        return self._live_ids()[start:stop]
+
+    def encoded(self, index: int) -> bytes:
+        doc_id = self._live_ids()[index]
+        encoded = getattr(self.documents, "encoded", None)
+        return encoded(doc_id) if encoded is not None else encode_episode(self.documents[doc_id])
+
+
+class FeedState:
+    """
+    What each feed file contributed to the corpus, for applying a new version
+    of a feed as a diff instead of reloading every file.
+
+    Items are identified within their feed by `item_key` and compared by the
+    hash of their encoding. A document id is deleted when no feed holds an item
+    for it anymore; with deduplication a document can be held by several feeds.
+    """
+
+    def __init__(self, deduplicate: bool = dedup.DEDUP_EPISODES):
+        self.deduplicator = dedup.Deduplicator() if deduplicate else None
+        self._feeds: List[List[str]] = []
+        self._items: Dict[str, Dict[str, Tuple[int, bytes]]] = {}
+        self._references: Dict[str, Counter] = {}
+
+    @property
+    def feeds(self) -> List[List[str]]:
+        """Feeds holding each document, by document id."""
+        return self.deduplicator.feeds if self.deduplicator is not None else self._feeds
+
+    def __len__(self) -> int:
+        return len(self.feeds)
+
+    def _keyed_items(self, episodes: Iterable[Mapping]) -> Iterator[Tuple[str, bytes, Mapping]]:
+        occurrences: Counter = Counter()
+        for episode in episodes:
+            digest = hashlib.sha1(encode_episode(episode)).digest()
+            key = item_key(episode, digest)
+            occurrences[key] += 1
+            # Items repeating a key within a feed are told apart by their rank
+            yield (key if occurrences[key] == 1 else f"{key}#{occurrences[key]}"), digest, episode
+
+    def _insert(self, feed: str, episode: Mapping, replaces: Optional[int] = None) -> Tuple[int, bool]:
+        if self.deduplicator is not None:
+            doc_id, new = self.deduplicator.place(episode, feed, exclude=replaces)
+        else:
+            doc_id, new = len(self._feeds), True
+            self._feeds.append([feed])
+        self._references.setdefault(feed, Counter())[doc_id] += 1
+        return doc_id, new
+
+    def _release(self, feed: str, doc_id: int) -> bool:
+        references = self._references[feed]
+        references[doc_id] -= 1
+        if references[doc_id]:
+            return False
+        del references[doc_id]
+        if self.deduplicator is not None:
+            return self.deduplicator.remove(doc_id, feed)
+        self._feeds[doc_id] = [name for name in self._feeds[doc_id] if name != feed]
+        return not self._feeds[doc_id]
+
+    def ingest(self, feeds: Iterable[Tuple[str, Iterable[Mapping]]]) -> Iterator[Mapping]:
+        """
+        Yield the documents of a full load, in document id order.
+        """
+        for feed, episodes in feeds:
+            items = self._items.setdefault(feed, {})
+            for key, digest, episode in self._keyed_items(episodes):
+                doc_id, new = self._insert(feed, episode)
+                items[key] = (doc_id, digest)
+                if new:
+                    yield episode
+
+    def apply(self, feed: str, episodes: Iterable[Mapping]) -> Tuple[Added, Set[int]]:
+        """
+        Replace the items of `feed` with `episodes`; an empty list removes the feed.
+
+        Returns:
+            The new documents as (document id, episode) pairs, and the ids of
+            the documents deleted
+        """
+        old_items = self._items.get(feed, {})
+        new_items = {key: (digest, episode) for key, digest, episode in self._keyed_items(episodes)}
+        deleted: Set[int] = set()
+        for key, (doc_id, digest) in old_items.items():
+            if key not in new_items or new_items[key][0] != digest:
+                if self._release(feed, doc_id):
+                    deleted.add(doc_id)
+
+        added: Added = []
+        items = {}
+        for key, (digest, episode) in new_items.items():
+            if key in old_items and old_items[key][1] == digest:
+                items[key] = old_items[key]
+                continue
+            # An updated item is not merged back into its previous version, which other feeds may still hold
+            doc_id, new = self._insert(feed, episode, old_items[key][0] if key in old_items else None)
+            items[key] = (doc_id, digest)
+            if new:
+                added.append((doc_id, episode))
+        if items:
+            self._items[feed] = items
+        else:
+            self._items.pop(feed, None)
+        return added, deleted
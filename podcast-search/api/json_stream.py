@@ -0,0 +1,188 @@
+import json
+import re
+from typing import Any, Iterator, Optional, Sequence, TextIO
+
+# Characters to read from the file per refill of the scan buffer
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+_STRING_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"')
+_STRUCTURE_RE = re.compile(r'[\[\]{}"]')
+_SCALAR_RE = re.compile(r"[^,\]}\s]+")
+
+_DECODER = json.JSONDecoder()
+
+
+class _Scanner:
+    """
+    Minimal pull scanner over a JSON text stream.
+
+    Only the text from the read position onwards is kept in memory: consumed
+    text is dropped whenever the buffer is refilled.
+    """
+
+    def __init__(self, fp: TextIO, chunk_size: int):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def more(self, size: Optional[int] = None) -> bool:
+        if self.eof:
+            return False
+        chunk = self.fp.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character, or '' at the end of the stream."""
+        while True:
+            self.pos = _WHITESPACE_RE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.more():
+                return ""
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} but found {found!r}")
+        self.pos += 1
+
+    def _match(self, pattern: re.Pattern) -> str:
+        while True:
+            match = pattern.match(self.buf, self.pos)
+            # A match reaching the end of the buffer may continue in the next chunk
+            if match and (match.end() < len(self.buf) or self.eof):
+                self.pos = match.end()
+                return match.group()
+            if not self.more():
+                if match:
+                    self.pos = match.end()
+                    return match.group()
+                raise ValueError("Unexpected end of JSON stream")
+
+    def read_string(self) -> str:
+        if self.peek() != '"':
+            raise ValueError("Expected a JSON string")
+        return json.loads(self._match(_STRING_RE))
+
+    def skip_value(self) -> None:
+        """Move past the next value without building it."""
+        char = self.peek()
+        if char == '"':
+            self._match(_STRING_RE)
+            return
+        if char not in "[{":
+            if not char:
+                raise ValueError("Unexpected end of JSON stream")
+            self._match(_SCALAR_RE)
+            return
+        depth = 0
+        while True:
+            match = _STRUCTURE_RE.search(self.buf, self.pos)
+            if match is None:
+                self.pos = len(self.buf)
+                if not self.more():
+                    raise ValueError("Unexpected end of JSON stream")
+                continue
+            self.pos = match.start()
+            char = match.group()
+            if char == '"':
+                self._match(_STRING_RE)
+                continue
+            self.pos += 1
+            depth += 1 if char in "[{" else -1
+            if depth == 0:
+                return
+
+    def read_value(self) -> Any:
+        """Decode the next value, holding only its own text in memory."""
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+                if not isinstance(value, (dict, list, str)):
+                    # Numbers and literals are not delimited and may continue in the next chunk
+                    end = max(end, _SCALAR_RE.match(self.buf, self.pos).end())
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Grow reads geometrically so values larger than a chunk stay linear to decode
+            self.more(max(self.chunk_size, len(self.buf) - self.pos))
+
+
+def iter_items(fp: TextIO, path: Sequence[str], chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Any]:
+    """
+    Incrementally yield the elements of the array found at `path` in a JSON document.
+
+    Peak memory is bounded by the size of the largest element (plus one read
+    chunk) instead of the size of the document. Values outside `path` are
+    skipped without being decoded. A single object at `path` is yielded as one
+    element, matching how XML-to-JSON converters encode one-item feeds.
+
+    Args:
+        fp: Text stream positioned at the start of the document
+        path: Object keys leading to the array, e.g. ("rss", "channel", "item")
+        chunk_size: Characters read from `fp` at a time
+    Yields:
+        Decoded elements of the array, in document order
+    Raises:
+        ValueError: If the document is malformed
+    """
+    scanner = _Scanner(fp, chunk_size)
+    if scanner.peek() == "\ufeff":
+        scanner.pos += 1
+    yield from _iter_path(scanner, list(path))
+
+
+def _iter_path(scanner: _Scanner, path: list) -> Iterator[Any]:
+    if not path:
+        char = scanner.peek()
+        if char == "[":
+            scanner.pos += 1
+            if scanner.peek() == "]":
+                scanner.pos += 1
+                return
+            while True:
+                yield scanner.read_value()
+                char = scanner.peek()
+                scanner.pos += 1
+                if char == "]":
+                    return
+                if char != ",":
+                    raise ValueError(f"Expected ',' or ']' but found {char!r}")
+        elif char == "{":
+            yield scanner.read_value()
+        else:
+            scanner.skip_value()
+        return
+
+    if scanner.peek() != "{":
+        scanner.skip_value()
+        return
+    scanner.pos += 1
+    if scanner.peek() == "}":
+        scanner.pos += 1
+        return
+    while True:
+        key = scanner.read_string()
+        scanner.expect(":")
+        if key == path[0]:
+            yield from _iter_path(scanner, path[1:])
+        else:
+            scanner.skip_value()
+        char = scanner.peek()
+        scanner.pos += 1
+        if char == "}":
+            return
+        if char != ",":
+            raise ValueError(f"Expected ',' or '}}' but found {char!r}")
@@ -0,0 +1,183 @@
+"""
+Lightweight request metrics: per-stage timers reported in a Server-Timing
+header, and counters and histograms exposed in the Prometheus text format.
+
+A stage costs two perf_counter calls, a dict update and one locked histogram
+update, so the timers stay on in production.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Upper bounds, in seconds, of the stage latency histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Stage durations of the request being handled, in seconds
+_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("timings", default=None)
+
+
+def _format_labels(labelnames: Sequence[str], labels: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """
+    Monotonic counter, optionally split by label values.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value:g}"
+
+
+class Histogram:
+    """
+    Histogram of observed values, optionally split by label values.
+
+    Counts are kept per bucket and only made cumulative when rendered.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = sorted((labels, (list(counts), total[0])) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total:g}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+        """
+        return "\n".join(line for metric in self._metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    "podcast_search_stage_seconds", "Time spent in each stage of a search request.", ["stage"]))
+SEARCH_REQUESTS = registry.register(Counter(
+    "podcast_search_requests_total", "Search requests by response status code.", ["status"]))
+QUERY_CACHE_REQUESTS = registry.register(Counter(
+    "podcast_search_query_cache_requests_total", "Query cache lookups by result (hit or miss).", ["result"]))
+RERANK_CANDIDATES = registry.register(Counter(
+    "podcast_search_rerank_candidates_total", "Candidate documents sent to the reranker."))
+RERANK_BYTES = registry.register(Counter(
+    "podcast_search_rerank_bytes_total", "Bytes of the candidate documents sent to the reranker."))
+RERANK_FALLBACKS = registry.register(Counter(
+    "podcast_search_rerank_fallbacks_total",
+    "Searches ranked locally because rerank failed (error) or its circuit breaker was open (open), "
+    "or reranked by only some of their shards (partial).", ["reason"]))
+RERANK_SKIPS = registry.register(Counter(
+    "podcast_search_rerank_skips_total", "Searches not reranked because first-stage retrieval was confident."))
+
+
+def start_request() -> contextvars.Token:
+    """
+    Start collecting the stage timings of a request in the current context.
+    """
+    return _timings.set({})
+
+
+def finish_request(token: contextvars.Token) -> Dict[str, float]:
+    """
+    Stop collecting the stage timings of a request and return them.
+    """
+    timings = _timings.get() or {}
+    _timings.reset(token)
+    return timings
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Time a stage of a request, into STAGE_SECONDS and the Server-Timing of the request.
+
+    Stages run several times per request add up. Threads started with a copy
+    of the request context (see contextvars.copy_context) report to the same
+    request.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, name)
+        timings = _timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """
+    Format stage timings as a Server-Timing header value, durations in milliseconds.
+    """
+    return ", ".join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items())
@@ -0,0 +1,184 @@
+import os
+import threading
+from array import array
+from typing import Collection, Dict, List, Mapping, Optional, Sequence, Tuple
+
+from episode_store import encode_episode
+
+# Rough number of characters per model token, used to turn token budgets into character budgets
+CHARS_PER_TOKEN = 4
+
+# Flattened key base name -> field name in the rerank document
+CANONICAL_FIELDS = {
+    "title": "title",
+    "subtitle": "subtitle",
+    "summary": "summary",
+    "description": "description",
+    "encoded": "content",
+    "keywords": "keywords",
+}
+
+DEFAULT_FIELD_BUDGETS = "title:300,subtitle:300,summary:1500,description:2500,keywords:300"
+
+
+def parse_field_budgets(spec: str) -> Dict[str, int]:
+    """
+    Parse a "field:chars,field:chars" allowlist, e.g. "title:300,summary:1500".
+
+    Fields are kept in the order given, which is the order they appear in the
+    rerank document.
+    """
+    budgets = {}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        field, _, chars = entry.partition(":")
+        if field.strip() not in CANONICAL_FIELDS.values():
+            raise ValueError(f"Unknown rerank document field: {field.strip()}")
+        budgets[field.strip()] = int(chars)
+    return budgets
+
+
+def truncate(text: str, max_chars: int) -> str:
+    """
+    Cut text to at most `max_chars` characters, at a word boundary when possible.
+    """
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    space = cut.rfind(" ")
+    return cut[:space] if space > max_chars // 2 else cut
+
+
+class RerankProjection:
+    """
+    Turns a flattened episode into the compact JSON document sent to the reranker.
+
+    Only allowlisted text fields are kept (player URLs, enclosures and images
+    carry no ranking signal), each cut to its character budget, and the whole
+    document to `max_tokens`. Values repeated under several keys, like an
+    itunes:title equal to the title, are sent once.
+    """
+
+    def __init__(self, field_budgets: Dict[str, int], max_tokens: int):
+        self.field_budgets = field_budgets
+        self.max_tokens = max_tokens
+        self.key = f"{sorted(field_budgets.items())}:{max_tokens}"
+
+    def project(self, episode: Mapping) -> Dict[str, str]:
+        values: Dict[str, str] = {}
+        for key, value in episode.items():
+            if not isinstance(value, str) or not value or key.endswith("prefix"):
+                continue
+            field = CANONICAL_FIELDS.get(key.split("_", 1)[0])
+            if field in self.field_budgets and field not in values:
+                values[field] = value
+
+        document = {}
+        seen = set()
+        remaining = self.max_tokens * CHARS_PER_TOKEN
+        for field, budget in self.field_budgets.items():
+            value = values.get(field)
+            if value is None or value in seen or remaining <= 0:
+                continue
+            seen.add(value)
+            document[field] = truncate(value, min(budget, remaining))
+            remaining -= len(document[field])
+        return document
+
+
+class RerankDocuments:
+    """
+    Projected rerank documents of every episode in a snapshot, with their
+    encoded sizes and the sizes the full episodes would have had.
+    """
+
+    def __init__(self, episodes, projection: RerankProjection):
+        self.projection = projection
+        self.documents: List[Dict[str, str]] = []
+        self.sizes = array("I")
+        self.full_sizes = array("I")
+        # Documents added by `updated`: doc id -> (document, size, full size)
+        self.added: Dict[int, Tuple[Dict[str, str], int, int]] = {}
+        for episode in episodes:
+            document, size, full_size = self._project(episode)
+            self.documents.append(document)
+            self.sizes.append(size)
+            self.full_sizes.append(full_size)
+
+    def _project(self, episode: Mapping) -> Tuple[Dict[str, str], int, int]:
+        document = self.projection.project(episode)
+        return document, len(encode_episode(document)), len(encode_episode(episode))
+
+    def __getitem__(self, doc_id: int) -> Dict[str, str]:
+        if doc_id < len(self.documents):
+            return self.documents[doc_id]
+        return self.added[doc_id][0]
+
+    def size(self, doc_id: int) -> int:
+        return self.sizes[doc_id] if doc_id < len(self.sizes) else self.added[doc_id][1]
+
+    def full_size(self, doc_id: int) -> int:
+        return self.full_sizes[doc_id] if doc_id < len(self.full_sizes) else self.added[doc_id][2]
+
+    def updated(self, added: Sequence[Tuple[int, Mapping]], deleted: Collection[int]) -> "RerankDocuments":
+        """
+        Return a copy with the documents of added episodes, sharing the existing ones.
+        """
+        documents = RerankDocuments((), self.projection)
+        documents.documents, documents.sizes, documents.full_sizes = self.documents, self.sizes, self.full_sizes
+        documents.added = dict(self.added)
+        for doc_id, episode in added:
+            documents.added[doc_id] = self._project(episode)
+        return documents
+
+
+class PayloadStats:
+    """
+    Running totals of the bytes sent to the reranker, and of the bytes the
+    same requests would have sent with whole episodes as documents.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.documents = 0
+        self.projected_bytes = 0
+        self.full_bytes = 0
+
+    def record(self, documents: RerankDocuments, doc_ids: List[int]) -> int:
+        """
+        Record a rerank request sending `doc_ids`, and return its size in bytes.
+        """
+        projected = sum(documents.size(i) for i in doc_ids)
+        full = sum(documents.full_size(i) for i in doc_ids)
+        with self._lock:
+            self.requests += 1
+            self.documents += len(doc_ids)
+            self.projected_bytes += projected
+            self.full_bytes += full
+        return projected
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            requests = self.requests or 1
+            return {
+                "requests": self.requests,
+                "documents": self.documents,
+                "avg_bytes_per_request": self.projected_bytes / requests,
+                "avg_full_bytes_per_request": self.full_bytes / requests,
+                "reduction": 1 - self.projected_bytes / self.full_bytes if self.full_bytes else 0.0,
+            }
+
+
+projection = RerankProjection(parse_field_budgets(os.environ.get("RERANK_FIELD_BUDGETS", DEFAULT_FIELD_BUDGETS)),
+                              int(os.environ.get("RERANK_MAX_TOKENS", "1024")))
+
+
+def get_documents(snapshot, rerank_projection: Optional[RerankProjection] = None) -> RerankDocuments:
+    """
+    Return the rerank documents of a corpus snapshot, building them on first use.
+    """
+    rerank_projection = rerank_projection or projection
+    return snapshot.derived(f"rerank_documents:{rerank_projection.key}",
+                            lambda s: RerankDocuments(s.documents, rerank_projection))
@@ -1,21 +1,361 @@
+import asyncio
 import boto3
+import concurrent.futures
+import contextvars
+import functools
+import heapq
+import itertools
 import json
-import random
-from utils import read_podcasts_json_file, read_podcasts_json_files
+import logging
+import os
+import time
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, HTTPClientError
+from concurrent.futures import ThreadPoolExecutor
+import bm25
+import corpus
+from circuit_breaker import CircuitBreaker
+import dense_index
+import episode_store
+import fusion
+import metrics
+import projection
+from query_cache import QueryCache, normalize_query
+from singleflight import SingleFlight
 region = 'us-west-2'
 
-bedrock_agent_runtime = boto3.client('bedrock-agent-runtime',region_name='us-west-2')
+# Maximum number of rerank calls a worker runs at the same time
+RERANK_MAX_CONCURRENCY = int(os.environ.get("RERANK_MAX_CONCURRENCY", "16"))
+# Seconds an async search waits for its rerank, including time queued for a slot
+RERANK_TIMEOUT = float(os.environ.get("RERANK_TIMEOUT", "30"))
+# Most documents reranked in one call; larger candidate pools are split into shards
+RERANK_SHARD_SIZE = int(os.environ.get("RERANK_SHARD_SIZE", "1000"))
+# Maximum number of shard rerank calls running at the same time, across all searches
+RERANK_SHARD_CONCURRENCY = int(os.environ.get("RERANK_SHARD_CONCURRENCY", "4"))
+
+bedrock_agent_runtime = boto3.client(
+    'bedrock-agent-runtime',
+    region_name='us-west-2',
+    config=Config(
+        max_pool_connections=RERANK_MAX_CONCURRENCY + RERANK_SHARD_CONCURRENCY,
+        connect_timeout=5,
+        read_timeout=RERANK_TIMEOUT,
+        retries={"max_attempts": 3, "mode": "standard"}
+    )
+)
+
+# boto3 is blocking, so async callers run reranks on this bounded pool
+_rerank_executor = ThreadPoolExecutor(max_workers=RERANK_MAX_CONCURRENCY, thread_name_prefix="rerank")
+# Shards of a large candidate pool are reranked on their own pool, as the
+# searches waiting for them may already hold every _rerank_executor thread
+_shard_executor = ThreadPoolExecutor(max_workers=RERANK_SHARD_CONCURRENCY, thread_name_prefix="rerank-shard")
 
 modelId = "cohere.rerank-v3-5:0"
 model_package_arn = f"arn:aws:bedrock:{region}::foundation-model/{modelId}"
 
+# Number of first-stage hits sent to the reranker as candidates, in shards of RERANK_SHARD_SIZE
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", "200"))
+
+# First-stage retrieval used to select the candidates: "lexical" (BM25) or "dense"
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "lexical")
+
+# Skip the rerank call when the first stage is at least this confident in its top results
+# (see fusion.first_stage_confidence, between 0 and 1); 0 always reranks
+RERANK_SKIP_CONFIDENCE = float(os.environ.get("RERANK_SKIP_CONFIDENCE", "0"))
+
+# Reranked results are cached per (query, limit, corpus version, retrieval mode, fusion mode, filters)
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", "1024"))
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", "300"))
+
+query_cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+
+# Seconds a request waits for an identical rerank call already in flight
+SINGLE_FLIGHT_TIMEOUT = float(os.environ.get("SINGLE_FLIGHT_TIMEOUT", "30"))
+
+in_flight_reranks = SingleFlight()
+
+# Size of the rerank requests with projected documents vs whole episodes
+payload_stats = projection.PayloadStats()
+
+# Rerank calls stop for RERANK_BREAKER_OPEN_SECONDS once, among the last RERANK_BREAKER_WINDOW
+# calls (and at least RERANK_BREAKER_MIN_CALLS), this share failed or took RERANK_BREAKER_SLOW_SECONDS
+# or more; searches are then ranked locally until RERANK_BREAKER_PROBES calls succeed again
+RERANK_BREAKER_WINDOW = int(os.environ.get("RERANK_BREAKER_WINDOW", "20"))
+RERANK_BREAKER_MIN_CALLS = int(os.environ.get("RERANK_BREAKER_MIN_CALLS", "10"))
+RERANK_BREAKER_FAILURE_RATE = float(os.environ.get("RERANK_BREAKER_FAILURE_RATE", "0.5"))
+RERANK_BREAKER_SLOW_SECONDS = float(os.environ.get("RERANK_BREAKER_SLOW_SECONDS", "5"))
+RERANK_BREAKER_SLOW_RATE = float(os.environ.get("RERANK_BREAKER_SLOW_RATE", "0.5"))
+RERANK_BREAKER_OPEN_SECONDS = float(os.environ.get("RERANK_BREAKER_OPEN_SECONDS", "30"))
+RERANK_BREAKER_PROBES = int(os.environ.get("RERANK_BREAKER_PROBES", "2"))
+
+rerank_breaker = CircuitBreaker(
+    "bedrock-rerank",
+    window_size=RERANK_BREAKER_WINDOW,
+    min_calls=RERANK_BREAKER_MIN_CALLS,
+    failure_rate=RERANK_BREAKER_FAILURE_RATE,
+    slow_call_seconds=RERANK_BREAKER_SLOW_SECONDS,
+    slow_call_rate=RERANK_BREAKER_SLOW_RATE,
+    open_seconds=RERANK_BREAKER_OPEN_SECONDS,
+    half_open_probes=RERANK_BREAKER_PROBES,
+)
+
+# Bedrock errors that say the service is unavailable, rather than that the request is wrong
+TRANSIENT_ERROR_CODES = frozenset({
+    "ThrottlingException",
+    "ServiceQuotaExceededException",
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+})
+
+_RETRIEVERS = {
+    "lexical": bm25.get_index,
+    "dense": dense_index.get_index,
+}
+
+
+class RankedResults(list):
+    """
+    Episodes of a search, most relevant first.
+
+    `degraded` is set when they are in first-stage retrieval order because
+    rerank was unavailable. `doc_ids` are the ids of the episodes in the
+    snapshot searched, and `encoded` the encoded documents of that snapshot.
+    `scores`, when known, holds the retrieval, rerank and fused scores of
+    each episode (see fusion.fuse).
+    """
+
+    def __init__(self, episodes=(), degraded=False, doc_ids=(), encoded=None, scores=None):
+        super().__init__(episodes)
+        self.degraded = degraded
+        self.doc_ids = doc_ids
+        self.encoded = encoded
+        self.scores = scores
+
+    @classmethod
+    def from_ids(cls, snapshot, doc_ids, degraded=False):
+        doc_ids = list(doc_ids)
+        return cls((snapshot.documents[doc_id] for doc_id in doc_ids), degraded, doc_ids,
+                   episode_store.get_encoded(snapshot))
+
+    @classmethod
+    def from_scored(cls, snapshot, scored_hits, degraded=False):
+        results = cls.from_ids(snapshot, (doc_id for doc_id, _ in scored_hits), degraded)
+        results.scores = [scores for _, scores in scored_hits]
+        return results
+
+    def copy(self):
+        return RankedResults(self, self.degraded, self.doc_ids, self.encoded, self.scores)
+
+    def to_json(self, with_scores=False):
+        """
+        Encode the results as a {"results": [...]} JSON response body, joining the cached episode encodings.
+
+        With `with_scores`, each episode gets a "_scores" key holding its scores.
+        """
+        if self.encoded is not None:
+            encoded = (self.encoded[doc_id] for doc_id in self.doc_ids)
+        else:
+            encoded = map(episode_store.encode_episode, self)
+        if with_scores and self.scores is not None:
+            encoded = map(_with_scores, encoded, self.scores)
+        return episode_store.join_json("results", encoded)
+
+
+def _with_scores(encoded, scores):
+    # Splice the key into the encoded object rather than decoding it; join also takes the memoryviews of mapped
+    # snapshots, which do not support +
+    separator = b"," if len(encoded) > 2 else b""
+    return b"".join((encoded[:-1], separator, b'"_scores":', json.dumps(scores, separators=(",", ":")).encode(), b"}"))
+
+
+def config_fingerprint():
+    """
+    Ranking settings that change the results of a search for the same query and corpus, e.g. for HTTP validators.
+    """
+    return (RETRIEVAL_MODE, dense_index.DENSE_EMBEDDER, RERANK_CANDIDATES, RERANK_SHARD_SIZE, RERANK_SKIP_CONFIDENCE,
+            modelId, projection.projection.key, fusion.RANK_FUSION, fusion.FUSION_RERANK_WEIGHT, fusion.RRF_K)
+
+
+def rerank_podcasts(text_query, num_results, retrieval=None, filters=None):
+    """
+    Retrieve candidate episodes from a local index and rerank them with Cohere rerank.
+
+    Results are served from `query_cache` when the same normalized query was
+    reranked recently against the same corpus version, and concurrent requests
+    for the same cache key share a single Bedrock rerank call.
+
+    When Bedrock is throttling, timing out or failing, or `rerank_breaker` is
+    open after it did, the first-stage ranking is returned instead, marked as
+    degraded and not cached. So are the results of a sharded rerank some
+    shards of which failed.
+
+    Args:
+        text_query (str): Free text query
+        num_results (int): Maximum number of episodes to return
+        retrieval (str): First-stage retrieval, "lexical" or "dense" (default: RETRIEVAL_MODE)
+        filters (facets.FacetFilter): Shows, publication dates and durations to restrict the search to
+    Returns:
+        RankedResults: Flattened episodes, most relevant first
+    """
+    with metrics.stage("corpus"):
+        snapshot = corpus.store.snapshot()
+    retrieval = retrieval or RETRIEVAL_MODE
+    cache_key = (normalize_query(text_query), num_results, snapshot.version, retrieval, fusion.RANK_FUSION,
+                 filters.key if filters else None)
+    cached = query_cache.get(cache_key)
+    if cached is not None:
+        metrics.QUERY_CACHE_REQUESTS.inc(1, "hit")
+        return cached.copy()
+    metrics.QUERY_CACHE_REQUESTS.inc(1, "miss")
+
+    def rerank_and_cache():
+        results = _rerank_snapshot(snapshot, text_query, num_results, retrieval, filters)
+        if not results.degraded:
+            query_cache.set(cache_key, results)
+        return results
+
+    return in_flight_reranks.do(cache_key, rerank_and_cache, timeout=SINGLE_FLIGHT_TIMEOUT).copy()
+
 
-def rerank_podcasts(text_query, num_results):
+async def rerank_podcasts_async(text_query, num_results, retrieval=None, timeout=None, filters=None):
     """
+    Async variant of `rerank_podcasts` that does not block the event loop.
+
+    The blocking boto3 call runs on a pool of RERANK_MAX_CONCURRENCY threads, so
+    at most that many reranks run at once and further searches queue for a slot.
+
+    Args:
+        text_query (str): Free text query
+        num_results (int): Maximum number of episodes to return
+        retrieval (str): First-stage retrieval, "lexical" or "dense" (default: RETRIEVAL_MODE)
+        timeout (float): Seconds to wait for the results (default: RERANK_TIMEOUT)
+        filters (facets.FacetFilter): Shows, publication dates and durations to restrict the search to
+    Returns:
+        RankedResults: Flattened episodes, most relevant first
+    Raises:
+        asyncio.TimeoutError: If the results are not available within `timeout`.
+            The rerank itself keeps running and still populates the query cache.
+    """
+    loop = asyncio.get_running_loop()
+    # Run in a copy of the request context, so the stages timed in the pool count towards the request
+    call = functools.partial(contextvars.copy_context().run, rerank_podcasts, text_query, num_results, retrieval,
+                             filters)
+    return await asyncio.wait_for(loop.run_in_executor(_rerank_executor, call),
+                                  timeout if timeout is not None else RERANK_TIMEOUT)
+
+
+def _rerank_snapshot(snapshot, text_query, num_results, retrieval, filters=None):
+    allowed = None
+    if filters:
+        with metrics.stage("filter"):
+            allowed = filters.mask(snapshot)
+        if not allowed.any():
+            return RankedResults()
+    with metrics.stage("retrieve"):
+        hits = retrieve_candidate_ids(snapshot, text_query, max(RERANK_CANDIDATES, num_results), retrieval, allowed)
+    if not hits:
+        return RankedResults()
+    if RERANK_SKIP_CONFIDENCE > 0 and fusion.first_stage_confidence(hits, num_results) >= RERANK_SKIP_CONFIDENCE:
+        metrics.RERANK_SKIPS.inc()
+        return RankedResults.from_scored(snapshot, fusion.first_stage_results(hits, num_results))
+    if rerank_breaker.state == CircuitBreaker.OPEN:
+        return _rank_locally(snapshot, hits, num_results, "open")
+    with metrics.stage("prepare"):
+        doc_ids = [doc_id for doc_id, _ in hits]
+        documents = projection.get_documents(snapshot)
+        payload_bytes = payload_stats.record(documents, doc_ids)
+        podcasts_sources = prepare_text_sources([documents[doc_id] for doc_id in doc_ids])
+    metrics.RERANK_CANDIDATES.inc(len(doc_ids))
+    metrics.RERANK_BYTES.inc(payload_bytes)
+    # Fusion also ranks the candidates the reranker would have left out, so it needs all their scores
+    rerank_depth = num_results if fusion.RANK_FUSION == "rerank" else len(podcasts_sources)
+    # The breaker admits the search as one call, so a half-open breaker never reranks only some of its shards
+    if not rerank_breaker.allow():
+        return _rank_locally(snapshot, hits, num_results, "open")
+    started = time.perf_counter()
+    try:
+        with metrics.stage("rerank"):
+            rerank_results, partial = rerank_sources(text_query, podcasts_sources, rerank_depth)
+    except Exception as e:
+        if not is_transient_error(e):
+            rerank_breaker.release()
+            raise
+        rerank_breaker.record(False, time.perf_counter() - started)
+        logging.error(f"Rerank failed, ranking the candidates locally: {str(e)}")
+        return _rank_locally(snapshot, hits, num_results, "error")
+    rerank_breaker.record(not partial, time.perf_counter() - started)
+    if partial:
+        metrics.RERANK_FALLBACKS.inc(1, "partial")
+    with metrics.stage("sort"):
+        return RankedResults.from_scored(snapshot, fusion.fuse(hits, rerank_results, num_results), degraded=partial)
+
+
+def _rank_locally(snapshot, hits, num_results, reason):
+    """
+    Fallback ranking when rerank is unavailable: the first-stage (BM25 or dense) order of the candidates.
+    """
+    metrics.RERANK_FALLBACKS.inc(1, reason)
+    return RankedResults.from_scored(snapshot, fusion.first_stage_results(hits, num_results), degraded=True)
+
+
+def is_transient_error(error):
     """
-    podcasts = random.choices(list(read_podcasts_json_files()), k=1000)
-    podcasts_sources = prepare_text_sources(podcasts)
-    response = bedrock_agent_runtime.rerank(
+    Whether a rerank error means Bedrock is unavailable (throttling, timeouts,
+    connection and server errors), as opposed to a rejected request.
+    """
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code") in TRANSIENT_ERROR_CODES
+    # Before Python 3.11 neither asyncio nor concurrent.futures timeouts are the builtin TimeoutError
+    return isinstance(error, (BotocoreConnectionError, HTTPClientError, TimeoutError, asyncio.TimeoutError,
+                              concurrent.futures.TimeoutError))
+
+
+def rerank_sources(text_query, sources, num_results):
+    """
+    Rerank any number of sources, splitting them into shards of RERANK_SHARD_SIZE.
+
+    Shards are reranked concurrently and their results merged by relevance
+    score into a global top `num_results`. If some shards fail, the results
+    of the others are returned, flagged as partial; only when every shard
+    fails is the error raised.
+
+    Args:
+        text_query (str): Free text query
+        sources (list): Rerank sources, as built by `prepare_text_sources`
+        num_results (int): Maximum number of results
+    Returns:
+        tuple: Rerank results, most relevant first, with `index` into `sources`,
+            and whether some shards failed
+    """
+    if len(sources) <= RERANK_SHARD_SIZE:
+        return _rerank_shard(text_query, sources, num_results), False
+
+    offsets = range(0, len(sources), RERANK_SHARD_SIZE)
+    futures = [_shard_executor.submit(_rerank_shard, text_query, sources[offset:offset + RERANK_SHARD_SIZE],
+                                      num_results)
+               for offset in offsets]
+    shard_results = []
+    errors = []
+    for offset, future in zip(offsets, futures):
+        try:
+            shard_results.append(offset_rerank_results(future.result(), offset))
+        except Exception as e:
+            logging.error(f"Rerank of candidates {offset}-{offset + RERANK_SHARD_SIZE - 1} failed: {str(e)}")
+            errors.append(e)
+    if not shard_results:
+        raise errors[0]
+    merged = heapq.merge(*shard_results, key=lambda result: -result["relevanceScore"])
+    return list(itertools.islice(merged, num_results)), bool(errors)
+
+
+def _rerank_shard(text_query, sources, num_results):
+    return _call_rerank(text_query, sources, num_results)['results']
+
+
+def _call_rerank(text_query, sources, num_results):
+    return bedrock_agent_runtime.rerank(
         queries=[
             {
                 "type": "TEXT",
@@ -24,19 +364,61 @@ def rerank_podcasts(text_query, num_results):
                 }
             }
         ],
-        sources=podcasts_sources,
+        sources=sources,
         rerankingConfiguration={
             "type": "BEDROCK_RERANKING_MODEL",
             "bedrockRerankingConfiguration": {
-                "numberOfResults": num_results,
+                "numberOfResults": min(num_results, len(sources)),
                 "modelConfiguration": {
                     "modelArn": model_package_arn,
                 }
             }
         }
     )
-    ranked_search_results = sort_podcasts_by_rerank(podcasts, response['results'])
-    return ranked_search_results
+
+
+def offset_rerank_results(rerank_results, offset):
+    """
+    Shift the indices of a shard's rerank results by the shard's offset in
+    the candidate pool, sorted by decreasing relevance score for merging.
+    """
+    shifted = [dict(result, index=offset + int(result['index'])) for result in rerank_results]
+    shifted.sort(key=lambda result: -result["relevanceScore"])
+    return shifted
+
+
+def _clear_query_cache(snapshot):
+    query_cache.clear()
+
+
+corpus.store.add_listener(_clear_query_cache)
+
+
+def retrieve_candidate_ids(snapshot, text_query, num_candidates, retrieval=None, allowed=None):
+    """
+    Select the first-stage candidates for reranking from the BM25 or dense index.
+
+    Args:
+        snapshot (corpus.CorpusSnapshot): Corpus to search
+        text_query (str): Free text query
+        num_candidates (int): Maximum number of candidates
+        retrieval (str): "lexical" or "dense" (default: RETRIEVAL_MODE)
+        allowed (np.ndarray): Boolean mask of the document ids that may be candidates, see `facets.FacetFilter.mask`
+    Returns:
+        list: (document id, first-stage score) pairs, best match first
+    """
+    retrieval = retrieval or RETRIEVAL_MODE
+    if retrieval not in _RETRIEVERS:
+        raise ValueError(f"Unknown retrieval mode: {retrieval}")
+    return _RETRIEVERS[retrieval](snapshot).search(text_query, num_candidates, allowed)
+
+
+def retrieve_candidates(snapshot, text_query, num_candidates, retrieval=None):
+    """
+    Same as `retrieve_candidate_ids`, returning the candidate episodes.
+    """
+    hits = retrieve_candidate_ids(snapshot, text_query, num_candidates, retrieval)
+    return [snapshot.documents[doc_id] for doc_id, _ in hits]
 
 
 def prepare_text_sources(podcasts):
@@ -48,7 +430,7 @@ def prepare_text_sources(podcasts):
             "type": "INLINE",
             "inlineDocumentSource": {
                 "type": "JSON",
-                "jsonDocument": text_source
+                "jsonDocument": episode_store.to_dict(text_source)
             },
 
         })
@@ -57,6 +439,14 @@ def prepare_text_sources(podcasts):
 
 def sort_podcasts_by_rerank(podcasts, rerank_results):
     """
+    Order podcasts as ranked by the reranker.
+
+    Args:
+        podcasts (list): Candidates sent to rerank, in candidate pool order
+        rerank_results (list): Rerank results; for sharded reranks their
+            indices must already be shifted by `offset_rerank_results`
+    Returns:
+        list: Podcasts, most relevant first
     """
     podcasts_reranked = []
     for result in rerank_results:
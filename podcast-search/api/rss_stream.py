@@ -0,0 +1,168 @@
+import re
+import xml.etree.ElementTree as ET
+from typing import BinaryIO, Dict, Iterator, Sequence
+
+# Bytes read from the file per parser feed
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# A character or entity reference
+_REFERENCE_RE = re.compile(rb"&(?:#[0-9]+|#x[0-9a-fA-F]+|[A-Za-z_][\w.-]*);")
+_CDATA_START = b"<![CDATA["
+_CDATA_END = b"]]>"
+# Bytes kept back at the end of a chunk, so references and CDATA markers are never split
+_LOOKAHEAD = 32
+
+
+class _FeedReader:
+    """
+    Binary stream over an RSS file that repairs the two defects of feeds
+    saved from a browser or written by hand: text before the root element,
+    and ampersands not escaped as &amp; outside CDATA sections. Well-formed
+    feeds pass unchanged.
+    """
+
+    def __init__(self, fp: BinaryIO, chunk_size: int):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.pending = b""
+        self.started = False
+        self.in_cdata = False
+        self.eof = False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.eof:
+            chunk = self.fp.read(self.chunk_size)
+            if not chunk:
+                self.eof = True
+                break
+            data = self.pending + chunk
+            if not self.started:
+                start = data.find(b"<")
+                if start < 0:
+                    self.pending = b""
+                    continue
+                data = data[start:]
+                self.started = True
+            repaired = self._repair(data, len(data) - _LOOKAHEAD)
+            if repaired:
+                return repaired
+        data = self.pending
+        return self._repair(data, len(data)) if self.started else b""
+
+    def _repair(self, data: bytes, limit: int) -> bytes:
+        """
+        Escape the bare ampersands of `data` up to about `limit`, keeping the rest pending.
+        """
+        parts = []
+        pos = 0
+        while pos < limit:
+            if self.in_cdata:
+                end = data.find(_CDATA_END, pos, limit + len(_CDATA_END) - 1)
+                stop = limit if end < 0 else end + len(_CDATA_END)
+                self.in_cdata = end < 0
+                parts.append(data[pos:stop])
+                pos = stop
+                continue
+            start = data.find(_CDATA_START, pos, limit + len(_CDATA_START) - 1)
+            stop = limit if start < 0 else start
+            ampersand = data.find(b"&", pos, stop)
+            while ampersand >= 0:
+                parts.append(data[pos:ampersand])
+                parts.append(b"&" if _REFERENCE_RE.match(data, ampersand) else b"&amp;")
+                pos = ampersand + 1
+                ampersand = data.find(b"&", pos, stop)
+            parts.append(data[pos:stop])
+            pos = stop
+            if start >= 0:
+                parts.append(_CDATA_START)
+                pos += len(_CDATA_START)
+                self.in_cdata = True
+        self.pending = data[pos:]
+        return b"".join(parts)
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _text_key(text: str) -> str:
+    # CDATA sections are reported as plain text; feeds put HTML in them
+    return "__cdata" if "<" in text else "__text"
+
+
+def to_json(element: ET.Element, prefixes: Dict[str, str]):
+    """
+    Convert an element to the JSON shape of the X2JS converter the data files were made with.
+
+    Children become keys named after their local name, repeated children a
+    list, attributes keys prefixed with '_', and the namespace prefix
+    '__prefix'. An element holding only text, without attributes or
+    namespace, is its text, unless the text is CDATA.
+    """
+    converted = {}
+    for child in element:
+        name = _local_name(child.tag)
+        value = to_json(child, prefixes)
+        if name not in converted:
+            converted[name] = value
+        elif isinstance(converted[name], list):
+            converted[name].append(value)
+        else:
+            converted[name] = [converted[name], value]
+    for name, value in element.attrib.items():
+        if name.startswith("{"):
+            uri, local = name[1:].split("}", 1)
+            name = f"{prefixes[uri]}:{local}" if uri in prefixes else local
+        converted[f"_{name}"] = value
+    if element.tag.startswith("{"):
+        uri = element.tag[1:].split("}", 1)[0]
+        if uri in prefixes:
+            converted["__prefix"] = prefixes[uri]
+    text = (element.text or "").strip()
+    key = _text_key(text)
+    if not converted and key == "__text":
+        return text
+    if text:
+        converted[key] = text
+    return converted
+
+
+def iter_items(fp: BinaryIO, path: Sequence[str] = ("rss", "channel", "item"),
+               chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[dict]:
+    """
+    Incrementally yield the elements found at `path` in an RSS document,
+    converted to the JSON shape of the data files (see `to_json`).
+
+    Elements are parsed with iterparse and dropped from the tree once
+    converted, so peak memory is bounded by the largest element instead of
+    the size of the document.
+
+    Args:
+        fp: Binary stream positioned at the start of the document
+        path: Local names of the elements leading to the items, root first
+        chunk_size: Bytes read from `fp` at a time
+    Yields:
+        Converted elements, in document order
+    Raises:
+        xml.etree.ElementTree.ParseError: If the document is malformed
+    """
+    path = list(path)
+    prefixes: Dict[str, str] = {}
+    # Elements from the root to the one being parsed, with their local names
+    stack = []
+    names = []
+    for event, value in ET.iterparse(_FeedReader(fp, chunk_size), events=("start", "end", "start-ns")):
+        if event == "start-ns":
+            prefix, uri = value
+            if prefix:
+                prefixes.setdefault(uri, prefix)
+        elif event == "start":
+            stack.append(value)
+            names.append(_local_name(value.tag))
+        else:
+            stack.pop()
+            if names.pop() == path[-1] and names == path[:-1]:
+                yield to_json(value, prefixes)
+                value.clear()
+                if stack:
+                    stack[-1].remove(value)
@@ -1,19 +1,46 @@
+import asyncio
+import concurrent.futures
 import os
 import re
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict, List
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from datetime import date
+from typing import Dict, List, Optional
 import json
+import time
 from pathlib import Path
-import utils
+import bm25
+import corpus
+import episode_store
+import facets
+import http_cache
+import metrics
 import reranker
+import watcher
 from fastapi.staticfiles import StaticFiles
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Parse the podcast files once at startup instead of on the first request
+    snapshot = corpus.store.load()
+    bm25.get_index(snapshot)
+    facets.get_index(snapshot)
+    facets.get_show_index(snapshot)
+    # Apply changes to the data files in the background as they land
+    directory_watcher = watcher.DirectoryWatcher(corpus.store).start() if watcher.WATCH_INTERVAL > 0 else None
+    yield
+    if directory_watcher is not None:
+        directory_watcher.stop()
+
+
 app = FastAPI(
     title="Podcast Search API.",
     description="API for searching and retrieving podcast episodes from RSS feed",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 
@@ -28,22 +55,68 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Response headers the frontend reads across origins, beyond the CORS-safelisted ones
+    expose_headers=["X-Search-Degraded", "X-Total-Count", "Link", "ETag", "Server-Timing"],
 )
 
 
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
 @app.get("/episodes",
          response_model=Dict[str, List[Dict]],
          summary="Get all podcast episodes",
-         description="Retrieves all podcast episodes from the RSS feed",
+         description="Retrieves podcast episodes from the RSS feed. Use offset/limit to page through them, "
+                     "fields to select the returned fields, and format=ndjson (or Accept: application/x-ndjson) "
+                     "to stream one episode per line. The total count is sent in X-Total-Count and the next "
+                     "page in a Link header. Responses carry an ETag and Last-Modified that clients can send back "
+                     "in If-None-Match or If-Modified-Since to get 304 Not Modified while the corpus is unchanged.",
          response_description="List of podcast episodes",
          responses={
-             200: {"description": "Successfully retrieved episodes"},
+             200: {"description": "Successfully retrieved episodes",
+                   "content": {NDJSON_MEDIA_TYPE: {}}},
+             304: {"description": "Episodes unchanged since the validators sent"},
              500: {"description": "Internal server error"}
          })
-async def get_all_episodes():
+async def get_all_episodes(request: Request,
+                           offset: int = Query(0, ge=0, description="Index of the first episode to return"),
+                           limit: Optional[int] = Query(None, ge=1, description="Maximum number of episodes"),
+                           fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+                           format: str = Query("json", pattern="^(json|ndjson)$")):
     try:
-        episodes = utils.read_podcasts_json_file()
-        return {"episodes": episodes}
+        snapshot = corpus.store.snapshot()
+        ndjson = format == "ndjson" or NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+        etag = http_cache.make_etag(snapshot, "ndjson" if ndjson else "json")
+        # The format can be negotiated with the Accept header
+        headers, not_modified = http_cache.conditional(request.headers, snapshot, etag,
+                                                       http_cache.EPISODES_CACHE_CONTROL, vary="Accept")
+        if not_modified is not None:
+            return not_modified
+
+        episodes = snapshot.episodes
+        total = len(episodes)
+        start = min(offset, total)
+        stop = total if limit is None else min(total, start + limit)
+        projection = None if fields is None else frozenset(f.strip() for f in fields.split(",") if f.strip())
+
+        headers["X-Total-Count"] = str(total)
+        if stop < total:
+            headers["Link"] = f'<{request.url.include_query_params(offset=stop)}>; rel="next"'
+
+        if projection is None:
+            encoded = episode_store.get_encoded(snapshot)
+            doc_ids = episodes.doc_ids(start, stop) if hasattr(episodes, "doc_ids") else range(start, stop)
+            if ndjson:
+                return StreamingResponse(episode_store.iter_encoded_ndjson(encoded, doc_ids),
+                                         media_type=NDJSON_MEDIA_TYPE, headers=headers)
+            body = episode_store.join_json("episodes", (encoded[doc_id] for doc_id in doc_ids))
+        elif ndjson:
+            return StreamingResponse(episode_store.iter_ndjson(episodes, start, stop, projection),
+                                     media_type=NDJSON_MEDIA_TYPE, headers=headers)
+        else:
+            body = episode_store.join_json("episodes", (episode_store.encode_episode(
+                episode_store.project_episode(episodes[i], projection)) for i in range(start, stop)))
+        return Response(body, media_type="application/json", headers=headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -51,21 +124,76 @@ async def get_all_episodes():
 @app.get("/search",
           response_model=Dict[str, List[Dict]],
           summary="Search podcast episodes",
-          description="Search for podcast episodes based on a query string matching title, content, or summary",
+          description="Search for podcast episodes based on a query string matching title, content, or summary. "
+                      "Results can be restricted to some shows, a publication date range and a duration range, and "
+                      "scores=true adds the retrieval, rerank and fused scores of each episode. "
+                      "The time spent in each stage of the search is sent in a Server-Timing header. When "
+                      "reranking is unavailable, episodes are ranked locally and X-Search-Degraded is set. Reranked "
+                      "results carry an ETag and Last-Modified; while the corpus is unchanged, a request sending "
+                      "them back gets 304 Not Modified without searching again.",
           response_description="List of matching podcast episodes",
           responses={
               200: {"description": "Successfully retrieved matching episodes"},
-              500: {"description": "Internal server error"}
+              304: {"description": "Results unchanged since the validators sent"},
+              500: {"description": "Internal server error"},
+              504: {"description": "Reranking timed out"}
           })
-async def search_episodes(q: str = 'learn about strategy', limit: int = 10):
+async def search_episodes(request: Request, q: str = 'learn about strategy', limit: int = 10,
+                          show: Optional[List[str]] = Query(
+                              None, description="Shows to search, by feed name (e.g. hbr_ideacast); repeatable"),
+                          published_after: Optional[date] = Query(
+                              None, description="Earliest publication day, inclusive (UTC)"),
+                          published_before: Optional[date] = Query(
+                              None, description="Latest publication day, inclusive (UTC)"),
+                          min_duration: Optional[int] = Query(None, ge=0, description="Minimum duration in seconds"),
+                          max_duration: Optional[int] = Query(None, ge=0, description="Maximum duration in seconds"),
+                          scores: bool = Query(
+                              False, description="Add the retrieval, rerank and fused scores of each episode "
+                                                 "in a _scores key")):
+    started = time.perf_counter()
+    token = metrics.start_request()
+    status = 200
+    filters = facets.FacetFilter(show or (), published_after, published_before, min_duration, max_duration)
     try:
-        reranked_result = reranker.rerank_podcasts(q, limit)
-        return {"results": reranked_result} 
+        # Results depend on the URL, the corpus and the ranking configuration
+        snapshot = corpus.store.snapshot()
+        etag = http_cache.make_etag(snapshot, *reranker.config_fingerprint())
+        headers, response = http_cache.conditional(request.headers, snapshot, etag, http_cache.SEARCH_CACHE_CONTROL)
+        if response is not None:
+            status = 304
+        else:
+            reranked_result = await reranker.rerank_podcasts_async(q, limit, filters=filters)
+            if reranked_result.degraded:
+                # Locally ranked results are not worth caching once reranking is back
+                headers = {"Cache-Control": http_cache.NO_STORE, "X-Search-Degraded": "rerank-unavailable"}
+            with metrics.stage("serialize"):
+                response = Response(reranked_result.to_json(scores), media_type="application/json", headers=headers)
+    except (asyncio.TimeoutError, concurrent.futures.TimeoutError):
+        # Raised by the async rerank and by waiting on another request's rerank; not TimeoutError before 3.11
+        status = 504
+        raise HTTPException(status_code=504, detail="Search timed out waiting for reranking")
     except Exception as e:
+        status = 500
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        timings = metrics.finish_request(token)
+        elapsed = time.perf_counter() - started
+        metrics.STAGE_SECONDS.observe(elapsed, "total")
+        metrics.SEARCH_REQUESTS.inc(1, str(status))
+    timings["total"] = elapsed
+    response.headers["Server-Timing"] = metrics.server_timing(timings)
+    return response
+
+
+@app.get("/metrics",
+         summary="Prometheus metrics",
+         description="Search stage latency histograms and counters, in the Prometheus text format",
+         response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
 
 
-app.mount("/", StaticFiles(directory="build", html=True), name="frontend")
+app.mount("/", StaticFiles(directory=Path(__file__).parent / "build", html=True), name="frontend")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,64 @@
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one execution.
+
+    The first caller for a key (the leader) runs the function; callers arriving
+    while it is in flight wait for the leader's result instead of running it
+    again. The result, or the exception, is handed to every waiter. Once the
+    call completes the key is forgotten, so later calls run the function anew.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        """
+        Run `fn` for `key`, or wait for the call already in flight for it.
+
+        Args:
+            key: Identity of the call
+            fn: Function producing the result
+            timeout: Seconds a waiter waits for the in-flight call; the leader
+                is never interrupted
+        Returns:
+            The result of `fn`
+        Raises:
+            concurrent.futures.TimeoutError: If a waiter times out before the in-flight call completes
+            Exception: Whatever `fn` raised, for the leader and every waiter
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.executions += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            return future.result(timeout=timeout)
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
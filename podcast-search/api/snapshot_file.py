@@ -0,0 +1,505 @@
+"""
+Precompiled, memory-mapped corpus snapshots.
+
+A snapshot holds the flattened, HTML-cleaned episodes of the data files plus
+the structures derived from them (BM25 and dense indexes, facet indexes,
+rerank documents), so a worker can start serving by mapping one file instead
+of parsing the raw feeds. Build it with:
+
+    python snapshot_file.py [--data data] [--output ../index/corpus.snapshot]
+
+With PODCAST_SHARED_CORPUS (see corpus.py), the worker processes of a server
+all map the same snapshot file, so the page cache holds one copy of the
+corpus and its indexes however many workers run. When the data files change,
+the first worker to take the build lock rebuilds the snapshot and atomically
+replaces the file; every worker then maps the new file on its next check.
+
+Layout (little-endian, sections aligned to 64 bytes):
+
+    header   magic, format version, section count, SHA-256 of the source files
+    table    one (name, offset, length) entry per section
+    sections meta (JSON), episode offsets (uint64) and JSON blobs, feed
+             names (JSON) with the feeds of each episode and the episodes
+             of each feed, publication date and duration values with their
+             sort order, rerank document offsets and JSON blobs, BM25
+             vocabulary / postings / document lengths, dense matrix
+"""
+import argparse
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from collections.abc import Sequence
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import bm25
+import dedup
+import dense_index
+import facets
+import projection
+import utils
+from episode_store import encode_episode
+
+MAGIC = b"PODSNAP1"
+FORMAT_VERSION = 2
+ALIGNMENT = 64
+
+_HEADER = struct.Struct("<8sII32s")
+_SECTION = struct.Struct("<16sQQ")
+
+# Snapshot mapped at startup by the corpus store when it is not stale
+DEFAULT_PATH = Path(os.environ.get("PODCAST_SNAPSHOT", Path(__file__).parent.parent / "index" / "corpus.snapshot"))
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot file is malformed or was written by another format version."""
+
+
+# Device, inode, mtime and size of a file: changes whenever a new snapshot replaces it
+FileIdentity = Tuple[int, int, int, int]
+
+
+def _identity(stat: os.stat_result) -> FileIdentity:
+    return stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def file_identity(path: Path) -> Optional[FileIdentity]:
+    """
+    Return the identity of the file at `path`, or None if there is none.
+    """
+    try:
+        return _identity(os.stat(path))
+    except FileNotFoundError:
+        return None
+
+
+def describe_sources(files: Iterable[Path]) -> List[Dict[str, Any]]:
+    """
+    Describe the data files by name, size and mtime.
+    """
+    sources = []
+    for file_path in files:
+        stat = file_path.stat()
+        sources.append({"name": file_path.name, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+    return sources
+
+
+def content_hash(files: Iterable[Path]) -> bytes:
+    """
+    SHA-256 over the names and contents of the data files.
+    """
+    digest = hashlib.sha256()
+    for file_path in files:
+        digest.update(file_path.name.encode("utf-8") + b"\0")
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        digest.update(b"\0")
+    return digest.digest()
+
+
+class MappedEpisodes(Sequence):
+    """
+    Episodes stored as JSON blobs in a mapped snapshot, decoded on access.
+    """
+
+    def __init__(self, offsets: memoryview, blobs: memoryview):
+        self._offsets = offsets
+        self._blobs = blobs
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("episode index out of range")
+        return json.loads(bytes(self.encoded(index)))
+
+    def encoded(self, index: int) -> memoryview:
+        """
+        Return the compact JSON encoding of an episode without copying it.
+        """
+        return self._blobs[self._offsets[index]:self._offsets[index + 1]]
+
+
+class MappedFeeds(Sequence):
+    """
+    Feeds of each episode of a mapped snapshot, looked up on access.
+    """
+
+    def __init__(self, names: List[str], offsets: memoryview, feed_ids: memoryview):
+        self._names = names
+        self._offsets = offsets
+        self._feed_ids = feed_ids
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return [self._names[feed_id] for feed_id in self._feed_ids[self._offsets[index]:self._offsets[index + 1]]]
+
+
+class MappedRerankDocuments:
+    """
+    Rerank documents (see projection.RerankDocuments) stored as JSON blobs in
+    a mapped snapshot, decoded on access. Their sizes are the blob lengths.
+    """
+
+    def __init__(self, offsets: memoryview, blobs: memoryview, episode_offsets: memoryview,
+                 rerank_projection: projection.RerankProjection, added=None):
+        self.projection = rerank_projection
+        self._offsets = offsets
+        self._blobs = blobs
+        self._episode_offsets = episode_offsets
+        # Documents added by `updated`: doc id -> (document, size, full size)
+        self.added = added or {}
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1 + len(self.added)
+
+    def __getitem__(self, doc_id: int) -> Dict[str, str]:
+        if doc_id in self.added:
+            return self.added[doc_id][0]
+        return json.loads(bytes(self._blobs[self._offsets[doc_id]:self._offsets[doc_id + 1]]))
+
+    def size(self, doc_id: int) -> int:
+        if doc_id in self.added:
+            return self.added[doc_id][1]
+        return self._offsets[doc_id + 1] - self._offsets[doc_id]
+
+    def full_size(self, doc_id: int) -> int:
+        if doc_id in self.added:
+            return self.added[doc_id][2]
+        return self._episode_offsets[doc_id + 1] - self._episode_offsets[doc_id]
+
+    def updated(self, added, deleted) -> "MappedRerankDocuments":
+        """
+        Return a copy with the documents of added episodes, sharing the mapped ones.
+        """
+        documents = dict(self.added)
+        for doc_id, episode in added:
+            document = self.projection.project(episode)
+            documents[doc_id] = (document, len(encode_episode(document)), len(encode_episode(episode)))
+        return MappedRerankDocuments(self._offsets, self._blobs, self._episode_offsets, self.projection, documents)
+
+
+class SnapshotFile:
+    """
+    Read-only view of a snapshot file. Sections are memoryviews over one shared
+    mmap, so nothing is copied onto the heap except the BM25 vocabulary.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with open(self.path, "rb") as f:
+            self.identity = _identity(os.fstat(f.fileno()))
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        if len(buffer) < _HEADER.size:
+            raise SnapshotError(f"Truncated snapshot: {self.path}")
+        magic, version, count, digest = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise SnapshotError(f"Unsupported snapshot format: {self.path}")
+        self.content_hash = digest
+        self.sections: Dict[str, memoryview] = {}
+        for i in range(count):
+            name, offset, length = _SECTION.unpack_from(buffer, _HEADER.size + i * _SECTION.size)
+            if offset + length > len(buffer):
+                raise SnapshotError(f"Truncated snapshot: {self.path}")
+            self.sections[name.rstrip(b"\0").decode("ascii")] = buffer[offset:offset + length]
+        self.meta = json.loads(bytes(self.sections["meta"]))
+        if self.meta.get("byteorder") != sys.byteorder:
+            raise SnapshotError(f"Snapshot was written on a {self.meta.get('byteorder')}-endian host")
+
+    @property
+    def fingerprint(self) -> Tuple[Tuple[str, int, int], ...]:
+        """
+        (name, mtime, size) of the data files the snapshot was built from, like CorpusStore.fingerprint.
+        """
+        return tuple((source["name"], source["mtime_ns"], source["size"]) for source in self.meta["sources"])
+
+    def _array(self, name: str, typecode: str) -> memoryview:
+        return self.sections[name].cast(typecode)
+
+    def episodes(self) -> MappedEpisodes:
+        return MappedEpisodes(self._array("episode_offsets", "Q"), self.sections["episodes"])
+
+    def feeds(self) -> Optional[MappedFeeds]:
+        """
+        Return the feeds each episode was found in, if the snapshot records them.
+        """
+        if "feed_names" not in self.sections:
+            return None
+        return MappedFeeds(json.loads(bytes(self.sections["feed_names"])), self._array("ep_feed_offsets", "Q"),
+                           self._array("ep_feed_ids", "I"))
+
+    def _numpy(self, name: str, dtype) -> np.ndarray:
+        return np.frombuffer(self.sections[name], dtype=dtype)
+
+    def _sorted_index(self, name: str) -> facets.SortedIndex:
+        return facets.SortedIndex(self._numpy(f"{name}_values", np.float64), self._numpy(f"{name}_order", np.int64),
+                                  self._numpy(f"{name}_sorted", np.float64))
+
+    def facet_index(self) -> facets.FacetIndex:
+        return facets.FacetIndex(self._sorted_index("published"), self._sorted_index("duration"))
+
+    def show_index(self) -> Optional[facets.ShowIndex]:
+        if "feed_names" not in self.sections:
+            return None
+        names = json.loads(bytes(self.sections["feed_names"]))
+        offsets = self._array("feed_doc_offsets", "Q")
+        doc_ids = self._numpy("feed_doc_ids", np.uint32)
+        return facets.ShowIndex.from_doc_ids(
+            {name: doc_ids[offsets[i]:offsets[i + 1]] for i, name in enumerate(names)}, self.meta["episodes"])
+
+    def rerank_documents(self, rerank_projection: projection.RerankProjection) -> Optional[MappedRerankDocuments]:
+        """
+        Return the stored rerank documents if they were projected with `rerank_projection`.
+        """
+        if self.meta.get("rerank_projection") != rerank_projection.key:
+            return None
+        return MappedRerankDocuments(self._array("rerank_offsets", "Q"), self.sections["rerank_documents"],
+                                     self._array("episode_offsets", "Q"), rerank_projection)
+
+    def bm25_index(self) -> bm25.BM25Index:
+        terms = bytes(self.sections["bm25_vocabulary"]).decode("utf-8").split("\n")
+        vocabulary = {term: term_id for term_id, term in enumerate(terms) if term}
+        return bm25.BM25Index(vocabulary, self._array("bm25_offsets", "Q"), self._array("bm25_doc_ids", "I"),
+                              self._array("bm25_term_freqs", "I"), self._array("bm25_doc_lengths", "I"))
+
+    def dense_index(self, embedder: dense_index.Embedder) -> Optional[dense_index.DenseIndex]:
+        """
+        Return the stored dense index if it was built with `embedder`.
+        """
+        dense = self.meta.get("dense")
+        if "dense_matrix" not in self.sections or not dense or dense["embedder"] != embedder.name:
+            return None
+        matrix = np.frombuffer(self.sections["dense_matrix"], dtype=np.float32)
+        return dense_index.DenseIndex(matrix.reshape(-1, dense["dimension"]), embedder)
+
+    def derived(self) -> Dict[str, Any]:
+        """
+        Indexes stored in the snapshot, keyed like CorpusSnapshot.derived entries.
+        """
+        derived = {"bm25": self.bm25_index(), "facets": self.facet_index()}
+        stored_dense = self.dense_index(dense_index.get_embedder())
+        if stored_dense is not None:
+            derived["dense"] = stored_dense
+        show_index = self.show_index()
+        if show_index is not None:
+            derived["facets:shows"] = show_index
+        documents = self.rerank_documents(projection.projection)
+        if documents is not None:
+            derived[f"rerank_documents:{projection.projection.key}"] = documents
+        return derived
+
+    def is_fresh(self, files: List[Path]) -> bool:
+        """
+        Check that the snapshot was built from the current content of `files`.
+
+        Names, sizes and mtimes are compared first; the content is only hashed
+        when they differ, e.g. after a checkout or an image build reset mtimes.
+        """
+        if [source["name"] for source in self.meta["sources"]] != [f.name for f in files]:
+            return False
+        if self.meta["sources"] == describe_sources(files):
+            return True
+        return content_hash(files) == self.content_hash
+
+
+def write(path: Path, files: List[Path], episodes: Iterable, embedder: Optional[dense_index.Embedder] = None,
+          feeds: Optional[List[List[str]]] = None, deduplicated: bool = False) -> Path:
+    """
+    Build a snapshot of the flattened `episodes` parsed from `files` and
+    atomically replace `path` with it.
+
+    Args:
+        path: Snapshot file to write
+        files: Data files the episodes were parsed from
+        episodes: Flattened episodes
+        embedder: Embedder of the stored dense index (default: DENSE_EMBEDDER)
+        feeds: Feeds each episode was found in, read after `episodes` is consumed
+        deduplicated: Whether duplicates across feeds were dropped from `episodes`
+    Returns:
+        The written path
+    """
+    embedder = embedder or dense_index.get_embedder()
+    offsets = array("Q", [0])
+    blobs = bytearray()
+    rerank_offsets = array("Q", [0])
+    rerank_blobs = bytearray()
+    texts = []
+    published, durations = [], []
+    for episode in episodes:
+        blobs += encode_episode(episode)
+        offsets.append(len(blobs))
+        rerank_blobs += encode_episode(projection.projection.project(episode))
+        rerank_offsets.append(len(rerank_blobs))
+        texts.append(utils.episode_text(episode))
+        published.append(facets.parse_pub_date(episode.get("pubDate")))
+        durations.append(facets.episode_duration(episode))
+
+    index = bm25.BM25Index.build(texts)
+    terms = sorted(index.vocabulary, key=index.vocabulary.get)
+    matrix = np.ascontiguousarray(embedder.embed(texts), dtype=np.float32)
+    meta = {
+        "byteorder": sys.byteorder,
+        "created_at": time.time(),
+        "episodes": len(offsets) - 1,
+        "sources": describe_sources(files),
+        "deduplicated": deduplicated,
+        "dense": {"embedder": embedder.name, "dimension": embedder.dimension},
+        "rerank_projection": projection.projection.key,
+    }
+    sections = [
+        ("meta", json.dumps(meta).encode("utf-8")),
+        ("episode_offsets", offsets.tobytes()),
+        ("episodes", bytes(blobs)),
+        ("rerank_offsets", rerank_offsets.tobytes()),
+        ("rerank_documents", bytes(rerank_blobs)),
+    ]
+    for name, values in (("published", published), ("duration", durations)):
+        facet = facets.SortedIndex(np.array(values, dtype=np.float64))
+        order, sorted_values = facet.sorted_arrays()
+        sections += [
+            (f"{name}_values", facet.values.tobytes()),
+            (f"{name}_order", order.astype(np.int64).tobytes()),
+            (f"{name}_sorted", sorted_values.tobytes()),
+        ]
+    if feeds is not None:
+        shows = facets.ShowIndex(feeds, len(offsets) - 1)
+        names = sorted(shows.doc_ids)
+        ids = {name: feed_id for feed_id, name in enumerate(names)}
+        feed_offsets, feed_ids = array("Q", [0]), array("I")
+        for episode_feeds in feeds:
+            feed_ids.extend(ids[feed] for feed in episode_feeds)
+            feed_offsets.append(len(feed_ids))
+        doc_offsets = array("Q", [0])
+        for name in names:
+            doc_offsets.append(doc_offsets[-1] + len(shows.doc_ids[name]))
+        sections += [
+            ("feed_names", json.dumps(names).encode("utf-8")),
+            ("ep_feed_offsets", feed_offsets.tobytes()),
+            ("ep_feed_ids", feed_ids.tobytes()),
+            ("feed_doc_offsets", doc_offsets.tobytes()),
+            ("feed_doc_ids", b"".join(shows.doc_ids[name].tobytes() for name in names)),
+        ]
+    sections += [
+        ("bm25_vocabulary", "\n".join(terms).encode("utf-8")),
+        ("bm25_offsets", array("Q", index.offsets).tobytes()),
+        ("bm25_doc_ids", array("I", index.doc_ids).tobytes()),
+        ("bm25_term_freqs", array("I", index.term_freqs).tobytes()),
+        ("bm25_doc_lengths", array("I", index.doc_lengths).tobytes()),
+        ("dense_matrix", matrix.tobytes()),
+    ]
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(sections), content_hash(files)))
+        position = _HEADER.size + len(sections) * _SECTION.size
+        table = []
+        for name, data in sections:
+            position += -position % ALIGNMENT
+            table.append(_SECTION.pack(name.encode("ascii"), position, len(data)))
+            position += len(data)
+        f.write(b"".join(table))
+        for (name, data), entry in zip(sections, table):
+            f.seek(_SECTION.unpack(entry)[1])
+            f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+
+def build(directory: str = "data", pattern: str = utils.DEFAULT_FEED_PATTERN, output: Path = DEFAULT_PATH,
+          workers: int = 0, deduplicate: bool = dedup.DEDUP_EPISODES) -> Path:
+    """
+    Parse the data files, on `workers` processes if any, and write their snapshot to `output`.
+    """
+    files = utils.list_podcast_files(directory, pattern)
+    episodes, feeds = dedup.read_episodes(directory, pattern, deduplicate=deduplicate, workers=workers)
+    return write(output, files, episodes, feeds=feeds, deduplicated=deduplicate)
+
+
+@contextmanager
+def build_lock(path: Path, blocking: bool = True) -> Iterator[bool]:
+    """
+    Hold the lock that elects the one process rebuilding the snapshot at `path`.
+
+    The lock is an flock on a file next to the snapshot, released when its
+    holder exits, even if it crashes.
+
+    Args:
+        path: Snapshot file
+        blocking: Wait for the lock instead of giving up if another process holds it
+    Yields:
+        Whether the lock was acquired
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path.with_name(f"{path.name}.lock"), "ab") as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def load_if_fresh(path: Path, files: List[Path]) -> Optional[SnapshotFile]:
+    """
+    Map the snapshot at `path` if it exists and matches the current data files.
+
+    Returns:
+        The mapped snapshot, or None if it is missing, stale or unreadable
+    """
+    if not Path(path).exists():
+        return None
+    try:
+        snapshot = SnapshotFile(path)
+    except (OSError, KeyError, ValueError) as e:
+        logging.warning(f"Ignoring unreadable corpus snapshot {path}: {str(e)}")
+        return None
+    if not snapshot.is_fresh(files):
+        logging.info(f"Corpus snapshot {path} is stale, parsing the data files")
+        return None
+    return snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the memory-mapped podcast corpus snapshot.")
+    parser.add_argument("--data", default="data", help="Directory containing the feed files")
+    parser.add_argument("--pattern", default=os.environ.get("PODCAST_FEED_PATTERN", utils.DEFAULT_FEED_PATTERN),
+                        help="File pattern to match, among JSON and RSS feed files")
+    parser.add_argument("--output", type=Path, default=DEFAULT_PATH, help="Snapshot file to write")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Processes parsing the JSON files (default: 0, parse them on threads)")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    path = build(args.data, args.pattern, args.output, args.workers)
+    print(f"Wrote {path} ({path.stat().st_size / 2 ** 20:.1f} MB) in {time.perf_counter() - started:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,26 @@
 from pathlib import Path
 import json
+import mmap
+import multiprocessing
 import re
-from concurrent.futures import ThreadPoolExecutor
-from typing import List, Iterator
+import xml.etree.ElementTree as ET
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import chain
+from typing import Callable, List, Iterator, Optional, Tuple
 import logging
+import flatten
+import json_stream
+import rss_stream
+
+# Files are parsed by process pool workers in chunks of about this many bytes
+DEFAULT_PARSE_CHUNK_BYTES = 8 * 1024 * 1024
+
+# Files matching the pattern are read if they are feeds: JSON conversions or raw RSS
+DEFAULT_FEED_PATTERN = "*"
+FEED_SUFFIXES = (".json", ".xml", ".rss")
+
+_ITEM_ARRAY_RE = re.compile(rb'"item"\s*:\s*\[')
+_FIRST_KEY_RE = re.compile(rb'\s*\{\s*("[^"\\]*(?:\\.[^"\\]*)*")\s*:')
 
 def flatten_json(data):
     """
@@ -90,6 +107,34 @@ def flatten_hbr_json(json_obj, parent_key='', sep='_'):
     return dict(items)
 
 
+# Flattened keys whose base name holds searchable episode text
+TEXT_FIELDS = ("title", "subtitle", "summary", "description", "encoded", "keywords")
+
+
+def episode_text(episode) -> str:
+    """
+    Join the title, summary and content text of a flattened episode.
+    
+    Both feed layouts repeat some text under several keys (e.g. 'title' and
+    'title__itunes'), so each distinct value is only included once.
+    
+    Args:
+        episode (dict): Flattened episode
+    
+    Returns:
+        str: Searchable text of the episode
+    """
+    seen = set()
+    parts = []
+    for key, value in episode.items():
+        if not isinstance(value, str) or key.endswith("prefix") or value in seen:
+            continue
+        if key.split("_", 1)[0] in TEXT_FIELDS:
+            seen.add(value)
+            parts.append(value)
+    return "\n".join(parts)
+
+
 def remove_html_tags(text: str) -> str:
     """
     Remove HTML tags from text while preserving the text content.
@@ -110,7 +155,7 @@ def remove_html_tags(text: str) -> str:
     if not text:
         return ""
     # Method 1: Using regex (faster but less robust)
-    clean_text = re.sub(r'<[^>]+>', '', text)
+    clean_text = flatten.HTML_TAG_RE.sub('', text)
     # Remove extra whitespace
     clean_text = ' '.join(clean_text.split())
     return clean_text
@@ -147,11 +192,15 @@ def process_single_file(file_path: Path) -> Iterator:
     """
     Process a single JSON file and extract podcast data.
     
+    RSS files (.xml) are parsed by iter_podcasts_xml_file before returning.
+    
     Args:
-        file_path: Path to the JSON file
+        file_path: Path to the JSON or RSS file
     Returns:
         Iterator of flattened podcast items
     """
+    if is_rss_file(file_path):
+        return iter(list(iter_podcasts_xml_file(file_path)))
     try:
         with open(file_path, "r") as f:
             content = f.read().strip()
@@ -166,26 +215,111 @@ def process_single_file(file_path: Path) -> Iterator:
                 logging.error(f"Invalid format in {file_path}: expected a list of podcasts")
                 return iter([])
             
-            if 'hbr' in file_path.name:
-                return map(flatten_hbr_json, podcasts)
-            elif 'mckinsey' in file_path.name:
-                return map(flatten_json, podcasts)
+            return map(flattener_for(file_path), podcasts)
     except (json.JSONDecodeError, ValueError) as e:
         logging.error(f"Error processing {file_path}: {str(e)}")
         return iter([])
 
 
-def read_podcasts_json_files(directory: str = "data", pattern: str = "*.json") -> Iterator:
+def flattener_for(file_path: Path) -> Callable[[dict], dict]:
     """
-    Read multiple podcast JSON files concurrently from the specified directory.
+    Select the flattening function matching the layout of a podcast feed file.
+    
+    The flatteners of the flatten module produce the same output as
+    flatten_hbr_json and flatten_json, and learn the schema of the feed, so a
+    new one is returned for each file.
     
     Args:
-        directory: Directory containing JSON files (default: "data")
-        pattern: File pattern to match (default: "*.json")
+        file_path: Path to the JSON file
     Returns:
-        Iterator of all podcast data combined
+        An HbrJsonFlattener for HBR feeds, a JsonFlattener otherwise
+    """
+    if 'hbr' in file_path.name:
+        return flatten.HbrJsonFlattener()
+    return flatten.JsonFlattener()
+
+
+def iter_podcasts_json_file(file_path: Path) -> Iterator[dict]:
+    """
+    Stream the flattened podcast items of a single JSON file.
+    
+    Unlike process_single_file, the file is never fully loaded: items under
+    rss.channel.item are decoded and flattened one at a time, so peak memory is
+    bounded by the largest item rather than by the file size.
+    
+    Args:
+        file_path: Path to the JSON file
+    Yields:
+        Flattened podcast items
+    """
+    flatten = flattener_for(file_path)
+    try:
+        with open(file_path, "r") as f:
+            for item in json_stream.iter_items(f, ("rss", "channel", "item")):
+                if isinstance(item, dict):
+                    yield flatten(item)
+    except (json.JSONDecodeError, ValueError) as e:
+        logging.error(f"Error processing {file_path}: {str(e)}")
+
+
+def is_rss_file(file_path: Path) -> bool:
+    """
+    Whether a feed file is raw RSS XML rather than its JSON conversion.
+    """
+    return file_path.suffix.lower() in (".xml", ".rss")
+
+
+def is_feed_file(file_path: Path) -> bool:
+    """
+    Whether a file is a podcast feed, as JSON or raw RSS XML.
+    """
+    return file_path.is_file() and file_path.suffix.lower() in FEED_SUFFIXES
+
+
+def iter_podcasts_xml_file(file_path: Path) -> Iterator[dict]:
+    """
+    Stream the flattened podcast items of a raw RSS XML file.
+    
+    Items are converted to the JSON shape of the data files (see
+    rss_stream.to_json) and flattened like the items of a JSON file of the
+    same feed, so both give the same episodes. Peak memory is bounded by the
+    largest item.
+    
+    Args:
+        file_path: Path to the RSS file
+    Yields:
+        Flattened podcast items
+    """
+    flatten = flattener_for(file_path)
+    try:
+        with open(file_path, "rb") as f:
+            for item in rss_stream.iter_items(f, ("rss", "channel", "item")):
+                if isinstance(item, dict):
+                    yield flatten(item)
+    except ET.ParseError as e:
+        logging.error(f"Error processing {file_path}: {str(e)}")
+
+
+def iter_feed_file(file_path: Path) -> Iterator[dict]:
+    """
+    Stream the flattened podcast items of a JSON or RSS file with bounded memory.
+    """
+    if is_rss_file(file_path):
+        return iter_podcasts_xml_file(file_path)
+    return iter_podcasts_json_file(file_path)
+
+
+def list_podcast_files(directory: str = "data", pattern: str = DEFAULT_FEED_PATTERN) -> List[Path]:
+    """
+    List the podcast feed files (JSON or RSS) in the specified directory, sorted by name.
+    
+    Args:
+        directory: Directory containing the feed files (default: "data")
+        pattern: File pattern to match, among feed files (default: every feed file)
+    Returns:
+        List of matching file paths
     Raises:
-        FileNotFoundError: If the directory is not found
+        FileNotFoundError: If the directory is not found or contains no matching files
     """
     base_path = Path(__file__).parent.parent
     data_dir = base_path / directory
@@ -193,15 +327,196 @@ def read_podcasts_json_files(directory: str = "data", pattern: str = "*.json") -
     if not data_dir.exists():
         raise FileNotFoundError(f"Directory not found: {directory}")
     
-    json_files = list(data_dir.glob(pattern))
+    json_files = sorted(file_path for file_path in data_dir.glob(pattern) if is_feed_file(file_path))
     if not json_files:
-        raise FileNotFoundError(f"No JSON files found in {directory}")
+        raise FileNotFoundError(f"No feed files found in {directory}")
+    return json_files
+
+
+def split_feed_file(file_path: Path, chunk_bytes: int) -> Optional[Tuple[int, List[Tuple[int, int]]]]:
+    """
+    Guess offsets splitting the rss.channel.item array of a feed file into
+    chunks of about `chunk_bytes`, without parsing the file.
+    
+    Boundaries are found by pattern: '},{' followed by the first key of the
+    first item, which the items of a feed share. They may still fall inside a
+    string or a nested object. JSON has a single parse, so a
+    split is right if each chunk parses as array elements and the file
+    without its items parses as a feed. parse_feed_chunk checks both and
+    raises ValueError otherwise.
+    
+    Args:
+        file_path: Path to the JSON file
+        chunk_bytes: Approximate size of a chunk
+    Returns:
+        Offset of the '[' opening the item array, and the (start, stop)
+        offsets of the chunks, the last one stopping at the end of the file;
+        None if the file is not worth splitting or has no item array
+    """
+    with open(file_path, "rb") as f:
+        size = f.seek(0, 2)
+        if size <= chunk_bytes:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            array = _ITEM_ARRAY_RE.search(data)
+            if array is None:
+                return None
+            bracket = array.end() - 1
+            first_key = _FIRST_KEY_RE.match(data, bracket + 1)
+            if first_key is None:
+                return None
+            separator_re = re.compile(rb'\}\s*,\s*\{\s*' + re.escape(first_key.group(1)) + rb'\s*:')
+            chunks = []
+            start = bracket + 1
+            while True:
+                separator = separator_re.search(data, start + chunk_bytes)
+                if separator is None:
+                    break
+                chunks.append((start, separator.start() + 1))
+                start = data.find(b"{", separator.start() + 1)
+            chunks.append((start, size))
+    return (bracket, chunks) if len(chunks) > 1 else None
+
+
+def parse_feed_chunk(file_path: Path, bracket: int, start: int, stop: int, last: bool) -> List[dict]:
+    """
+    Parse and flatten the items in a chunk of a feed file, as split by split_feed_file.
+    
+    Returns:
+        Flattened podcast items of the chunk
+    Raises:
+        ValueError: If the chunk is not a sequence of array elements (the
+            split was wrong) or the file is not a valid feed
+    """
+    with open(file_path, "rb") as f:
+        f.seek(start)
+        text = f.read(stop - start).decode("utf-8")
+        if not last:
+            items = json.loads(f"[{text}]")
+        else:
+            items, end = json.JSONDecoder().raw_decode(f"[{text}")
+            # The file without its items must be a feed whose item array is the one parsed
+            f.seek(0)
+            header = f.read(bracket).decode("utf-8")
+            feed = json.loads(f"{header}[]{text[end - 1:]}")
+            if feed.get("rss", {}).get("channel", {}).get("item") != []:
+                raise ValueError(f"Item array of {file_path.name} not found at offset {bracket}")
+    flatten_item = flattener_for(file_path)
+    return [flatten_item(item) for item in items]
+
+
+def parse_feed_file(file_path: Path) -> List[dict]:
+    """
+    Same as process_single_file, flattening the items before returning.
+    """
+    return list(process_single_file(file_path))
+
+
+def _iter_parsed(file_path: Path, futures: List[Future]) -> Iterator[dict]:
+    if len(futures) == 1:
+        yield from futures[0].result()
+        return
+    try:
+        chunks = [future.result() for future in futures]
+    except Exception as e:
+        logging.warning(f"Could not parse {file_path} in chunks, parsing it whole: {str(e)}")
+        yield from process_single_file(file_path)
+        return
+    for chunk in chunks:
+        yield from chunk
+
+
+def parse_podcast_files(json_files: List[Path], workers: int,
+                        chunk_bytes: int = DEFAULT_PARSE_CHUNK_BYTES) -> List[Iterator]:
+    """
+    Parse and flatten podcast JSON files on a pool of worker processes.
+    
+    JSON decoding and flattening hold the GIL, so threads cannot run them in
+    parallel. Here each file, or each chunk of about `chunk_bytes` of a larger
+    file (see split_feed_file), is a task for one of `workers` processes,
+    which sends the flattened items back pickled. Pickle writes the keys
+    shared by the items of a chunk once, so results are compact.
+    
+    Every task is submitted up front: the items of the first files can be
+    consumed while later ones are still being parsed.
+    
+    Args:
+        json_files: Paths to the JSON files
+        workers: Number of worker processes
+        chunk_bytes: Approximate size of the chunks large files are split into
+    Returns:
+        Iterator of flattened podcast items for each file, in order
+    """
+    # Spawned workers do not inherit the locks and threads of a running server
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        tasks = []
+        for file_path in json_files:
+            split = None if is_rss_file(file_path) else split_feed_file(file_path, chunk_bytes)
+            if split is None:
+                tasks.append((file_path, [executor.submit(parse_feed_file, file_path)]))
+                continue
+            bracket, chunks = split
+            tasks.append((file_path, [executor.submit(parse_feed_chunk, file_path, bracket, start, stop,
+                                                      i == len(chunks) - 1)
+                                      for i, (start, stop) in enumerate(chunks)]))
+    finally:
+        # Pending tasks still run; the worker processes exit once they are done
+        executor.shutdown(wait=False)
+    return [_iter_parsed(file_path, futures) for file_path, futures in tasks]
+
+
+def read_podcast_feeds(directory: str = "data", pattern: str = DEFAULT_FEED_PATTERN, streaming: bool = False,
+                       workers: int = 0, chunk_bytes: int = DEFAULT_PARSE_CHUNK_BYTES) -> List[Tuple[str, Iterator]]:
+    """
+    Read the podcast JSON files of a directory, keeping track of which feed
+    each episode comes from.
+    
+    Args:
+        directory: Directory containing JSON files (default: "data")
+        pattern: File pattern to match (default: every feed file)
+        streaming: Parse the files one item at a time with bounded memory
+            instead of loading each file whole (default: False)
+        workers: Parse the files, in chunks of about `chunk_bytes`, on this
+            many processes (default: 0, parse them on threads)
+        chunk_bytes: Approximate size of the chunks parsed by each process
+    Returns:
+        List of (feed name, iterator of flattened podcast items) pairs, one
+        per file, the feed name being the file name without its extension
+    Raises:
+        FileNotFoundError: If the directory is not found
+    """
+    json_files = list_podcast_files(directory, pattern)
+    names = [file_path.stem for file_path in json_files]
+
+    if streaming:
+        return list(zip(names, map(iter_feed_file, json_files)))
+
+    if workers > 0:
+        return list(zip(names, parse_podcast_files(json_files, workers, chunk_bytes)))
 
     # Use ThreadPoolExecutor for concurrent file processing
     with ThreadPoolExecutor() as executor:
-        # Process all files concurrently and chain the results
-        results = executor.map(process_single_file, json_files)
-        
-        # Flatten the results from all files into a single iterator
-        from itertools import chain
-        return chain.from_iterable(results)        
\ No newline at end of file
+        return list(zip(names, executor.map(process_single_file, json_files)))
+
+
+def read_podcasts_json_files(directory: str = "data", pattern: str = DEFAULT_FEED_PATTERN, streaming: bool = False,
+                             workers: int = 0, chunk_bytes: int = DEFAULT_PARSE_CHUNK_BYTES) -> Iterator:
+    """
+    Read multiple podcast JSON files concurrently from the specified directory.
+    
+    Args:
+        directory: Directory containing JSON files (default: "data")
+        pattern: File pattern to match (default: every feed file)
+        streaming: Parse the files one item at a time with bounded memory
+            instead of loading each file whole (default: False)
+        workers: Parse the files on this many processes (default: 0, on threads)
+        chunk_bytes: Approximate size of the chunks parsed by each process
+    Returns:
+        Iterator of all podcast data combined
+    Raises:
+        FileNotFoundError: If the directory is not found
+    """
+    feeds = read_podcast_feeds(directory, pattern, streaming, workers, chunk_bytes)
+    # Flatten the results from all files into a single iterator
+    return chain.from_iterable(episodes for _, episodes in feeds)
@@ -0,0 +1,44 @@
+import logging
+import os
+import threading
+from typing import Optional
+
+import corpus
+
+# Seconds between two polls of the data files by the background watcher (0 disables it)
+WATCH_INTERVAL = float(os.environ.get("PODCAST_WATCH_INTERVAL", "2"))
+
+
+class DirectoryWatcher:
+    """
+    Polls the data files of a corpus store from a background thread and applies
+    their changes as soon as they land, so requests never pay for an update.
+
+    Polling costs one stat call per data file and, unlike filesystem
+    notifications, works the same on every platform and on mounted volumes.
+    """
+
+    def __init__(self, store: corpus.CorpusStore, interval: float = WATCH_INTERVAL):
+        self.store = store
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "DirectoryWatcher":
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="corpus-watcher", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                self.store.refresh()
+            except Exception as e:
+                logging.error(f"Error applying podcast data changes: {str(e)}")
@@ -0,0 +1,486 @@
+"""
+Benchmark suite for podcast ingestion and search, saving JSON results that
+can be compared across commits.
+
+Benchmarks:
+    flatten  items/s and MB/s of the reference and planned flatteners and of remove_html_tags
+    read     wall time and peak RSS of read_podcasts_json_files on synthetic corpora
+    ingest   wall time and peak traced memory of whole-file vs streaming parsing of one feed file
+    parse    scaling of process pool parsing with the number of workers
+    search   end-to-end /search latency percentiles against a stubbed Bedrock reranker
+    serialize  time to encode search results, per episode dict vs joined pre-encoded episodes
+    fusion   time to fuse candidate scores per mode, and share of queries confident enough to skip rerank
+    payload  bytes of the rerank documents per query, whole flattened episodes vs token-budgeted projections
+    dense    query latency percentiles of the memory-mapped dense index against its size
+
+Usage:
+    python benchmarks/suite.py                                   # every benchmark
+    python benchmarks/suite.py read --sizes 10000 100000         # some of them
+    python benchmarks/suite.py parse --workers 1 2 4 8 16
+    python benchmarks/suite.py --compare benchmarks/results/abc1234.json
+
+Results go to benchmarks/results/<commit>.json unless --output is given.
+Each read measurement runs in a fresh process so its peak RSS is its own.
+Synthetic items are copies of the bundled ones (about 4 KB each), so the
+1M-item corpus needs about 4 GB of temporary disk space.
+"""
+import argparse
+import copy
+import gc
+import json
+import multiprocessing
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT / "api"))
+
+import flatten  # noqa: E402
+import utils  # noqa: E402
+
+DATA_DIRECTORY = ROOT / "data"
+RESULTS_DIRECTORY = Path(__file__).parent / "results"
+
+BENCHMARKS = ("flatten", "read", "ingest", "parse", "search", "serialize", "fusion", "payload", "dense")
+
+SEARCH_QUERIES = [
+    "leadership during a crisis",
+    "growth strategy",
+    "remote work and productivity",
+    "negotiation tips",
+    "artificial intelligence in business",
+    "mergers and acquisitions",
+    "managing your career",
+    "diversity and inclusion",
+    "board communications",
+    "pricing strategy for startups",
+]
+
+
+def load_items(file_name):
+    with open(DATA_DIRECTORY / file_name) as f:
+        return json.load(f)["rss"]["channel"]["item"]
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+# flatten
+
+def throughput(function, inputs, min_seconds):
+    """Run `function` over `inputs` until `min_seconds` elapsed; return calls per second."""
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        for value in inputs:
+            function(value)
+        calls += len(inputs)
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            return calls / elapsed
+
+
+def bench_flatten(args):
+    hbr_items = load_items("podcasts_hbr_ideacast.json")
+    mckinsey_items = load_items("podcasts_mckinsey.json")
+    descriptions = [item["description"] for item in hbr_items if isinstance(item.get("description"), str)]
+    cases = [
+        ("flatten_hbr_json", utils.flatten_hbr_json, hbr_items),
+        ("HbrJsonFlattener", flatten.HbrJsonFlattener(), hbr_items),
+        ("flatten_json", utils.flatten_json, mckinsey_items),
+        ("JsonFlattener", flatten.JsonFlattener(), mckinsey_items),
+        ("remove_html_tags", utils.remove_html_tags, descriptions),
+        ("clean_text", flatten.clean_text, descriptions),
+    ]
+    results = []
+    for name, function, inputs in cases:
+        rate = throughput(function, inputs, args.min_seconds)
+        average_bytes = sum(len(json.dumps(value)) for value in inputs) / len(inputs)
+        results.append({"function": name, "items_per_s": rate, "mb_per_s": rate * average_bytes / 2 ** 20})
+        print(f"{name:>18} {rate:>12,.0f} items/s {rate * average_bytes / 2 ** 20:>8.1f} MB/s")
+    return results
+
+
+# read
+
+def write_synthetic_corpus(directory, size):
+    """
+    Write `size` items to one HBR-layout and one McKinsey-layout feed file, by
+    repeating the bundled items with unique titles and GUIDs.
+    """
+    layouts = [("podcasts_hbr_synthetic.json", load_items("podcasts_hbr_ideacast.json")),
+               ("podcasts_mckinsey_synthetic.json", load_items("podcasts_mckinsey.json"))]
+    counts = [size - size // 2, size // 2]
+    for (file_name, items), count in zip(layouts, counts):
+        with open(Path(directory) / file_name, "w") as f:
+            f.write('{"rss": {"channel": {"title": "Synthetic", "item": [')
+            for n in range(count):
+                item = copy.copy(items[n % len(items)])
+                item["guid"] = {"_isPermaLink": "false", "__text": f"synthetic-{file_name}-{n}"}
+                item["title"] = f"{n}. {item['title'] if isinstance(item['title'], str) else 'Synthetic'}"
+                if n:
+                    f.write(",")
+                json.dump(item, f)
+            f.write("]}}}")
+
+
+def _read_corpus(directory, streaming, results):
+    started = time.perf_counter()
+    count = sum(1 for _ in utils.read_podcasts_json_files(directory, streaming=streaming))
+    elapsed = time.perf_counter() - started
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    results.put((count, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale))
+
+
+def bench_read(args):
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            write_synthetic_corpus(directory, size)
+            corpus_mb = sum(p.stat().st_size for p in Path(directory).iterdir()) / 2 ** 20
+            for streaming in (False, True):
+                queue = context.Queue()
+                process = context.Process(target=_read_corpus, args=(directory, streaming, queue))
+                process.start()
+                count, elapsed, peak = queue.get()
+                process.join()
+                mode = "streaming" if streaming else "whole-file"
+                results.append({"items": count, "mode": mode, "corpus_mb": corpus_mb, "seconds": elapsed,
+                                "items_per_s": count / elapsed, "peak_rss_mb": peak / 2 ** 20})
+                print(f"{count:>10,} items {corpus_mb:>8.1f} MB {mode:>10} {elapsed:>8.2f} s "
+                      f"{peak / 2 ** 20:>8.1f} MB peak RSS")
+    return results
+
+
+# ingest
+
+def _traced(consume):
+    """Run `consume`; return its result, seconds and peak traced memory in bytes."""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    count = consume()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return count, elapsed, peak
+
+
+def bench_ingest(args):
+    """
+    Flatten every item of one synthetic feed file without keeping the results,
+    the access pattern of streaming ingestion, by loading the file whole and
+    by streaming its items.
+    """
+    items = load_items(args.ingest_source)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for copies in args.ingest_copies:
+            path = Path(directory) / args.ingest_source
+            with open(path, "w") as f:
+                f.write('{"rss": {"channel": {"title": "Synthetic", "item": [')
+                for n in range(copies * len(items)):
+                    if n:
+                        f.write(",")
+                    json.dump(items[n % len(items)], f)
+                f.write("]}}}")
+            file_mb = path.stat().st_size / 2 ** 20
+            modes = {
+                "whole-file": lambda: sum(1 for _ in utils.process_single_file(path)),
+                "streaming": lambda: sum(1 for _ in utils.iter_podcasts_json_file(path)),
+            }
+            for mode, consume in modes.items():
+                count, elapsed, peak = _traced(consume)
+                results.append({"items": count, "mode": mode, "file_mb": file_mb, "seconds": elapsed,
+                                "peak_traced_mb": peak / 2 ** 20})
+                print(f"{count:>10,} items {file_mb:>8.1f} MB {mode:>10} {elapsed:>8.2f} s "
+                      f"{peak / 2 ** 20:>8.1f} MB peak traced")
+    return results
+
+
+# parse
+
+def bench_parse(args):
+    """
+    Read a synthetic corpus on threads (workers 0) and on process pools of
+    increasing size. Speedups are relative to threads, and flatten out at the
+    number of cores or when the parent's unpickling of the results saturates.
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        write_synthetic_corpus(directory, args.parse_items)
+        corpus_mb = sum(p.stat().st_size for p in Path(directory).iterdir()) / 2 ** 20
+        baseline = None
+        for workers in [0] + [n for n in args.workers if n > 0]:
+            started = time.perf_counter()
+            count = sum(1 for _ in utils.read_podcasts_json_files(directory, workers=workers,
+                                                                  chunk_bytes=int(args.chunk_mb * 2 ** 20)))
+            elapsed = time.perf_counter() - started
+            baseline = baseline or elapsed
+            mode = "threads" if workers == 0 else f"{workers} processes"
+            results.append({"items": count, "mode": mode, "workers": workers, "corpus_mb": corpus_mb,
+                            "seconds": elapsed, "items_per_s": count / elapsed, "speedup": baseline / elapsed})
+            print(f"{mode:>14} {elapsed:>8.2f} s {count / elapsed:>10,.0f} items/s {baseline / elapsed:>6.2f}x")
+    return results
+
+
+# search
+
+class StubBedrockAgentRuntime:
+    """Local stand-in for bedrock-agent-runtime: scores sources by position after a fixed delay."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def rerank(self, queries, sources, rerankingConfiguration):
+        time.sleep(self.latency)
+        num_results = rerankingConfiguration["bedrockRerankingConfiguration"]["numberOfResults"]
+        return {"results": [{"index": i, "relevanceScore": 1.0 - i / len(sources)} for i in range(num_results)]}
+
+
+def bench_search(args):
+    from fastapi.testclient import TestClient
+
+    import corpus
+    import reranker
+    import search
+
+    corpus.store = corpus.CorpusStore(directory=str(args.data), snapshot_path=None)
+    reranker.bedrock_agent_runtime = StubBedrockAgentRuntime(args.bedrock_latency_ms / 1000)
+    results = {}
+    with TestClient(search.app) as client:
+        for mode in ("uncached", "cached"):
+            latencies = []
+            for n in range(args.requests):
+                if mode == "uncached":
+                    reranker.query_cache.clear()
+                query = SEARCH_QUERIES[n % len(SEARCH_QUERIES)]
+                started = time.perf_counter()
+                response = client.get("/search", params={"q": query, "limit": 10})
+                latencies.append((time.perf_counter() - started) * 1000)
+                response.raise_for_status()
+            latencies.sort()
+            results[mode] = {"requests": len(latencies), "p50_ms": statistics.median(latencies),
+                             "p95_ms": percentile(latencies, 0.95), "p99_ms": percentile(latencies, 0.99),
+                             "max_ms": latencies[-1]}
+            print(f"{mode:>10} p50 {results[mode]['p50_ms']:>8.2f} ms  p95 {results[mode]['p95_ms']:>8.2f} ms  "
+                  f"p99 {results[mode]['p99_ms']:>8.2f} ms")
+    results["bedrock_latency_ms"] = args.bedrock_latency_ms
+    return results
+
+
+# serialize
+
+def bench_serialize(args):
+    from fastapi.responses import JSONResponse
+
+    import corpus
+    import episode_store
+    import reranker
+
+    snapshot = corpus.CorpusStore(directory=str(args.data), snapshot_path=None).snapshot()
+    results = []
+    for size in args.result_sizes:
+        doc_ids = [i % len(snapshot.documents) for i in range(size)]
+        ranked = reranker.RankedResults.from_ids(snapshot, doc_ids)
+        ranked.to_json()
+        functions = {
+            "dicts": lambda: JSONResponse({"results": [episode_store.to_dict(e) for e in ranked]}).body,
+            "encoded": ranked.to_json,
+        }
+        for mode, function in functions.items():
+            per_second = throughput(lambda _: function(), [None], args.min_seconds)
+            results.append({"items": size, "mode": mode, "us_per_response": 1e6 / per_second})
+            print(f"{size:>6} results {mode:>8} {1e6 / per_second:>10.1f} us/response")
+    return results
+
+
+# fusion
+
+def bench_fusion(args):
+    import random
+
+    import corpus
+    import fusion
+    import reranker
+
+    rng = random.Random(0)
+    results = []
+    for size in args.candidate_sizes:
+        hits = sorted(((n, rng.random()) for n in range(size)), key=lambda hit: -hit[1])
+        rerank_results = sorted(({"index": i, "relevanceScore": rng.random()} for i in range(size)),
+                                key=lambda result: -result["relevanceScore"])
+        for mode in fusion.FUSION_MODES:
+            per_second = throughput(lambda _: fusion.fuse(hits, rerank_results, 10, mode), [None], args.min_seconds)
+            results.append({"items": size, "mode": mode, "us_per_search": 1e6 / per_second})
+            print(f"{size:>6} candidates {mode:>8} {1e6 / per_second:>10.1f} us/search")
+
+    snapshot = corpus.CorpusStore(directory=str(args.data), snapshot_path=None).snapshot()
+    confidences = [fusion.first_stage_confidence(
+        reranker.retrieve_candidate_ids(snapshot, query, reranker.RERANK_CANDIDATES, "lexical"), 10)
+        for query in SEARCH_QUERIES]
+    skipped = {}
+    for threshold in (0.05, 0.1, 0.25, 0.5):
+        skipped[str(threshold)] = sum(confidence >= threshold for confidence in confidences) / len(confidences)
+        print(f"confidence >= {threshold:<5} skips rerank for {skipped[str(threshold)]:.0%} of the queries")
+    return {"fuse": results, "skipped_share": skipped}
+
+
+# payload
+
+def bench_payload(args):
+    import bm25
+    import corpus
+    import projection
+
+    snapshot = corpus.CorpusStore(directory=str(args.data), snapshot_path=None).snapshot()
+    index = bm25.get_index(snapshot)
+    documents = projection.get_documents(snapshot)
+    stats = projection.PayloadStats()
+    for query in SEARCH_QUERIES:
+        stats.record(documents, [doc_id for doc_id, _ in index.search(query, args.payload_candidates)])
+    summary = stats.summary()
+    print(f"{summary['documents'] / max(summary['requests'], 1):>8.0f} documents/query "
+          f"{summary['avg_full_bytes_per_request']:>12,.0f} -> {summary['avg_bytes_per_request']:>10,.0f} bytes/query "
+          f"({summary['reduction']:.1%} smaller)")
+    return summary
+
+
+# dense
+
+def random_unit_matrix(rows, dimension, seed=0):
+    import numpy as np
+
+    matrix = np.random.default_rng(seed).standard_normal((rows, dimension), dtype=np.float32)
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+
+def bench_dense(args):
+    import numpy as np
+
+    import dense_index
+
+    results = []
+    queries = random_unit_matrix(args.dense_queries, args.dimension, seed=1)
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.dense_sizes:
+            path = Path(directory) / f"dense-{size}.npy"
+            np.save(path, random_unit_matrix(size, args.dimension))
+            index = dense_index.DenseIndex.load(path, dense_index.HashingEmbedder(args.dimension))
+            k = min(args.dense_k, size)
+            # Fault the mapped pages in
+            index.search_vector(queries[0], k)
+            latencies = []
+            for query in queries:
+                started = time.perf_counter()
+                index.search_vector(query, k)
+                latencies.append((time.perf_counter() - started) * 1000)
+            latencies.sort()
+            results.append({"items": size, "p50_ms": statistics.median(latencies),
+                            "p95_ms": percentile(latencies, 0.95), "max_ms": latencies[-1]})
+            print(f"{size:>10,} episodes p50 {results[-1]['p50_ms']:>8.3f} ms  p95 {results[-1]['p95_ms']:>8.3f} ms  "
+                  f"max {results[-1]['max_ms']:>8.3f} ms")
+    return results
+
+
+# results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def flatten_metrics(results, prefix=""):
+    """Turn nested results into {"read.100000.streaming.seconds": value, ...} for comparison."""
+    metrics = {}
+    if isinstance(results, dict):
+        for key, value in results.items():
+            metrics.update(flatten_metrics(value, f"{prefix}{key}."))
+    elif isinstance(results, list):
+        for entry in results:
+            label = ".".join(str(entry[key]) for key in ("function", "items", "mode") if key in entry)
+            metrics.update(flatten_metrics({k: v for k, v in entry.items() if k not in ("function", "items", "mode")},
+                                           f"{prefix}{label}."))
+    elif isinstance(results, (int, float)):
+        metrics[prefix.rstrip(".")] = results
+    return metrics
+
+
+def compare(current, baseline):
+    before = flatten_metrics(baseline["results"])
+    after = flatten_metrics(current["results"])
+    print(f"\nCompared with {baseline['meta']['commit']}:")
+    for name in sorted(before.keys() & after.keys()):
+        if before[name]:
+            print(f"{name:<55} {before[name]:>12.3f} -> {after[name]:>12.3f} ({after[name] / before[name]:>6.2f}x)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmarks", nargs="*", help=f"Benchmarks to run, among {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--min-seconds", type=float, default=1.0, help="Minimum run time per flatten function")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000],
+                        help="Items in the synthetic corpora read")
+    parser.add_argument("--ingest-source", default="podcasts_hbr_ideacast.json",
+                        help="Bundled feed file repeated into the ingested feed")
+    parser.add_argument("--ingest-copies", type=int, nargs="+", default=[1, 10, 50],
+                        help="Copies of the source items in the ingested feed")
+    parser.add_argument("--parse-items", type=int, default=100_000, help="Items in the corpus parsed")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({1, 2, 4, multiprocessing.cpu_count()}), help="Process pool sizes parsed with")
+    parser.add_argument("--chunk-mb", type=float, default=8, help="Approximate size of the chunks parsed")
+    parser.add_argument("--data", type=Path, default=DATA_DIRECTORY, help="Corpus served by the search benchmark")
+    parser.add_argument("--requests", type=int, default=200, help="Search requests per mode")
+    parser.add_argument("--result-sizes", type=int, nargs="+", default=[10, 100, 1000],
+                        help="Episodes per serialized response")
+    parser.add_argument("--candidate-sizes", type=int, nargs="+", default=[200, 1000],
+                        help="Candidates per fused search")
+    parser.add_argument("--bedrock-latency-ms", type=float, default=0.0, help="Delay of the stubbed rerank call")
+    parser.add_argument("--payload-candidates", type=int, default=200,
+                        help="Candidates sent to rerank per query in the payload benchmark")
+    parser.add_argument("--dense-sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000],
+                        help="Episodes in the dense indexes searched")
+    parser.add_argument("--dimension", type=int, default=256, help="Dimension of the dense vectors")
+    parser.add_argument("--dense-k", type=int, default=200, help="Candidates per dense search")
+    parser.add_argument("--dense-queries", type=int, default=200, help="Queries per dense index")
+    parser.add_argument("--output", type=Path, help="JSON results file (default: results/<commit>.json)")
+    parser.add_argument("--compare", type=Path, help="Results file to compare against")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    report = {
+        "meta": {"commit": git_commit(), "timestamp": time.time(), "python": platform.python_version(),
+                 "platform": platform.platform(), "cpus": multiprocessing.cpu_count(),
+                 "args": {key: str(value) for key, value in vars(args).items()}},
+        "results": {},
+    }
+    for name in dict.fromkeys(args.benchmarks or BENCHMARKS):
+        print(f"== {name}")
+        report["results"][name] = globals()[f"bench_{name}"](args)
+
+    output = args.output or RESULTS_DIRECTORY / f"{report['meta']['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\nWrote {output}")
+    if args.compare:
+        compare(report, json.loads(args.compare.read_text()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+# The API modules import each other as top-level modules (see Dockerfile WORKDIR)
+sys.path.insert(0, str(Path(__file__).parent.parent / "api"))
+
+
+def hbr_item(n, title=None, description=None):
+    """Build an item shaped like the ones in data/podcasts_hbr_*.json."""
+    return {
+        "title": title or f"Episode {n} about strategy",
+        "description": description or f"<p>Episode <b>{n}</b> discusses leadership and strategy.</p>",
+        "enclosure": {
+            "_url": f"https://audio.example.com/hbr/{n}.mp3",
+            "_type": "audio/mpeg",
+            "_length": str(1000 + n)
+        },
+        "guid": {"_isPermaLink": "false", "__text": f"tag:audio.example.com:hbr.{n}"},
+        "duration": {"__prefix": "itunes", "__text": "00:25:00"},
+        "pubDate": "Wed, 22 Jan 2025 05:55:00 -0500"
+    }
+
+
+def mckinsey_item(n, title=None):
+    """Build an item shaped like the ones in data/podcasts_mckinsey.json."""
+    title = title or f"{n}. Reimagining board communications"
+    return {
+        "title": [title, {"__prefix": "itunes", "__text": title}],
+        "description": {"__cdata": f"<p>We discuss board <b>communications</b> number {n}.</p>"},
+        "content": [
+            {"player": {"_url": f"https://omny.fm/{n}/embed"}, "_url": f"https://traffic.omny.fm/{n}.mp3",
+             "_type": "audio/mpeg", "__prefix": "media"}
+        ],
+        "guid": {"_isPermaLink": "false", "__text": f"mckinsey-{n}"},
+        "duration": {"__prefix": "itunes", "__text": "1800"},
+        "pubDate": "Mon, 13 Jan 2025 15:00:00 +0000"
+    }
+
+
+def write_feed(path, items, title="Test Feed"):
+    """Write `items` to `path` in the rss.channel.item layout of the data files."""
+    path.write_text(json.dumps({"rss": {"channel": {"title": title, "item": items}}}))
+    return path
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    """A data directory with one small HBR and one small McKinsey feed."""
+    write_feed(tmp_path / "podcasts_hbr_test.json", [hbr_item(n) for n in range(3)], "HBR Test")
+    write_feed(tmp_path / "podcasts_mckinsey.json", [mckinsey_item(n) for n in range(2)], "Inside the Strategy Room")
+    return tmp_path
+
+
+class FakeBedrockAgentRuntime:
+    """Stand-in for the bedrock-agent-runtime client that ranks sources in reverse order."""
+
+    def __init__(self):
+        self.calls = []
+
+    def rerank(self, queries, sources, rerankingConfiguration):
+        self.calls.append({"queries": queries, "sources": sources, "config": rerankingConfiguration})
+        num_results = rerankingConfiguration["bedrockRerankingConfiguration"]["numberOfResults"]
+        indices = list(reversed(range(len(sources))))[:num_results]
+        return {"results": [{"index": i, "relevanceScore": 1.0 - rank / len(sources)}
+                            for rank, i in enumerate(indices)]}
+
+
+@pytest.fixture
+def store(data_dir, monkeypatch):
+    """Point the application corpus store at `data_dir`."""
+    import corpus
+    test_store = corpus.CorpusStore(directory=str(data_dir), snapshot_path=None)
+    monkeypatch.setattr(corpus, "store", test_store)
+    return test_store
+
+
+@pytest.fixture
+def fake_bedrock(monkeypatch):
+    import reranker
+    from circuit_breaker import CircuitBreaker
+    client = FakeBedrockAgentRuntime()
+    monkeypatch.setattr(reranker, "bedrock_agent_runtime", client)
+    monkeypatch.setattr(reranker, "rerank_breaker", CircuitBreaker("test", min_calls=2))
+    return client
+
+
+@pytest.fixture
+def client(store):
+    """Test client of the API serving the `store` corpus."""
+    from fastapi.testclient import TestClient
+    import search
+    with TestClient(search.app) as test_client:
+        yield test_client
@@ -0,0 +1,33 @@
+import bm25
+
+
+class TestBM25Index:
+
+    documents = [
+        "How to execute a growth strategy",
+        "Leading teams through change",
+        "Strategy and leadership: strategy for middle managers",
+        "Cooking pasta at home",
+    ]
+
+    def test_tokenize_drops_stopwords_and_case(self):
+        assert bm25.tokenize("Learn ABOUT the Strategy, now!") == ["learn", "strategy"]
+
+    def test_search_ranks_matching_documents(self):
+        index = bm25.BM25Index.build(self.documents)
+        hits = index.search("strategy", 10)
+        assert [doc_id for doc_id, _ in hits] == [2, 0]
+        assert hits[0][1] > hits[1][1] > 0
+
+    def test_search_is_limited_to_k(self):
+        index = bm25.BM25Index.build(self.documents)
+        assert len(index.search("strategy leadership teams", 1)) == 1
+
+    def test_search_without_matching_terms_is_empty(self):
+        index = bm25.BM25Index.build(self.documents)
+        assert index.search("quantum", 10) == []
+        assert bm25.BM25Index.build([]).search("strategy", 10) == []
+
+    def test_results_are_reproducible(self):
+        index = bm25.BM25Index.build(self.documents * 3)
+        assert index.search("strategy", 4) == index.search("strategy", 4)
@@ -0,0 +1,92 @@
+from circuit_breaker import CircuitBreaker
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_breaker(clock, **kwargs):
+    options = dict(window_size=4, min_calls=4, failure_rate=0.5, slow_call_seconds=1.0, slow_call_rate=0.75,
+                   open_seconds=10.0, half_open_probes=2, clock=clock)
+    options.update(kwargs)
+    return CircuitBreaker("test", **options)
+
+
+class TestCircuitBreaker:
+
+    def test_opens_when_the_failure_rate_is_reached(self):
+        breaker = make_breaker(FakeClock())
+        for success in (True, False, True):
+            assert breaker.allow()
+            breaker.record(success, 0.1)
+        assert breaker.state == CircuitBreaker.CLOSED
+        breaker.allow()
+        breaker.record(False, 0.1)
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.allow()
+        assert breaker.rejected == 1
+
+    def test_opens_when_the_slow_call_rate_is_reached(self):
+        breaker = make_breaker(FakeClock())
+        for latency in (2.0, 2.0, 0.1, 2.0):
+            breaker.allow()
+            breaker.record(True, latency)
+        assert breaker.state == CircuitBreaker.OPEN
+
+    def test_waits_for_min_calls(self):
+        breaker = make_breaker(FakeClock())
+        for _ in range(3):
+            breaker.allow()
+            breaker.record(False, 0.1)
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_half_open_probes_close_the_breaker(self):
+        clock = FakeClock()
+        breaker = make_breaker(clock, min_calls=1)
+        breaker.allow()
+        breaker.record(False, 0.1)
+        clock.now = 10.0
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.allow() and breaker.allow()
+        assert not breaker.allow()
+        breaker.record(True, 0.1)
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        breaker.record(True, 0.1)
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_a_failed_or_slow_probe_reopens_the_breaker(self):
+        clock = FakeClock()
+        breaker = make_breaker(clock, min_calls=1)
+        breaker.allow()
+        breaker.record(False, 0.1)
+        for outcome in ((False, 0.1), (True, 5.0)):
+            clock.now += 10.0
+            assert breaker.allow()
+            breaker.record(*outcome)
+            assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.opened == 3
+
+    def test_released_probes_can_be_retried(self):
+        clock = FakeClock()
+        breaker = make_breaker(clock, min_calls=1, half_open_probes=1)
+        breaker.allow()
+        breaker.record(False, 0.1)
+        clock.now = 10.0
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.release()
+        assert breaker.allow()
+
+    def test_outcomes_of_calls_started_before_opening_are_ignored(self):
+        clock = FakeClock()
+        breaker = make_breaker(clock, min_calls=1)
+        breaker.allow()
+        breaker.allow()
+        breaker.record(False, 0.1)
+        breaker.record(True, 0.1)
+        assert breaker.state == CircuitBreaker.OPEN
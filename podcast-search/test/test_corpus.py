@@ -0,0 +1,56 @@
+import os
+
+import corpus
+import utils
+from conftest import hbr_item, write_feed
+
+
+class TestCorpusStore:
+
+    def test_snapshot_loads_all_feeds(self, data_dir):
+        store = corpus.CorpusStore(directory=str(data_dir))
+        snapshot = store.snapshot()
+        assert len(snapshot.episodes) == 5
+        assert snapshot.version > 0
+
+    def test_unchanged_files_are_not_parsed_again(self, data_dir, monkeypatch):
+        store = corpus.CorpusStore(directory=str(data_dir), check_interval=0)
+        first = store.snapshot()
+        monkeypatch.setattr(utils, "read_podcast_feeds",
+                            lambda *args, **kwargs: (_ for _ in ()).throw(AssertionError("corpus parsed again")))
+        assert store.snapshot() is first
+
+    def test_changed_file_triggers_reload(self, data_dir):
+        store = corpus.CorpusStore(directory=str(data_dir), check_interval=0)
+        first = store.snapshot()
+        reloaded = []
+        store.add_listener(reloaded.append)
+
+        feed = data_dir / "podcasts_hbr_test.json"
+        write_feed(feed, [hbr_item(n) for n in range(4)])
+        stat = feed.stat()
+        os.utime(feed, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        second = store.snapshot()
+        assert second is not first
+        assert second.version == first.version + 1
+        assert len(second.episodes) == 6
+        assert reloaded == [second]
+
+    def test_failed_reload_keeps_serving_previous_snapshot(self, data_dir, monkeypatch):
+        store = corpus.CorpusStore(directory=str(data_dir), check_interval=0)
+        first = store.snapshot()
+        monkeypatch.setattr(store, "fingerprint", lambda: (_ for _ in ()).throw(FileNotFoundError("gone")))
+        assert store.snapshot() is first
+
+    def test_derived_structures_are_built_once_per_snapshot(self, data_dir):
+        snapshot = corpus.CorpusStore(directory=str(data_dir)).snapshot()
+        calls = []
+
+        def build(s):
+            calls.append(s)
+            return len(s.episodes)
+
+        assert snapshot.derived("count", build) == 5
+        assert snapshot.derived("count", build) == 5
+        assert calls == [snapshot]
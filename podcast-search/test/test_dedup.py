@@ -0,0 +1,75 @@
+import corpus
+import dedup
+from conftest import hbr_item, mckinsey_item, write_feed
+
+LONG_DESCRIPTION = ("In this episode our guest explains why most change programs stall, how managers can "
+                    "redesign the systems their teams work in, and which small experiments build momentum "
+                    "before a company commits to a large transformation effort across every business unit.")
+
+
+class TestKeys:
+
+    def test_titles_are_reduced_to_words(self):
+        assert dedup.normalize_title("Ep. 12:  Growth — Now!") == "ep 12 growth now"
+
+    def test_urls_ignore_scheme_and_query(self):
+        assert (dedup.normalize_url("http://Audio.example.com/1.mp3?utm_source=feed")
+                == dedup.normalize_url("https://audio.example.com/1.mp3"))
+
+    def test_media_content_audio_is_the_enclosure(self):
+        episode = {"content_0__url": "https://example.com/1.jpg", "content_0__type": "image/jpeg",
+                   "content_1__url": "https://example.com/1.mp3", "content_1__type": "audio/mpeg"}
+        assert dedup.enclosure_url(episode) == "https://example.com/1.mp3"
+
+
+class TestSimHasher:
+
+    def test_similar_texts_have_close_fingerprints(self):
+        hasher = dedup.SimHasher()
+        original = hasher.fingerprint(LONG_DESCRIPTION)
+        edited = hasher.fingerprint(LONG_DESCRIPTION.replace("stall", "fail"))
+        unrelated = hasher.fingerprint("A conversation about negotiating salaries and job offers in tech.")
+        assert bin(original ^ edited).count("1") < bin(original ^ unrelated).count("1")
+        assert hasher.fingerprint("") is None
+
+
+class TestDeduplicator:
+
+    def test_exact_duplicates_keep_the_first_episode_and_record_feeds(self):
+        first = {"title": "Managing Up", "enclosure__url": "https://a.example.com/1.mp3?src=ideacast"}
+        repeat = {"title": "Managing up!", "enclosure__url": "http://a.example.com/1.mp3", "link": "x"}
+        other = {"title": "Managing Down", "enclosure__url": "https://a.example.com/2.mp3"}
+        deduplicator = dedup.Deduplicator()
+        kept = list(deduplicator.deduplicate([("ideacast", [first, other]), ("leadership", [repeat])]))
+        assert kept == [first, other]
+        assert deduplicator.feeds == [["ideacast", "leadership"], ["ideacast"]]
+        assert deduplicator.duplicates == 1
+
+    def test_near_duplicates_are_dropped(self):
+        first = {"title": "Why Change Stalls", "description": LONG_DESCRIPTION}
+        rerun = {"title": "Best of: Why Change Stalls", "description": LONG_DESCRIPTION}
+        deduplicator = dedup.Deduplicator()
+        assert list(deduplicator.deduplicate([("ideacast", [first]), ("strategy", [rerun])])) == [first]
+        assert deduplicator.near_duplicates == 1
+        assert deduplicator.feeds == [["ideacast", "strategy"]]
+
+
+class TestStoreDedup:
+
+    def write_overlapping_feeds(self, directory):
+        write_feed(directory / "podcasts_hbr_ideacast.json", [hbr_item(n) for n in range(3)])
+        write_feed(directory / "podcasts_hbr_leadership.json", [hbr_item(1), hbr_item(2), hbr_item(7)])
+        write_feed(directory / "podcasts_mckinsey.json", [mckinsey_item(0)])
+
+    def test_duplicates_across_feeds_are_loaded_once(self, tmp_path):
+        self.write_overlapping_feeds(tmp_path)
+        snapshot = corpus.CorpusStore(directory=str(tmp_path), snapshot_path=None).load()
+        assert len(snapshot.episodes) == 5
+        assert snapshot.feeds[1] == ["podcasts_hbr_ideacast", "podcasts_hbr_leadership"]
+        assert snapshot.feeds[3] == ["podcasts_hbr_leadership"]
+
+    def test_dedup_can_be_disabled(self, tmp_path):
+        self.write_overlapping_feeds(tmp_path)
+        snapshot = corpus.CorpusStore(directory=str(tmp_path), snapshot_path=None, deduplicate=False).load()
+        assert len(snapshot.episodes) == 7
+        assert snapshot.feeds[3] == ["podcasts_hbr_leadership"]
@@ -0,0 +1,50 @@
+import numpy as np
+
+import dense_index
+import reranker
+
+
+class TestHashingEmbedder:
+
+    def test_embeddings_are_deterministic_and_normalized(self):
+        embedder = dense_index.HashingEmbedder(64)
+        first = embedder.embed(["growth strategy for managers", ""])
+        second = embedder.embed(["growth strategy for managers", ""])
+        assert first.dtype == np.float32
+        assert np.array_equal(first, second)
+        assert np.isclose(np.linalg.norm(first[0]), 1.0)
+        assert not np.any(first[1])
+
+
+class TestDenseIndex:
+
+    texts = ["growth strategy", "leading teams through change", "cooking pasta", "strategy for growth"]
+
+    def test_search_returns_nearest_documents_first(self):
+        index = dense_index.DenseIndex.build(self.texts, dense_index.HashingEmbedder(128))
+        hits = index.search("growth strategy", 2)
+        assert [doc_id for doc_id, _ in hits][0] == 0
+        assert {doc_id for doc_id, _ in hits} == {0, 3}
+        assert hits[0][1] >= hits[1][1]
+
+    def test_k_larger_than_corpus_and_empty_query(self):
+        index = dense_index.DenseIndex.build(self.texts, dense_index.HashingEmbedder(128))
+        assert len(index.search("growth", 10)) == 4
+        assert index.search("the", 10) == []
+
+    def test_saved_matrix_is_memory_mapped(self, tmp_path):
+        embedder = dense_index.HashingEmbedder(32)
+        index = dense_index.DenseIndex.build(self.texts, embedder, tmp_path / "dense.npy")
+        assert isinstance(index.matrix, np.memmap)
+        assert index.matrix.flags["C_CONTIGUOUS"]
+        assert index.search("cooking", 1)[0][0] == 2
+
+
+class TestDenseRetrieval:
+
+    def test_rerank_podcasts_takes_candidates_from_dense_index(self, store, fake_bedrock, tmp_path, monkeypatch):
+        monkeypatch.setattr(dense_index, "INDEX_DIRECTORY", tmp_path / "index")
+        results = reranker.rerank_podcasts("board communications", 1, retrieval="dense")
+        assert len(fake_bedrock.calls[0]["sources"]) == 5
+        assert len(results) == 1
+        assert list((tmp_path / "index").glob("dense-*.npy"))
@@ -0,0 +1,89 @@
+import json
+
+import pytest
+
+import utils
+from episode_store import EncodedEpisodes, EpisodeRecord, EpisodeTable, encode_episode, join_json, to_dict
+
+
+@pytest.fixture(scope="module")
+def bundled_episodes():
+    return list(utils.read_podcasts_json_files())
+
+
+class TestEpisodeTable:
+
+    def test_records_serialize_to_the_same_json(self, bundled_episodes):
+        table = EpisodeTable.from_episodes(bundled_episodes)
+        assert len(table) == len(bundled_episodes)
+        for record, episode in zip(table, bundled_episodes):
+            assert json.dumps(to_dict(record)) == json.dumps(episode)
+
+    def test_records_behave_like_dicts(self):
+        episode = {"title": "Strategy", "enclosure__length": "30748042", "episode___text": "007"}
+        record = EpisodeTable.from_episodes([episode])[0]
+        assert isinstance(record, EpisodeRecord)
+        assert record == episode
+        assert list(record) == list(episode)
+        assert record["enclosure__length"] == "30748042"
+        assert record.get("missing") is None
+        assert "title" in record and "missing" not in record
+        assert list(record.items()) == list(episode.items())
+
+    def test_integer_fields_are_stored_in_columns(self):
+        table = EpisodeTable.from_episodes([
+            {"title": "a", "enclosure__length": "100"},
+            {"title": "b"},
+            {"title": "c", "enclosure__length": "0100"},
+        ])
+        assert len(table._columns) == 1
+        assert table._columns[0][0] == 100
+        assert [dict(r) for r in table] == [
+            {"title": "a", "enclosure__length": "100"},
+            {"title": "b"},
+            {"title": "c", "enclosure__length": "0100"},
+        ]
+
+    def test_keys_and_repeated_values_are_shared(self):
+        description = "x" * 200
+        table = EpisodeTable.from_episodes([
+            {"enclosure__type": "audio/mpeg", "description": description, "encoded": "x" * 200},
+            {"enclosure__type": "audio/" + "mpeg", "description": "y"},
+        ])
+        first, second = table._row_values
+        assert first[0] is second[0]
+        assert first[1] is first[2]
+        assert len(table._shape_keys) == 2
+
+    def test_negative_indexes_and_slices(self):
+        table = EpisodeTable.from_episodes([{"n": "a"}, {"n": "b"}, {"n": "c"}])
+        assert table[-1]["n"] == "c"
+        assert [r["n"] for r in table[1:]] == ["b", "c"]
+        with pytest.raises(IndexError):
+            table[3]
+
+
+class TestEncodedEpisodes:
+
+    def test_encodings_match_json_responses(self, bundled_episodes):
+        table = EpisodeTable.from_episodes(bundled_episodes)
+        encoded = EncodedEpisodes(table)
+        body = join_json("results", (encoded[i] for i in (5, 0, 5)))
+        assert json.loads(body) == {"results": [bundled_episodes[5], bundled_episodes[0], bundled_episodes[5]]}
+        assert encoded[5] is encoded[5]
+
+    def test_stored_encodings_are_not_copied(self):
+        class Stored(list):
+            def encoded(self, index):
+                return memoryview(b'{"stored":true}')
+
+        assert bytes(EncodedEpisodes(Stored([{"n": "a"}]))[0]) == b'{"stored":true}'
+
+    def test_updates_keep_known_encodings_and_encode_added_episodes(self):
+        encoded = EncodedEpisodes([{"n": "a"}, {"n": "b"}])
+        first = encoded[0]
+        updated = encoded.updated([(2, {"n": "c"})], {1})
+        assert len(encoded) == 2 and len(updated) == 3
+        assert updated[0] is first
+        assert updated[1] == encode_episode({"n": "b"})
+        assert updated[2] == b'{"n":"c"}'
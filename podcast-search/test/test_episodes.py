@@ -0,0 +1,75 @@
+import json
+
+from fastapi.responses import JSONResponse
+
+import episode_store
+import utils
+from conftest import hbr_item, write_feed
+
+
+class TestEpisodesEndpoint:
+
+    def test_returns_all_episodes_by_default(self, client, data_dir):
+        response = client.get("/episodes")
+        assert response.status_code == 200
+        assert response.json() == {"episodes": list(utils.read_podcasts_json_files(str(data_dir)))}
+        assert response.headers["X-Total-Count"] == "5"
+        assert "Link" not in response.headers
+
+    def test_body_matches_the_json_encoder(self, client, data_dir):
+        response = client.get("/episodes")
+        assert response.headers["content-type"] == "application/json"
+        expected = JSONResponse({"episodes": list(utils.read_podcasts_json_files(str(data_dir)))}).body
+        assert response.content == expected
+
+    def test_deleted_episodes_are_not_listed(self, client, data_dir, store):
+        client.get("/episodes")
+        write_feed(data_dir / "podcasts_hbr_test.json", [hbr_item(0), hbr_item(2)], "HBR Test")
+        store.refresh()
+        assert store.snapshot().deleted
+        titles = [e["title"] for e in client.get("/episodes", params={"offset": 1, "limit": 2}).json()["episodes"]]
+        assert titles == ["Episode 2 about strategy", "0. Reimagining board communications"]
+
+    def test_offset_pagination(self, client, data_dir):
+        everything = list(utils.read_podcasts_json_files(str(data_dir)))
+        response = client.get("/episodes", params={"offset": 1, "limit": 2})
+        assert response.json() == {"episodes": everything[1:3]}
+        assert 'offset=3' in response.headers["Link"] and 'rel="next"' in response.headers["Link"]
+
+        last = client.get("/episodes", params={"offset": 3, "limit": 2})
+        assert last.json() == {"episodes": everything[3:]}
+        assert "Link" not in last.headers
+        assert client.get("/episodes", params={"offset": 50}).json() == {"episodes": []}
+
+    def test_pagination_headers_are_exposed_to_the_frontend(self, client):
+        response = client.get("/episodes", params={"limit": 2}, headers={"Origin": "http://localhost:3000"})
+        exposed = {name.strip().lower() for name in response.headers["Access-Control-Expose-Headers"].split(",")}
+        assert {"x-total-count", "link"} <= exposed
+
+    def test_field_projection(self, client):
+        episodes = client.get("/episodes", params={"fields": "title,pubDate"}).json()["episodes"]
+        assert all(set(episode) <= {"title", "pubDate"} for episode in episodes)
+        assert all("pubDate" in episode for episode in episodes)
+
+    def test_ndjson_streaming(self, client, data_dir):
+        response = client.get("/episodes", params={"format": "ndjson", "offset": 2})
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        lines = response.text.splitlines()
+        assert [json.loads(line) for line in lines] == list(utils.read_podcasts_json_files(str(data_dir)))[2:]
+
+        accepted = client.get("/episodes", headers={"Accept": "application/x-ndjson"}, params={"limit": 1})
+        assert len(accepted.text.splitlines()) == 1
+
+    def test_ndjson_reuses_the_encoded_episodes(self, client, monkeypatch):
+        expected = [json.dumps(e, ensure_ascii=False, separators=(",", ":"))
+                    for e in client.get("/episodes").json()["episodes"]]
+
+        def fail(episode):
+            raise AssertionError("episode encoded again")
+
+        monkeypatch.setattr(episode_store, "encode_episode", fail)
+        assert client.get("/episodes", params={"format": "ndjson"}).text.splitlines() == expected
+
+    def test_invalid_parameters_are_rejected(self, client):
+        assert client.get("/episodes", params={"offset": -1}).status_code == 422
+        assert client.get("/episodes", params={"format": "xml"}).status_code == 422
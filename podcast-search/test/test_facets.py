@@ -0,0 +1,138 @@
+import math
+from datetime import date
+
+import numpy as np
+import pytest
+
+import bm25
+import dense_index
+import facets
+import reranker
+from conftest import hbr_item, write_feed
+
+
+class TestParsing:
+
+    def test_pub_dates_are_parsed_to_timestamps(self):
+        assert facets.parse_pub_date("Mon, 13 Jan 2025 15:00:00 +0000") == 1736780400.0
+        assert facets.parse_pub_date("Mon, 13 Jan 2025 10:00:00 -0500") == 1736780400.0
+
+    @pytest.mark.parametrize("value", [None, "", "yesterday", 20250113])
+    def test_unknown_pub_dates_are_nan(self, value):
+        assert math.isnan(facets.parse_pub_date(value))
+
+    @pytest.mark.parametrize("value, seconds", [("1837", 1837), ("26:25", 1585), ("00:26:25", 1585),
+                                                ("1:02:03", 3723)])
+    def test_durations_are_parsed_to_seconds(self, value, seconds):
+        assert facets.parse_duration(value) == seconds
+
+    @pytest.mark.parametrize("value", [None, "", "26 min", "1:2:3:4", "-5"])
+    def test_unknown_durations_are_nan(self, value):
+        assert math.isnan(facets.parse_duration(value))
+
+    def test_durations_are_read_from_both_layouts(self):
+        assert facets.episode_duration({"duration___text": "00:25:00", "duration___prefix": "itunes"}) == 1500
+        assert facets.episode_duration({"duration__itunes": "1800"}) == 1800
+        assert math.isnan(facets.episode_duration({"title": "No duration"}))
+
+
+class TestSortedIndex:
+
+    def test_range_masks_include_both_bounds(self):
+        index = facets.SortedIndex(np.array([30.0, 10.0, math.nan, 20.0, 10.0]))
+        assert index.range_mask(10, 20).tolist() == [False, True, False, True, True]
+        assert index.range_mask(15, None).tolist() == [True, False, False, True, False]
+        assert index.range_mask(None, None).tolist() == [True, True, False, True, True]
+        assert not index.range_mask(40, None).any()
+
+    def test_updates_extend_the_values(self):
+        index = facets.FacetIndex.from_episodes([{"duration__itunes": "60"}])
+        updated = index.updated([(1, {"duration__itunes": "120"})], ())
+        assert len(index) == 1
+        assert updated.duration.range_mask(100, None).tolist() == [False, True]
+
+
+class TestFacetFilter:
+
+    def test_empty_filters_filter_nothing(self, store):
+        assert not facets.FacetFilter()
+        assert facets.FacetFilter().mask(store.snapshot()) is None
+
+    def test_shows_match_feed_names_with_or_without_prefix(self, store):
+        snapshot = store.snapshot()
+        mckinsey = [i for i, feeds in enumerate(snapshot.feeds) if "podcasts_mckinsey" in feeds]
+        assert len(mckinsey) == 2
+        for show in ("mckinsey", "podcasts_mckinsey", " McKinsey "):
+            assert np.flatnonzero(facets.FacetFilter([show]).mask(snapshot)).tolist() == mckinsey
+        assert facets.FacetFilter(["mckinsey", "hbr_test"]).mask(snapshot).all()
+        assert not facets.FacetFilter(["unknown"]).mask(snapshot).any()
+
+    def test_criteria_are_intersected(self, store):
+        snapshot = store.snapshot()
+        hbr = facets.FacetFilter(published_after=date(2025, 1, 22), max_duration=1500).mask(snapshot)
+        assert hbr.sum() == 3
+        assert not facets.FacetFilter(["mckinsey"], published_after=date(2025, 1, 22)).mask(snapshot).any()
+
+    def test_date_bounds_are_whole_days(self, store):
+        snapshot = store.snapshot()
+        assert facets.FacetFilter(published_before=date(2025, 1, 13)).mask(snapshot).sum() == 2
+        assert facets.FacetFilter(published_after=date(2025, 1, 14),
+                                  published_before=date(2025, 1, 21)).mask(snapshot).sum() == 0
+
+    def test_keys_ignore_show_order_and_case(self):
+        assert facets.FacetFilter(["b", "A"]).key == facets.FacetFilter(["a", "b"]).key
+        assert facets.FacetFilter(["a"]).key != facets.FacetFilter(["a"], min_duration=60).key
+
+    def test_date_index_follows_corpus_updates(self, store, data_dir):
+        facets.get_index(store.snapshot())
+        write_feed(data_dir / "podcasts_hbr_test.json",
+                   [hbr_item(n) for n in range(3)] + [dict(hbr_item(3), pubDate="Sat, 01 Feb 2025 08:00:00 +0000")])
+        snapshot = store.refresh()
+        assert facets.FacetFilter(published_after=date(2025, 2, 1)).mask(snapshot).sum() == 1
+        assert facets.FacetFilter(["hbr_test"]).mask(snapshot).sum() == 4
+
+
+class TestFilteredRetrieval:
+
+    def test_bm25_only_returns_allowed_documents(self):
+        index = bm25.BM25Index.build(["board strategy", "board", "strategy"])
+        allowed = np.array([False, True, True])
+        assert [doc_id for doc_id, _ in index.search("board strategy", 3, allowed)] == [1, 2]
+        assert [doc_id for doc_id, _ in index.updated((), {1}).search("board", 3, allowed)] == []
+
+    def test_dense_only_returns_allowed_documents(self):
+        matrix = np.eye(3, dtype=np.float32)
+        index = dense_index.DenseIndex(matrix, embedder=None)
+        allowed = np.array([True, False, True])
+        assert [doc_id for doc_id, _ in index.search_vector(np.array([0.6, 0.8, 0.0]), 3, allowed)] == [0, 2]
+        assert index.search_vector(np.array([0.0, 1.0, 0.0]), 3, np.zeros(3, dtype=bool)) == []
+
+
+class TestSearch:
+
+    def test_filters_apply_before_rerank(self, client, fake_bedrock):
+        response = client.get("/search", params={"q": "strategy", "show": "hbr_test"})
+        assert response.status_code == 200
+        assert {r["guid___text"] for r in response.json()["results"]} == {f"tag:audio.example.com:hbr.{n}"
+                                                                         for n in range(3)}
+        assert len(fake_bedrock.calls[0]["sources"]) == 3
+
+    def test_filters_are_part_of_the_cache_key(self, client, fake_bedrock):
+        reranker.query_cache.clear()
+        everything = client.get("/search", params={"q": "strategy board"}).json()["results"]
+        short = client.get("/search", params={"q": "strategy board", "max_duration": 1500}).json()["results"]
+        assert len(everything) == 5
+        assert len(short) == 3
+        assert len(fake_bedrock.calls) == 2
+
+    def test_searches_matching_no_episode_skip_retrieval_and_rerank(self, client, fake_bedrock):
+        response = client.get("/search", params={"q": "strategy", "show": ["mckinsey", "hbr_test"],
+                                                  "published_after": "2030-01-01"})
+        assert response.status_code == 200
+        assert response.json() == {"results": []}
+        assert fake_bedrock.calls == []
+
+    @pytest.mark.parametrize("params", [{"published_after": "last week"}, {"min_duration": -1}])
+    def test_invalid_filters_are_rejected(self, client, params):
+        response = client.get("/search", params=dict(params, q="strategy"))
+        assert response.status_code == 422
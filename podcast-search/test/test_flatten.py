@@ -0,0 +1,77 @@
+import json
+from pathlib import Path
+
+import pytest
+
+import flatten
+import utils
+
+DATA_DIRECTORY = Path(__file__).parent.parent / "data"
+
+
+def encode(flattened):
+    """Bytes of a flattened item, sensitive to key order and value types."""
+    return json.dumps(flattened, ensure_ascii=False).encode("utf-8")
+
+
+def bundled_items(file_path):
+    with open(file_path) as f:
+        return json.load(f)["rss"]["channel"]["item"]
+
+
+class TestBundledFeeds:
+
+    @pytest.mark.parametrize("file_path", sorted(DATA_DIRECTORY.glob("*.json")), ids=lambda path: path.stem)
+    def test_output_is_byte_identical_to_the_reference_flattener(self, file_path):
+        reference = utils.flatten_hbr_json if "hbr" in file_path.name else utils.flatten_json
+        flattener = utils.flattener_for(file_path)
+        items = bundled_items(file_path)
+        # Twice, so the second pass runs on the plans compiled during the first
+        for _ in range(2):
+            for item in items:
+                assert encode(flattener(item)) == encode(reference(item))
+
+    def test_html_tags_are_removed_like_the_reference(self):
+        descriptions = [item["description"] for item in bundled_items(DATA_DIRECTORY / "podcasts_hbr_ideacast.json")]
+        for text in descriptions + ["", None, "  a  <b>b</b>\n c ", "a < b", "<<p>>"]:
+            assert flatten.clean_text(text) == utils.remove_html_tags(text)
+
+
+class TestHbrJsonFlattener:
+
+    @pytest.mark.parametrize("item", [
+        {"a": {"b": {"c": " <i>x</i> "}, "d": [1, {"e": "<b>y</b>"}, [None, "z"]]}},
+        {"a_b": "first", "a": {"b": "second"}},
+        {"": {"x": "1"}, "y": ["a", "b"]},
+        {"a": {}, "b": [], "c": None, "d": 0},
+        ["a", {"b": "c"}],
+        "not an item",
+    ])
+    def test_matches_the_reference_on_edge_cases(self, item):
+        assert encode(flatten.HbrJsonFlattener()(item)) == encode(utils.flatten_hbr_json(item))
+
+    def test_shapes_of_the_same_key_get_their_own_plan(self):
+        flattener = flatten.HbrJsonFlattener()
+        items = [{"enclosure": {"_url": "u", "_type": "t"}},
+                 {"enclosure": [{"_url": "u1"}, {"_url": "u2"}]},
+                 {"enclosure": {"_type": "t", "_url": "u"}}]
+        for item in items:
+            assert encode(flattener(item)) == encode(utils.flatten_hbr_json(item))
+
+
+class TestJsonFlattener:
+
+    @pytest.mark.parametrize("item", [
+        {"title": [{"__prefix": "itunes", "__text": "T"}, "ignored"], "category": ["a", "b"]},
+        {"title": ["<b>T</b>"], "summary": {"__prefix": "itunes", "__text": "<p>kept</p>"}},
+        {"content": [{"_url": "a", "player": {"_url": "p"}, "other": 1}, {"_type": "audio/mpeg"}]},
+        {"description": {"__cdata": "<p>x</p>", "_ignored": "y"}, "link": "l", "empty": None},
+    ])
+    def test_matches_the_reference_on_edge_cases(self, item):
+        assert encode(flatten.JsonFlattener()(item)) == encode(utils.flatten_json(item))
+
+    def test_prefixes_varying_across_items_are_kept(self):
+        flattener = flatten.JsonFlattener()
+        for prefix in ("itunes", "googleplay"):
+            item = {"author": {"__prefix": prefix, "__text": "A"}}
+            assert flattener(item) == utils.flatten_json(item) == {f"author__{prefix}": "A"}
@@ -0,0 +1,113 @@
+import random
+
+import pytest
+
+import corpus
+import fusion
+import metrics
+import reranker
+import snapshot_file
+
+HITS = [(10, 3.0), (11, 2.0), (12, 1.0)]
+# The reranker reverses the first-stage order
+RERANKED = [{"index": 2, "relevanceScore": 0.9}, {"index": 1, "relevanceScore": 0.5},
+            {"index": 0, "relevanceScore": 0.1}]
+
+
+def doc_ids(scored_hits):
+    return [doc_id for doc_id, _ in scored_hits]
+
+
+class TestFuse:
+
+    def test_rerank_mode_keeps_the_rerank_order(self):
+        fused = fusion.fuse(HITS, RERANKED[:2], 3, "rerank")
+        assert fused == [(12, {"retrieval": 1.0, "rerank": 0.9}), (11, {"retrieval": 2.0, "rerank": 0.5})]
+
+    @pytest.mark.parametrize("weight, expected", [(0.5, [10, 12, 11]), (0.7, [12, 11, 10]), (0.0, [10, 11, 12])])
+    def test_rrf_combines_ranks(self, weight, expected):
+        fused = fusion.fuse(HITS, RERANKED, 3, "rrf", weight)
+        assert doc_ids(fused) == expected
+        assert fused[0][1]["fused"] == pytest.approx(max(weight / (61 + r) + (1 - weight) / (61 + f)
+                                                         for r, f in ((2, 0), (1, 1), (0, 2))))
+
+    @pytest.mark.parametrize("weight, expected", [(0.5, [10, 11, 12]), (0.7, [12, 11, 10])])
+    def test_weighted_combines_normalized_scores(self, weight, expected):
+        fused = fusion.fuse(HITS, RERANKED, 3, "weighted", weight)
+        assert doc_ids(fused) == expected
+        assert fused[-1][1] == {"retrieval": HITS[[10, 11, 12].index(expected[-1])][1],
+                                "rerank": pytest.approx(0.1 if expected[-1] == 10 else 0.9),
+                                "fused": pytest.approx(min(weight * r + (1 - weight) * f
+                                                           for r, f in ((0.1, 1.0), (0.5, 0.5), (0.9, 0.0))))}
+
+    def test_candidates_left_out_by_the_reranker_keep_their_first_stage_score(self):
+        fused = fusion.fuse(HITS, RERANKED[:1], 3, "weighted", 0.5)
+        assert doc_ids(fused) == [10, 12, 11]
+        assert [set(scores) for _, scores in fused] == [{"retrieval", "fused"}, {"retrieval", "rerank", "fused"},
+                                                        {"retrieval", "fused"}]
+
+    def test_heap_selection_matches_a_full_sort(self):
+        rng = random.Random(7)
+        hits = sorted(((n, rng.random()) for n in range(500)), key=lambda hit: -hit[1])
+        results = [{"index": i, "relevanceScore": rng.random()} for i in rng.sample(range(500), 300)]
+        results.sort(key=lambda result: -result["relevanceScore"])
+        for mode in fusion.FUSION_MODES:
+            everything = fusion.fuse(hits, results, len(hits), mode)
+            assert fusion.fuse(hits, results, 10, mode) == everything[:10]
+
+    def test_unknown_modes_are_rejected(self):
+        with pytest.raises(ValueError):
+            fusion.fuse(HITS, RERANKED, 3, "borda")
+
+
+class TestFirstStageConfidence:
+
+    def test_confidence_is_the_relative_gap_after_the_last_result(self):
+        hits = [(0, 10.0), (1, 9.0), (2, 2.0), (3, 1.0)]
+        assert fusion.first_stage_confidence(hits, 2) == pytest.approx(7 / 9)
+        assert fusion.first_stage_confidence(hits, 1) == pytest.approx(1 / 9)
+
+    @pytest.mark.parametrize("hits, num_results", [(HITS, 3), (HITS, 5), ([(0, 1.0), (1, 1.0)], 1)])
+    def test_no_confidence_without_a_left_out_hit_or_a_spread(self, hits, num_results):
+        assert fusion.first_stage_confidence(hits, num_results) == 0.0
+
+
+class TestSearch:
+
+    def test_fusion_reranks_every_candidate(self, client, fake_bedrock, monkeypatch):
+        monkeypatch.setattr(fusion, "RANK_FUSION", "rrf")
+        response = client.get("/search", params={"q": "episode strategy board", "limit": 2})
+        config = fake_bedrock.calls[0]["config"]["bedrockRerankingConfiguration"]
+        assert config["numberOfResults"] == len(fake_bedrock.calls[0]["sources"]) == 5
+        assert len(response.json()["results"]) == 2
+
+    def test_scores_are_only_sent_on_request(self, client, fake_bedrock):
+        params = {"q": "board communications", "limit": 2}
+        assert all("_scores" not in r for r in client.get("/search", params=params).json()["results"])
+        results = client.get("/search", params=dict(params, scores=True)).json()["results"]
+        assert [r["guid__text"] for r in results] == ["mckinsey-1", "mckinsey-0"]
+        assert [set(r["_scores"]) for r in results] == [{"retrieval", "rerank"}] * 2
+        assert results[0]["_scores"]["rerank"] > results[1]["_scores"]["rerank"]
+
+    def test_scores_are_spliced_into_mapped_episodes(self, client, fake_bedrock, data_dir, tmp_path, monkeypatch):
+        path = snapshot_file.build(str(data_dir), output=tmp_path / "corpus.snapshot")
+        monkeypatch.setattr(corpus, "store", corpus.CorpusStore(directory=str(data_dir), snapshot_path=path))
+        assert isinstance(corpus.store.snapshot().episodes, snapshot_file.MappedEpisodes)
+        response = client.get("/search", params={"q": "board communications", "limit": 2, "scores": True})
+        assert response.status_code == 200
+        results = response.json()["results"]
+        assert [r["guid__text"] for r in results] == ["mckinsey-1", "mckinsey-0"]
+        assert [set(r["_scores"]) for r in results] == [{"retrieval", "rerank"}] * 2
+
+    def test_confident_first_stage_skips_rerank(self, client, fake_bedrock, monkeypatch):
+        monkeypatch.setattr(reranker, "RERANK_SKIP_CONFIDENCE", 0.5)
+        skips = metrics.RERANK_SKIPS._values.get((), 0)
+        # The three HBR episodes match both terms, the McKinsey ones only "board"
+        response = client.get("/search", params={"q": "episode strategy board", "limit": 3, "scores": True})
+        assert fake_bedrock.calls == []
+        assert "X-Search-Degraded" not in response.headers
+        assert [set(r["_scores"]) for r in response.json()["results"]] == [{"retrieval"}] * 3
+        assert metrics.RERANK_SKIPS._values[()] == skips + 1
+
+        client.get("/search", params={"q": "episode strategy board", "limit": 2})
+        assert len(fake_bedrock.calls) == 1
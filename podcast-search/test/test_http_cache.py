@@ -0,0 +1,121 @@
+import os
+
+import pytest
+from botocore.exceptions import ClientError
+
+import corpus
+import fusion
+import http_cache
+import reranker
+from conftest import hbr_item, write_feed
+
+
+class TestValidators:
+
+    def test_version_hash_is_the_same_in_every_store(self, store, data_dir):
+        other = corpus.CorpusStore(directory=str(data_dir), snapshot_path=None)
+        assert other.snapshot().version != store.snapshot().version
+        assert other.snapshot().version_hash == store.snapshot().version_hash
+        assert store.snapshot().last_modified == max(int(p.stat().st_mtime) for p in data_dir.iterdir())
+
+    def test_version_hash_depends_on_dedup(self, store, data_dir):
+        other = corpus.CorpusStore(directory=str(data_dir), snapshot_path=None, deduplicate=False)
+        assert other.snapshot().version_hash != store.snapshot().version_hash
+
+    def test_workers_mapping_the_same_snapshot_agree_on_the_version_hash(self, data_dir, tmp_path):
+        def worker():
+            return corpus.CorpusStore(directory=str(data_dir), snapshot_path=tmp_path / "corpus.snapshot",
+                                      shared=True, check_interval=0)
+
+        builder = worker()
+        first = builder.snapshot()
+        for file_path in data_dir.glob("*.json"):
+            os.utime(file_path, ns=(0, 0))
+        # One worker maps the file fresh, the other checks the touched files against the one it mapped
+        assert worker().snapshot().version_hash == builder.refresh().version_hash == first.version_hash
+
+    @pytest.mark.parametrize("if_none_match, matches", [('"a"', True), ('W/"a"', True), ('"b", "a"', True),
+                                                        ("*", True), ('"b"', False), ("", False)])
+    def test_if_none_match_uses_weak_comparison(self, if_none_match, matches):
+        assert http_cache.is_not_modified({"if-none-match": if_none_match}, '"a"', 0) is matches
+
+    def test_if_modified_since_is_ignored_with_if_none_match(self):
+        since = "Wed, 22 Jan 2025 00:00:00 GMT"
+        assert http_cache.is_not_modified({"if-modified-since": since}, '"a"', 1737504000)
+        assert not http_cache.is_not_modified({"if-modified-since": since}, '"a"', 1737504001)
+        assert not http_cache.is_not_modified({"if-modified-since": since, "if-none-match": '"b"'}, '"a"', 0)
+        assert not http_cache.is_not_modified({"if-modified-since": "yesterday"}, '"a"', 0)
+
+
+class TestEpisodes:
+
+    def test_responses_carry_validators(self, client):
+        response = client.get("/episodes")
+        assert response.headers["ETag"].startswith('"')
+        assert response.headers["Last-Modified"].endswith(" GMT")
+        assert response.headers["Cache-Control"] == http_cache.EPISODES_CACHE_CONTROL
+        assert "Accept" in response.headers["Vary"]
+
+    def test_matching_requests_are_not_modified(self, client):
+        etag = client.get("/episodes").headers["ETag"]
+        response = client.get("/episodes", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["ETag"] == etag
+        assert "Accept" in response.headers["Vary"]
+
+        last_modified = client.get("/episodes").headers["Last-Modified"]
+        assert client.get("/episodes", headers={"If-Modified-Since": last_modified}).status_code == 304
+
+    def test_formats_have_their_own_etag(self, client):
+        etag = client.get("/episodes").headers["ETag"]
+        ndjson = client.get("/episodes", headers={"Accept": "application/x-ndjson", "If-None-Match": etag})
+        assert ndjson.status_code == 200
+        assert ndjson.headers["ETag"] != etag
+
+    def test_corpus_changes_invalidate_the_etag(self, client, store, data_dir):
+        etag = client.get("/episodes").headers["ETag"]
+        path = write_feed(data_dir / "podcasts_hbr_test.json", [hbr_item(n) for n in range(4)], "HBR Test")
+        os.utime(path, ns=(path.stat().st_atime_ns, path.stat().st_mtime_ns + 10 ** 9))
+        store.refresh()
+        response = client.get("/episodes", headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+        assert response.headers["X-Total-Count"] == "6"
+
+
+class TestSearch:
+
+    def test_matching_requests_skip_the_search(self, client, fake_bedrock):
+        params = {"q": "board communications", "limit": 2}
+        response = client.get("/search", params=params)
+        assert response.headers["Cache-Control"] == http_cache.SEARCH_CACHE_CONTROL
+        reranker.query_cache.clear()
+        fake_bedrock.calls.clear()
+
+        not_modified = client.get("/search", params=params, headers={"If-None-Match": response.headers["ETag"]})
+        assert not_modified.status_code == 304
+        assert not_modified.headers["ETag"] == response.headers["ETag"]
+        assert fake_bedrock.calls == []
+
+    @pytest.mark.parametrize("module, setting, value", [
+        (reranker, "RETRIEVAL_MODE", "dense"), (reranker, "RERANK_CANDIDATES", 50),
+        (reranker, "RERANK_SKIP_CONFIDENCE", 0.5), (reranker, "RERANK_SHARD_SIZE", 10),
+        (fusion, "RANK_FUSION", "rrf"), (fusion, "FUSION_RERANK_WEIGHT", 0.5), (fusion, "RRF_K", 10)])
+    def test_ranking_configuration_is_part_of_the_etag(self, client, fake_bedrock, monkeypatch, module, setting,
+                                                       value):
+        params = {"q": "strategy"}
+        etag = client.get("/search", params=params).headers["ETag"]
+        monkeypatch.setattr(module, setting, value)
+        response = client.get("/search", params=params, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+    def test_degraded_results_are_not_cacheable(self, client, fake_bedrock, monkeypatch):
+        throttled = ClientError({"Error": {"Code": "ThrottlingException", "Message": "Too many requests"}}, "Rerank")
+        monkeypatch.setattr(fake_bedrock, "rerank", lambda **kwargs: (_ for _ in ()).throw(throttled))
+        reranker.query_cache.clear()
+        response = client.get("/search", params={"q": "board communications"})
+        assert response.headers["X-Search-Degraded"] == "rerank-unavailable"
+        assert response.headers["Cache-Control"] == "no-store"
+        assert "ETag" not in response.headers
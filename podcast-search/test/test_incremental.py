@@ -0,0 +1,156 @@
+import os
+import time
+
+import bm25
+import corpus
+import dense_index
+import incremental
+import utils
+import watcher
+from conftest import hbr_item, write_feed
+
+
+def touch(path):
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def episode(guid, title):
+    return {"title": title, "guid__text": guid}
+
+
+class TestFeedState:
+
+    def test_inserts_updates_and_deletes_are_diffed_by_guid(self):
+        state = incremental.FeedState(deduplicate=False)
+        loaded = list(state.ingest([("feed", [episode("a", "Alpha"), episode("b", "Beta"), episode("c", "Gamma")])]))
+        assert len(loaded) == 3
+
+        added, deleted = state.apply("feed", [episode("a", "Alpha"), episode("b", "Beta, updated"),
+                                              episode("d", "Delta")])
+        assert [(doc_id, e["title"]) for doc_id, e in added] == [(3, "Beta, updated"), (4, "Delta")]
+        assert deleted == {1, 2}
+
+        assert state.apply("feed", [episode("a", "Alpha"), episode("b", "Beta, updated"),
+                                    episode("d", "Delta")]) == ([], set())
+        assert state.apply("feed", []) == ([], {0, 3, 4})
+
+    def test_duplicates_are_deleted_with_their_last_feed(self):
+        state = incremental.FeedState(deduplicate=True)
+        item = {"title": "Managing Up", "enclosure__url": "https://a.example.com/1.mp3"}
+        assert len(list(state.ingest([("ideacast", [item]), ("leadership", [dict(item, guid__text="x")])]))) == 1
+        assert state.feeds == [["ideacast", "leadership"]]
+
+        assert state.apply("ideacast", []) == ([], set())
+        assert state.feeds == [["leadership"]]
+        assert state.apply("leadership", []) == ([], {0})
+
+    def test_updated_duplicates_are_not_merged_into_their_previous_version(self):
+        state = incremental.FeedState(deduplicate=True)
+        item = {"title": "Managing Up", "enclosure__url": "https://a.example.com/1.mp3", "guid__text": "x"}
+        list(state.ingest([("ideacast", [item]), ("leadership", [item])]))
+
+        updated = dict(item, description="Now with a transcript")
+        assert state.apply("ideacast", [updated]) == ([(1, updated)], set())
+        assert state.feeds == [["leadership"], ["ideacast"]]
+        assert state.apply("ideacast", [updated]) == ([], set())
+        # The feed still holding the previous version drops it
+        assert state.apply("leadership", [updated]) == ([], {0})
+        assert state.feeds[1] == ["ideacast", "leadership"]
+
+
+class TestIncrementalStore:
+
+    def make_store(self, data_dir, max_delta_fraction=1.0):
+        return corpus.CorpusStore(directory=str(data_dir), check_interval=0, snapshot_path=None,
+                                  max_delta_fraction=max_delta_fraction)
+
+    def test_only_changed_feeds_are_parsed(self, data_dir, monkeypatch):
+        store = self.make_store(data_dir)
+        first = store.snapshot()
+        parsed = []
+        read = utils.process_single_file
+        monkeypatch.setattr(utils, "process_single_file", lambda path: parsed.append(path.name) or read(path))
+
+        feed = data_dir / "podcasts_hbr_test.json"
+        write_feed(feed, [hbr_item(0), hbr_item(1, title="Renamed episode"), hbr_item(3)])
+        touch(feed)
+        second = store.snapshot()
+
+        assert parsed == ["podcasts_hbr_test.json"]
+        assert second.version > first.version
+        assert second.deleted == {1, 2}
+        titles = [utils.episode_text(e).split("\n")[0] for e in second.episodes]
+        assert titles[0] == "Episode 0 about strategy"
+        assert titles[3:] == ["Renamed episode", "Episode 3 about strategy"]
+        assert len(second.episodes) == len(first.episodes) == 5
+        assert first.documents is not second.documents and len(first.documents) == 5
+
+    def test_indexes_are_updated_instead_of_rebuilt(self, data_dir):
+        store = self.make_store(data_dir)
+        first = store.snapshot()
+        first_index = bm25.get_index(first)
+        dense_index.get_index(first)
+
+        feed = data_dir / "podcasts_hbr_test.json"
+        write_feed(feed, [hbr_item(0), hbr_item(1), hbr_item(3, title="Negotiating a raise")])
+        touch(feed)
+        second = store.snapshot()
+
+        index = bm25.get_index(second)
+        assert isinstance(index, bm25.LayeredBM25Index) and index.base is first_index
+        assert [second.documents[doc_id]["title"] for doc_id, _ in index.search("negotiating raise", 5)] == [
+            "Negotiating a raise"]
+        assert all(doc_id != 2 for doc_id, _ in index.search("episode strategy", 10))
+        assert index.num_docs == 5
+
+        dense = dense_index.get_index(second)
+        assert isinstance(dense, dense_index.LayeredDenseIndex)
+        assert dense.search("negotiating a raise", 1)[0][0] == 5
+        assert 2 not in {doc_id for doc_id, _ in dense.search("episode strategy", 10)}
+
+    def test_layered_scores_match_a_full_rebuild_for_inserts(self, data_dir):
+        store = self.make_store(data_dir)
+        bm25.get_index(store.snapshot())
+        feed = data_dir / "podcasts_hbr_test.json"
+        write_feed(feed, [hbr_item(n) for n in range(5)])
+        touch(feed)
+        snapshot = store.snapshot()
+
+        layered = bm25.get_index(snapshot)
+        rebuilt = bm25.BM25Index.from_episodes(snapshot.documents)
+        assert sorted(layered.scores("leadership strategy").values()) == sorted(
+            rebuilt.scores("leadership strategy").values())
+
+    def test_large_changes_trigger_a_full_reload(self, data_dir):
+        store = self.make_store(data_dir, max_delta_fraction=0.1)
+        store.snapshot()
+        feed = data_dir / "podcasts_hbr_test.json"
+        write_feed(feed, [hbr_item(n) for n in range(3, 6)])
+        touch(feed)
+        snapshot = store.snapshot()
+        assert not snapshot.deleted and len(snapshot.documents) == 5
+
+    def test_removed_feed_is_deleted(self, data_dir):
+        store = self.make_store(data_dir)
+        store.snapshot()
+        (data_dir / "podcasts_mckinsey.json").unlink()
+        snapshot = store.snapshot()
+        assert snapshot.deleted == {3, 4}
+        assert len(snapshot.episodes) == 3
+        assert bm25.get_index(snapshot).search("board communications", 5) == []
+
+    def test_watcher_applies_changes_in_the_background(self, data_dir):
+        store = self.make_store(data_dir)
+        first = store.snapshot()
+        directory_watcher = watcher.DirectoryWatcher(store, interval=0.01).start()
+        try:
+            feed = data_dir / "podcasts_hbr_test.json"
+            write_feed(feed, [hbr_item(n) for n in range(4)])
+            touch(feed)
+            deadline = time.monotonic() + 5
+            while store._snapshot is first and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            directory_watcher.stop()
+        assert len(store._snapshot.episodes) == 6
@@ -0,0 +1,54 @@
+import io
+import json
+
+import pytest
+
+import json_stream
+import utils
+
+PATH = ("rss", "channel", "item")
+
+
+def stream(document, chunk_size=json_stream.DEFAULT_CHUNK_SIZE):
+    return list(json_stream.iter_items(io.StringIO(document), PATH, chunk_size=chunk_size))
+
+
+class TestIterItems:
+
+    document = json.dumps({
+        "rss": {
+            "skipped": [1, {"tricky": "]}\\\"{["}],
+            "channel": {"title": "Feed", "item": [{"t": "a\\b"}, 2, 3.5e2, None, ["]"], True]},
+            "after": "ignored"
+        }
+    })
+
+    @pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 4096])
+    def test_items_match_full_parse_for_any_chunk_size(self, chunk_size):
+        expected = json.loads(self.document)["rss"]["channel"]["item"]
+        assert stream(self.document, chunk_size) == expected
+
+    def test_single_object_is_yielded_as_one_item(self):
+        assert stream('{"rss": {"channel": {"item": {"title": "Only"}}}}') == [{"title": "Only"}]
+
+    def test_missing_path_and_empty_array_yield_nothing(self):
+        assert stream('{"rss": {"channel": {"title": "No items"}}}') == []
+        assert stream('{"rss": {"channel": {"item": []}}}') == []
+
+    def test_truncated_document_raises(self):
+        with pytest.raises(ValueError):
+            stream('{"rss": {"channel": {"item": [{"title": "Cut', chunk_size=8)
+
+
+class TestStreamingIngest:
+
+    def test_streaming_matches_whole_file_parsing(self, data_dir):
+        whole = list(utils.read_podcasts_json_files(str(data_dir)))
+        streamed = list(utils.read_podcasts_json_files(str(data_dir), streaming=True))
+        assert streamed == whole
+
+    def test_malformed_file_is_logged_and_skipped(self, tmp_path, caplog):
+        broken = tmp_path / "podcasts_hbr_broken.json"
+        broken.write_text('{"rss": {"channel": {"item": [{"title": "Cut')
+        assert list(utils.iter_podcasts_json_file(broken)) == []
+        assert "Error processing" in caplog.text
@@ -0,0 +1,95 @@
+import threading
+
+import metrics
+import reranker
+
+
+class TestHistogram:
+
+    def test_renders_cumulative_buckets(self):
+        histogram = metrics.Histogram("latency_seconds", "Latency.", ["stage"], buckets=(0.1, 1.0))
+        histogram.observe(0.05, "rerank")
+        histogram.observe(0.5, "rerank")
+        histogram.observe(5.0, "rerank")
+        assert list(histogram.render()) == [
+            "# HELP latency_seconds Latency.",
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{stage="rerank",le="0.1"} 1',
+            'latency_seconds_bucket{stage="rerank",le="1"} 2',
+            'latency_seconds_bucket{stage="rerank",le="+Inf"} 3',
+            'latency_seconds_sum{stage="rerank"} 5.55',
+            'latency_seconds_count{stage="rerank"} 3',
+        ]
+
+    def test_concurrent_observations_are_all_counted(self):
+        histogram = metrics.Histogram("latency_seconds", "Latency.")
+
+        def observe():
+            for _ in range(1000):
+                histogram.observe(0.01)
+
+        threads = [threading.Thread(target=observe) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert histogram.count() == 8000
+
+
+class TestCounter:
+
+    def test_renders_labels_escaped(self):
+        counter = metrics.Counter("requests_total", "Requests.", ["status"])
+        counter.inc(1, "200")
+        counter.inc(2, 'a"b')
+        assert list(counter.render())[2:] == ['requests_total{status="200"} 1', 'requests_total{status="a\\"b"} 2']
+
+
+class TestStage:
+
+    def test_stages_add_up_within_a_request(self):
+        token = metrics.start_request()
+        with metrics.stage("retrieve"):
+            pass
+        with metrics.stage("retrieve"):
+            pass
+        timings = metrics.finish_request(token)
+        assert list(timings) == ["retrieve"]
+        assert timings["retrieve"] >= 0
+
+    def test_stages_outside_a_request_only_update_the_histogram(self):
+        before = metrics.STAGE_SECONDS.count("test")
+        with metrics.stage("test"):
+            pass
+        assert metrics.STAGE_SECONDS.count("test") == before + 1
+
+    def test_server_timing_header(self):
+        assert metrics.server_timing({"retrieve": 0.0012, "rerank": 0.25}) == "retrieve;dur=1.20, rerank;dur=250.00"
+
+
+class TestEndpoints:
+
+    def test_search_reports_server_timing(self, client, fake_bedrock):
+        reranker.query_cache.clear()
+        response = client.get("/search", params={"q": "board communications", "limit": 2})
+        assert response.status_code == 200
+        stages = [entry.split(";")[0] for entry in response.headers["Server-Timing"].split(", ")]
+        assert stages == ["corpus", "retrieve", "prepare", "rerank", "sort", "serialize", "total"]
+
+    def test_metrics_counts_cache_hits_and_rerank_payload(self, client, fake_bedrock):
+        reranker.query_cache.clear()
+        hits = metrics.QUERY_CACHE_REQUESTS.value("hit")
+        candidates = metrics.RERANK_CANDIDATES.value()
+        payload = metrics.RERANK_BYTES.value()
+        for _ in range(2):
+            client.get("/search", params={"q": "board communications", "limit": 2})
+        assert metrics.QUERY_CACHE_REQUESTS.value("hit") == hits + 1
+        assert metrics.RERANK_CANDIDATES.value() == candidates + len(fake_bedrock.calls[0]["sources"])
+        assert metrics.RERANK_BYTES.value() > payload
+
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+        assert 'podcast_search_query_cache_requests_total{result="hit"}' in response.text
+        assert 'podcast_search_stage_seconds_bucket{stage="rerank",le="+Inf"}' in response.text
+        assert 'podcast_search_requests_total{status="200"}' in response.text
@@ -0,0 +1,47 @@
+import json
+from pathlib import Path
+
+import utils
+from conftest import hbr_item, mckinsey_item, write_feed
+
+DATA_DIRECTORY = Path(__file__).parent.parent / "data"
+
+
+class TestSplitFeedFile:
+
+    def test_chunks_cover_the_item_array(self, tmp_path):
+        path = write_feed(tmp_path / "podcasts_hbr_test.json", [hbr_item(n) for n in range(20)])
+        bracket, chunks = utils.split_feed_file(path, chunk_bytes=1000)
+        data = path.read_bytes()
+        assert data[bracket:bracket + 1] == b"["
+        assert len(chunks) > 2
+        assert chunks[0][0] == bracket + 1 and chunks[-1][1] == len(data)
+        for start, stop in chunks[:-1]:
+            assert data[start:start + 1] == b"{" and data[stop - 1:stop] == b"}"
+
+    def test_small_files_are_not_split(self, tmp_path):
+        path = write_feed(tmp_path / "podcasts_hbr_test.json", [hbr_item(0)])
+        assert utils.split_feed_file(path, chunk_bytes=1 << 20) is None
+
+
+class TestProcessPoolIngest:
+
+    def test_matches_thread_pool_ingest_on_bundled_data(self):
+        threads = list(utils.read_podcasts_json_files(str(DATA_DIRECTORY)))
+        processes = list(utils.read_podcasts_json_files(str(DATA_DIRECTORY), workers=2, chunk_bytes=64 * 1024))
+        assert json.dumps(processes) == json.dumps(threads)
+
+    def test_wrong_chunk_boundaries_fall_back_to_whole_file_parsing(self, tmp_path, caplog):
+        # Nested objects starting with the first key of an item look like item boundaries
+        items = [dict(hbr_item(n), chapters=[{"title": f"Part {i}"} for i in range(50)]) for n in range(10)]
+        write_feed(tmp_path / "podcasts_hbr_test.json", items)
+        write_feed(tmp_path / "podcasts_mckinsey.json", [mckinsey_item(n) for n in range(10)])
+        threads = list(utils.read_podcasts_json_files(str(tmp_path)))
+        processes = list(utils.read_podcasts_json_files(str(tmp_path), workers=2, chunk_bytes=500))
+        assert processes == threads
+        assert "parsing it whole" in caplog.text
+
+    def test_malformed_files_are_skipped(self, tmp_path):
+        feed = json.dumps({"rss": {"channel": {"item": [hbr_item(n) for n in range(10)]}}})
+        (tmp_path / "podcasts_hbr_broken.json").write_text(feed[:-1] + ', "extra": }')
+        assert list(utils.read_podcasts_json_files(str(tmp_path), workers=1, chunk_bytes=500)) == []
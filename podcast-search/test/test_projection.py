@@ -0,0 +1,58 @@
+import projection
+import reranker
+
+EPISODE = {
+    "title": "Managing Up",
+    "itunes:title_1": "Managing Up",
+    "description": "How to work with your boss. " * 40,
+    "encoded": "How to work with your boss. " * 40,
+    "enclosure__url": "https://example.com/episode.mp3",
+    "link": "https://example.com/episode",
+    "itunes:duration": "1800",
+}
+
+
+class TestRerankProjection:
+
+    def test_only_allowlisted_text_fields_are_kept(self):
+        document = projection.RerankProjection({"title": 100, "description": 100}, 1024).project(EPISODE)
+        assert list(document) == ["title", "description"]
+        assert not any("https://" in value for value in document.values())
+
+    def test_fields_are_cut_to_their_budget_at_a_word_boundary(self):
+        document = projection.RerankProjection({"description": 50}, 1024).project(EPISODE)
+        cut = document["description"]
+        assert len(cut) <= 50
+        assert EPISODE["description"].startswith(cut) and EPISODE["description"][len(cut)] == " "
+
+    def test_document_is_cut_to_the_token_budget(self):
+        document = projection.RerankProjection({"title": 300, "description": 5000}, 10).project(EPISODE)
+        assert sum(map(len, document.values())) <= 10 * projection.CHARS_PER_TOKEN
+
+    def test_repeated_values_are_sent_once(self):
+        document = projection.RerankProjection({"description": 5000, "content": 5000}, 4096).project(EPISODE)
+        assert list(document) == ["description"]
+
+    def test_parse_field_budgets(self):
+        assert projection.parse_field_budgets("title:10, content:20") == {"title": 10, "content": 20}
+
+
+class TestRerankDocuments:
+
+    def test_projected_documents_are_smaller(self, store):
+        snapshot = store.load()
+        documents = projection.get_documents(snapshot)
+        assert documents is projection.get_documents(snapshot)
+        assert all(size < full for size, full in zip(documents.sizes, documents.full_sizes))
+
+        stats = projection.PayloadStats()
+        stats.record(documents, [0, 1])
+        summary = stats.summary()
+        assert summary["requests"] == 1
+        assert 0 < summary["avg_bytes_per_request"] < summary["avg_full_bytes_per_request"]
+
+    def test_reranker_sends_projected_documents(self, store, fake_bedrock):
+        reranker.rerank_podcasts("board communications", 5)
+        allowed = set(projection.projection.field_budgets)
+        for source in fake_bedrock.calls[0]["sources"]:
+            assert set(source["inlineDocumentSource"]["jsonDocument"]) <= allowed
@@ -0,0 +1,188 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import reranker
+from circuit_breaker import CircuitBreaker
+
+
+class TestRerankPodcasts:
+
+    def test_only_lexical_hits_are_sent_to_rerank(self, store, fake_bedrock):
+        results = reranker.rerank_podcasts("board communications", 5)
+
+        sources = fake_bedrock.calls[0]["sources"]
+        assert len(sources) == 2
+        assert all(s["inlineDocumentSource"]["jsonDocument"]["title"] for s in sources)
+        assert [r["guid__text"] for r in results] == ["mckinsey-1", "mckinsey-0"]
+
+    def test_number_of_results_is_capped_by_candidates(self, store, fake_bedrock):
+        reranker.rerank_podcasts("board communications", 50)
+        config = fake_bedrock.calls[0]["config"]["bedrockRerankingConfiguration"]
+        assert config["numberOfResults"] == 2
+
+    def test_no_lexical_hits_skips_rerank(self, store, fake_bedrock):
+        assert reranker.rerank_podcasts("quantum", 5) == []
+        assert fake_bedrock.calls == []
+
+    def test_repeated_query_is_served_from_cache(self, store, fake_bedrock):
+        first = reranker.rerank_podcasts("Board communications", 5)
+        second = reranker.rerank_podcasts("  board   COMMUNICATIONS", 5)
+        assert second == first
+        assert len(fake_bedrock.calls) == 1
+
+        reranker.rerank_podcasts("board communications", 1)
+        assert len(fake_bedrock.calls) == 2
+
+    def test_corpus_reload_invalidates_cache(self, store, fake_bedrock):
+        reranker.rerank_podcasts("board communications", 5)
+        store.load()
+        reranker.rerank_podcasts("board communications", 5)
+        assert len(fake_bedrock.calls) == 2
+
+    def test_identical_concurrent_requests_share_one_rerank_call(self, store, fake_bedrock, monkeypatch):
+        rerank = fake_bedrock.rerank
+
+        def slow_rerank(**kwargs):
+            time.sleep(0.2)
+            return rerank(**kwargs)
+
+        monkeypatch.setattr(fake_bedrock, "rerank", slow_rerank)
+        barrier = threading.Barrier(6)
+
+        def search():
+            barrier.wait()
+            return reranker.rerank_podcasts("board communications", 5)
+
+        with ThreadPoolExecutor(6) as executor:
+            results = [f.result() for f in [executor.submit(search) for _ in range(6)]]
+        assert len(fake_bedrock.calls) == 1
+        assert all(r == results[0] for r in results)
+
+
+class TestRerankPodcastsAsync:
+
+    def test_returns_same_results_as_sync_path(self, store, fake_bedrock):
+        results = asyncio.run(reranker.rerank_podcasts_async("board communications", 5))
+        assert results == reranker.rerank_podcasts("board communications", 5)
+
+    def test_event_loop_keeps_running_during_rerank(self, store, fake_bedrock, monkeypatch):
+        rerank = fake_bedrock.rerank
+
+        def slow_rerank(**kwargs):
+            time.sleep(0.3)
+            return rerank(**kwargs)
+
+        monkeypatch.setattr(fake_bedrock, "rerank", slow_rerank)
+
+        async def main():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            task = asyncio.create_task(ticker())
+            await reranker.rerank_podcasts_async("board communications", 5)
+            task.cancel()
+            return ticks
+
+        assert asyncio.run(main()) > 10
+
+    def test_timeout_is_raised(self, store, fake_bedrock, monkeypatch):
+        monkeypatch.setattr(fake_bedrock, "rerank", lambda **kwargs: time.sleep(0.5))
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(reranker.rerank_podcasts_async("board communications", 5, timeout=0.05))
+
+    @pytest.mark.parametrize("error", [asyncio.TimeoutError(), concurrent.futures.TimeoutError()])
+    def test_timeouts_are_transient(self, error):
+        assert reranker.is_transient_error(error)
+
+
+class ScoringBedrock:
+    """Fake client scoring each source by the number in its title, failing on titles listed in `fail_on`."""
+
+    def __init__(self, fail_on=()):
+        self.fail_on = set(fail_on)
+        self.shard_sizes = []
+
+    def rerank(self, queries, sources, rerankingConfiguration):
+        self.shard_sizes.append(len(sources))
+        scores = [int(s["inlineDocumentSource"]["jsonDocument"]["title"]) for s in sources]
+        if self.fail_on & set(scores):
+            raise RuntimeError("throttled")
+        num_results = rerankingConfiguration["bedrockRerankingConfiguration"]["numberOfResults"]
+        ranked = sorted(range(len(sources)), key=lambda i: -scores[i])[:num_results]
+        return {"results": [{"index": i, "relevanceScore": scores[i] / 100} for i in ranked]}
+
+
+class TestShardedRerank:
+
+    scores = [5, 42, 17, 8, 99, 23, 61, 3, 77, 12]
+
+    def sources(self):
+        return reranker.prepare_text_sources([{"title": str(score)} for score in self.scores])
+
+    def test_shards_are_merged_into_a_global_top_k(self, monkeypatch):
+        client = ScoringBedrock()
+        monkeypatch.setattr(reranker, "bedrock_agent_runtime", client)
+        monkeypatch.setattr(reranker, "RERANK_SHARD_SIZE", 3)
+
+        results, partial = reranker.rerank_sources("q", self.sources(), 4)
+        assert not partial
+        assert sorted(client.shard_sizes) == [1, 3, 3, 3]
+        assert [self.scores[r["index"]] for r in results] == [99, 77, 61, 42]
+        ranked = reranker.sort_podcasts_by_rerank(self.scores, results)
+        assert ranked == [99, 77, 61, 42]
+
+    def test_failed_shards_are_skipped(self, monkeypatch):
+        monkeypatch.setattr(reranker, "bedrock_agent_runtime", ScoringBedrock(fail_on={99}))
+        monkeypatch.setattr(reranker, "RERANK_SHARD_SIZE", 3)
+
+        results, partial = reranker.rerank_sources("q", self.sources(), 4)
+        assert partial
+        assert [self.scores[r["index"]] for r in results] == [77, 61, 42, 17]
+
+    def test_partial_results_are_degraded_and_not_cached(self, client, fake_bedrock, monkeypatch):
+        rerank = fake_bedrock.rerank
+
+        def fail_on_first_episode(**kwargs):
+            if any(s["inlineDocumentSource"]["jsonDocument"]["title"] == "Episode 0 about strategy"
+                   for s in kwargs["sources"]):
+                raise RuntimeError("throttled")
+            return rerank(**kwargs)
+
+        monkeypatch.setattr(fake_bedrock, "rerank", fail_on_first_episode)
+        monkeypatch.setattr(reranker, "RERANK_SHARD_SIZE", 2)
+        reranker.query_cache.clear()
+        response = client.get("/search", params={"q": "episode strategy board"})
+        assert response.headers["X-Search-Degraded"] == "rerank-unavailable"
+        assert response.headers["Cache-Control"] == "no-store"
+        assert "ETag" not in response.headers
+        assert len(response.json()["results"]) == 3
+        assert len(reranker.query_cache) == 0
+
+    def test_half_open_breaker_admits_every_shard_of_a_search(self, client, fake_bedrock, monkeypatch):
+        breaker = CircuitBreaker("test", min_calls=1, open_seconds=0, half_open_probes=1)
+        breaker.allow()
+        breaker.record(False, 0.1)
+        monkeypatch.setattr(reranker, "rerank_breaker", breaker)
+        monkeypatch.setattr(reranker, "RERANK_SHARD_SIZE", 2)
+        reranker.query_cache.clear()
+        response = client.get("/search", params={"q": "episode strategy board"})
+        assert "X-Search-Degraded" not in response.headers
+        assert len(fake_bedrock.calls) == 3
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_error_is_raised_when_every_shard_fails(self, monkeypatch):
+        monkeypatch.setattr(reranker, "bedrock_agent_runtime", ScoringBedrock(fail_on=self.scores))
+        monkeypatch.setattr(reranker, "RERANK_SHARD_SIZE", 3)
+
+        with pytest.raises(RuntimeError):
+            reranker.rerank_sources("q", self.sources(), 4)
@@ -0,0 +1,128 @@
+import io
+import json
+import tracemalloc
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+import pytest
+
+import corpus
+import rss_stream
+import utils
+
+API_DIR = Path(__file__).parent.parent / "api"
+DATA_DIR = Path(__file__).parent.parent / "data"
+
+FEED = b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd" xmlns:media="http://search.yahoo.com/mrss/"
+     xmlns:content="http://purl.org/rss/1.0/modules/content/" version="2.0">
+<channel>
+<title>Inside the Strategy Room</title>
+<item>
+<title>1. Boards &amp; CEOs </title>
+<itunes:title>1. Boards &amp; CEOs</itunes:title>
+<description><![CDATA[<p>Boards &amp; <b>CEOs</b> & more</p>]]></description>
+<itunes:image href="https://example.com/1.jpg?t=1&size=Large"/>
+<media:content url="https://example.com/1.mp3" type="audio/mpeg">
+<media:player url="https://omny.fm/1/embed"/>
+</media:content>
+<guid isPermaLink="false">episode-1</guid>
+<pubDate>Mon, 13 Jan 2025 15:00:00 +0000</pubDate>
+<itunes:duration>1800</itunes:duration>
+</item>
+<item>
+<title>2. Strategy</title>
+<itunes:author>McKinsey & Company</itunes:author>
+</item>
+</channel>
+</rss>
+"""
+
+
+def stream(document, chunk_size=rss_stream.DEFAULT_CHUNK_SIZE):
+    return list(rss_stream.iter_items(io.BytesIO(document), chunk_size=chunk_size))
+
+
+class TestIterItems:
+
+    def test_items_take_the_json_shape_of_the_data_files(self):
+        first, second = stream(FEED)
+        assert first == {
+            "title": ["1. Boards & CEOs", {"__prefix": "itunes", "__text": "1. Boards & CEOs"}],
+            "description": {"__cdata": "<p>Boards &amp; <b>CEOs</b> & more</p>"},
+            "image": {"_href": "https://example.com/1.jpg?t=1&size=Large", "__prefix": "itunes"},
+            "content": {"player": {"_url": "https://omny.fm/1/embed", "__prefix": "media"},
+                        "_url": "https://example.com/1.mp3", "_type": "audio/mpeg", "__prefix": "media"},
+            "guid": {"_isPermaLink": "false", "__text": "episode-1"},
+            "pubDate": "Mon, 13 Jan 2025 15:00:00 +0000",
+            "duration": {"__prefix": "itunes", "__text": "1800"},
+        }
+        assert second == {"title": "2. Strategy", "author": {"__prefix": "itunes", "__text": "McKinsey & Company"}}
+
+    @pytest.mark.parametrize("chunk_size", [1, 7, 33, 4096])
+    def test_items_do_not_depend_on_chunk_size(self, chunk_size):
+        assert stream(FEED, chunk_size) == stream(FEED)
+
+    def test_text_before_the_root_element_is_skipped(self):
+        assert stream(b"This XML file does not appear to have any style information.\n" + FEED) == stream(FEED)
+
+    def test_missing_path_yields_nothing(self):
+        assert stream(b"<rss><channel><title>No items</title></channel></rss>") == []
+
+    def test_truncated_document_raises(self):
+        with pytest.raises(ET.ParseError):
+            stream(FEED[:400])
+
+    def test_memory_stays_bounded_by_the_largest_item(self):
+        item = b"<item><title>Episode</title><description>" + b"x" * 1000 + b"</description></item>"
+        document = b"<rss><channel>" + item * 5000 + b"</channel></rss>"
+        tracemalloc.start()
+        try:
+            count = sum(1 for _ in rss_stream.iter_items(io.BytesIO(document)))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert count == 5000
+        assert peak < len(document) / 5
+
+
+class TestRssIngest:
+
+    def test_bundled_feed_matches_its_json_conversion(self):
+        def normalize(episode):
+            # The bundled RSS was saved from a browser, which collapsed runs of spaces and non-breaking spaces
+            return {key: " ".join(value.split()) if isinstance(value, str) else value
+                    for key, value in episode.items()}
+
+        episodes = list(utils.iter_podcasts_xml_file(API_DIR / "rss.xml"))
+        converted = json.loads((DATA_DIR / "podcasts_mckinsey.json").read_text())["rss"]["channel"]["item"]
+        assert len(episodes) == len(converted) == 235
+        assert [normalize(e) for e in episodes] == [normalize(utils.flatten_json(item)) for item in converted]
+
+    def test_rss_files_are_read_with_json_files(self, data_dir):
+        (data_dir / "podcasts_rss.xml").write_bytes(FEED)
+        store = corpus.CorpusStore(directory=str(data_dir), pattern="podcasts_*", snapshot_path=None)
+        snapshot = store.snapshot()
+        assert len(snapshot.documents) == 7
+        assert {"title": "2. Strategy", "author__itunes": "McKinsey & Company"} in [
+            dict(document) for document in snapshot.documents]
+
+    def test_default_store_serves_rss_feeds(self, client, store, data_dir):
+        (data_dir / "podcasts_rss.xml").write_bytes(FEED)
+        (data_dir / "notes.txt").write_text("not a feed")
+        store.refresh()
+        response = client.get("/episodes")
+        assert response.headers["X-Total-Count"] == "7"
+        assert {"title": "2. Strategy", "author__itunes": "McKinsey & Company"} in response.json()["episodes"]
+
+    @pytest.mark.parametrize("streaming, workers", [(True, 0), (False, 1)])
+    def test_every_ingest_path_reads_rss_files(self, tmp_path, streaming, workers):
+        (tmp_path / "podcasts_rss.xml").write_bytes(FEED)
+        feeds = utils.read_podcast_feeds(str(tmp_path), "*.xml", streaming=streaming, workers=workers)
+        assert [(name, len(list(episodes))) for name, episodes in feeds] == [("podcasts_rss", 2)]
+
+    def test_malformed_file_is_logged_and_skipped(self, tmp_path, caplog):
+        broken = tmp_path / "podcasts_broken.xml"
+        broken.write_bytes(FEED[:400])
+        assert list(utils.process_single_file(broken)) == []
+        assert "Error processing" in caplog.text
@@ -0,0 +1,73 @@
+import concurrent.futures
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+class TestSingleFlight:
+
+    def _run_concurrently(self, group, fn, callers, timeout=None):
+        started = threading.Barrier(callers)
+
+        def call():
+            started.wait()
+            return group.do("key", fn, timeout=timeout)
+
+        with ThreadPoolExecutor(callers) as executor:
+            futures = [executor.submit(call) for _ in range(callers)]
+        return futures
+
+    def test_concurrent_calls_share_one_execution(self):
+        group = SingleFlight()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.2)
+            return ["result"]
+
+        futures = self._run_concurrently(group, slow, 8)
+        assert [f.result() for f in futures] == [["result"]] * 8
+        assert len(calls) == 1
+        assert group.executions == 1
+        assert group.shared == 7
+        assert group.in_flight() == 0
+
+    def test_exception_is_propagated_to_every_waiter(self):
+        group = SingleFlight()
+
+        def failing():
+            time.sleep(0.2)
+            raise RuntimeError("throttled")
+
+        futures = self._run_concurrently(group, failing, 4)
+        for future in futures:
+            with pytest.raises(RuntimeError, match="throttled"):
+                future.result()
+        assert group.executions == 1
+
+    def test_waiter_timeout_does_not_interrupt_leader(self):
+        group = SingleFlight()
+        release = threading.Event()
+
+        def blocked():
+            release.wait(5)
+            return "done"
+
+        with ThreadPoolExecutor(1) as executor:
+            leader = executor.submit(group.do, "key", blocked)
+            while group.in_flight() == 0:
+                time.sleep(0.01)
+            with pytest.raises(concurrent.futures.TimeoutError):
+                group.do("key", blocked, timeout=0.05)
+            release.set()
+            assert leader.result() == "done"
+
+    def test_completed_calls_are_not_reused(self):
+        group = SingleFlight()
+        assert group.do("key", lambda: 1) == 1
+        assert group.do("key", lambda: 2) == 2
@@ -0,0 +1,140 @@
+import os
+from datetime import date
+
+import numpy as np
+
+import bm25
+import corpus
+import episode_store
+import facets
+import projection
+import snapshot_file
+import utils
+from conftest import hbr_item, write_feed
+
+
+def build_snapshot(data_dir, path):
+    return snapshot_file.build(str(data_dir), output=path)
+
+
+class TestSnapshotFile:
+
+    def test_store_maps_fresh_snapshot(self, data_dir, tmp_path, monkeypatch):
+        path = build_snapshot(data_dir, tmp_path / "corpus.snapshot")
+        raw = list(utils.read_podcasts_json_files(str(data_dir)))
+        monkeypatch.setattr(utils, "read_podcast_feeds",
+                            lambda *args, **kwargs: (_ for _ in ()).throw(AssertionError("raw files parsed")))
+
+        snapshot = corpus.CorpusStore(directory=str(data_dir), snapshot_path=path).snapshot()
+        assert isinstance(snapshot.episodes, snapshot_file.MappedEpisodes)
+        assert list(snapshot.episodes) == raw
+        assert list(snapshot.feeds) == [["podcasts_hbr_test"]] * 3 + [["podcasts_mckinsey"]] * 2
+
+        index = bm25.get_index(snapshot)
+        assert isinstance(index.doc_ids, memoryview)
+        assert index.search("board communications", 5) == bm25.BM25Index.from_episodes(raw).search(
+            "board communications", 5)
+
+    def test_dense_matrix_is_stored(self, data_dir, tmp_path):
+        mapped = snapshot_file.SnapshotFile(build_snapshot(data_dir, tmp_path / "corpus.snapshot"))
+        dense = mapped.derived()["dense"]
+        assert dense.matrix.dtype == np.float32
+        assert dense.matrix.shape[0] == 5
+
+    def test_touched_but_unchanged_files_keep_snapshot_fresh(self, data_dir, tmp_path):
+        path = build_snapshot(data_dir, tmp_path / "corpus.snapshot")
+        for file_path in data_dir.glob("*.json"):
+            os.utime(file_path, ns=(0, 0))
+        files = utils.list_podcast_files(str(data_dir))
+        assert snapshot_file.load_if_fresh(path, files) is not None
+
+    def test_changed_files_fall_back_to_raw_parsing(self, data_dir, tmp_path):
+        path = build_snapshot(data_dir, tmp_path / "corpus.snapshot")
+        write_feed(data_dir / "podcasts_hbr_test.json", [hbr_item(n) for n in range(7)])
+
+        files = utils.list_podcast_files(str(data_dir))
+        assert snapshot_file.load_if_fresh(path, files) is None
+        snapshot = corpus.CorpusStore(directory=str(data_dir), snapshot_path=path).snapshot()
+        assert len(snapshot.episodes) == 9
+
+    def test_corrupt_snapshot_is_ignored(self, data_dir, tmp_path):
+        path = tmp_path / "corpus.snapshot"
+        path.write_bytes(b"not a snapshot")
+        assert snapshot_file.load_if_fresh(path, utils.list_podcast_files(str(data_dir))) is None
+
+
+def shared_store(data_dir, path):
+    return corpus.CorpusStore(directory=str(data_dir), snapshot_path=path, shared=True, check_interval=0)
+
+
+def forbid_parsing(monkeypatch):
+    monkeypatch.setattr(utils, "read_podcast_feeds",
+                        lambda *args, **kwargs: (_ for _ in ()).throw(AssertionError("raw files parsed")))
+
+
+class TestSharedCorpus:
+
+    def test_first_worker_builds_the_snapshot_and_others_map_it(self, data_dir, tmp_path, monkeypatch):
+        path = tmp_path / "corpus.snapshot"
+        first = shared_store(data_dir, path).snapshot()
+        forbid_parsing(monkeypatch)
+        second = shared_store(data_dir, path).snapshot()
+        assert isinstance(second.episodes, snapshot_file.MappedEpisodes)
+        assert list(second.episodes) == list(first.episodes)
+        assert len(second.episodes) == 5
+
+    def test_new_snapshots_are_swapped_in_atomically(self, data_dir, tmp_path, monkeypatch):
+        path = tmp_path / "corpus.snapshot"
+        builder, reader = shared_store(data_dir, path), shared_store(data_dir, path)
+        old = reader.snapshot()
+        old_titles = [episode["title"] for episode in old.episodes]
+
+        write_feed(data_dir / "podcasts_hbr_test.json", [hbr_item(n) for n in range(7)])
+        assert len(builder.refresh().episodes) == 9
+        forbid_parsing(monkeypatch)
+        new = reader.refresh()
+        assert new.version != old.version
+        assert len(new.episodes) == 9
+        # Requests still holding the previous snapshot keep reading the replaced file
+        assert [episode["title"] for episode in old.episodes] == old_titles
+
+    def test_workers_keep_serving_while_another_rebuilds(self, data_dir, tmp_path, monkeypatch):
+        path = tmp_path / "corpus.snapshot"
+        store = shared_store(data_dir, path)
+        current = store.snapshot()
+        write_feed(data_dir / "podcasts_hbr_test.json", [hbr_item(n) for n in range(7)])
+        forbid_parsing(monkeypatch)
+        with snapshot_file.build_lock(path) as acquired:
+            assert acquired
+            assert store.refresh() is current
+
+    def test_touched_data_files_do_not_publish_a_new_version(self, data_dir, tmp_path):
+        path = tmp_path / "corpus.snapshot"
+        store = shared_store(data_dir, path)
+        current = store.snapshot()
+        for file_path in data_dir.glob("*.json"):
+            os.utime(file_path, ns=(0, 0))
+        assert store.refresh() is current
+        assert store.refresh() is current
+
+    def test_derived_structures_are_mapped_from_the_snapshot(self, data_dir, tmp_path):
+        snapshot = shared_store(data_dir, tmp_path / "corpus.snapshot").snapshot()
+        heap = corpus.CorpusStore(directory=str(data_dir), snapshot_path=None).snapshot()
+        shows = facets.get_show_index(snapshot)
+        # Arrays over the read-only mapping, not copies
+        assert not any(ids.flags.writeable for ids in shows.doc_ids.values())
+        assert shows.shows == facets.get_show_index(heap).shows
+        assert not facets.get_index(snapshot).published.values.flags.writeable
+        for facet_filter in (facets.FacetFilter(["mckinsey"]), facets.FacetFilter(min_duration=1600),
+                             facets.FacetFilter(published_after=date(2025, 1, 20))):
+            assert facet_filter.mask(snapshot).tolist() == facet_filter.mask(heap).tolist()
+
+        documents = projection.get_documents(snapshot)
+        assert isinstance(documents, snapshot_file.MappedRerankDocuments)
+        expected = projection.get_documents(heap)
+        assert [(documents[i], documents.size(i), documents.full_size(i)) for i in range(5)] == [
+            (expected[i], expected.size(i), expected.full_size(i)) for i in range(5)]
+
+        encoded = episode_store.get_encoded(snapshot)
+        assert encoded._encoded is None
+        assert [bytes(encoded[i]) for i in range(5)] == [episode_store.get_encoded(heap)[i] for i in range(5)]